@@ -0,0 +1,540 @@
+#!/usr/bin/env python3
+"""Catalog of the backup snapshots, kept on the backup device.
+
+Backup_Orchestrator.py records each snapshot here when it promotes it, so
+restores and retention no longer need find over millions of hard links.
+
+Every stored file is an object, identified by its inode plus a fingerprint of
+size and mtime (inode numbers are reused once a file is gone). Each path has
+versions: the object it pointed to and the run of snapshots that held it
+(first_seq .. last_seq; last_seq is NULL while the latest snapshot still
+holds it). A snapshot is recorded from the backup's change list when it was
+built from the previous one, so only the changed paths are stat'ed. Full
+backups, and anything recorded out of turn, walk the new snapshot once.
+
+Commands (ROOT is the backup destination holding snapshots/ and latest):
+	record NAME [--base PREV --changes FILE]   catalog a newly promoted snapshot
+	sync                                       catch up with snapshots/ on disk
+	which PATH [--at DATE]                     snapshots holding PATH and where it changed
+	search GLOB                                catalogued paths matching GLOB
+	report                                     size of each snapshot and the space only it uses
+	prune [NAME ...] [--older-than-days N]     delete snapshots, several trees in parallel
+
+Example:
+	python3 Snapshot_Catalog.py --root /mnt/backup which user_1/Documents/tax.pdf
+	python3 Snapshot_Catalog.py --root /mnt/backup prune --older-than-days 56 --dry-run
+"""
+import os
+import re
+import sys
+import time
+import shutil
+import sqlite3
+import logging
+import subprocess
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# ------------------ Configuration Constants ------------------
+CATALOG_NAME: str = "snapshot_catalog.db"   # Kept in ROOT next to snapshots/
+PRUNE_WORKERS: int = 4                      # Subtrees deleted at once
+WALK_BATCH: int = 5000                      # Rows per executemany while walking
+PRUNING_PREFIX: str = ".pruning-"           # Snapshots being deleted are renamed to this first
+SNAPSHOT_TIME = re.compile(r"(\d{4}-\d{2}-\d{2})_(\d{2})-(\d{2})-(\d{2})")
+
+logger = logging.getLogger("catalog")
+
+def setup_logging(debug: bool) -> None:
+	handler = logging.StreamHandler(sys.stderr)
+	handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", "%Y-%m-%d %H:%M:%S"))
+	logger.addHandler(handler)
+	logger.setLevel(logging.DEBUG if debug else logging.INFO)
+
+class CatalogError(Exception):
+	pass
+
+# ------------------ Database ------------------
+def open_catalog(path: str) -> sqlite3.Connection:
+	conn = sqlite3.connect(path, timeout=60)
+	conn.execute("PRAGMA journal_mode=WAL")
+	conn.executescript(
+		"""
+		CREATE TABLE IF NOT EXISTS snapshots (
+			seq INTEGER PRIMARY KEY,
+			name TEXT NOT NULL UNIQUE,
+			created_at REAL NOT NULL,
+			recorded_at REAL NOT NULL,
+			mode TEXT NOT NULL                  -- 'changes' or 'walk'
+		);
+		CREATE TABLE IF NOT EXISTS paths (
+			id INTEGER PRIMARY KEY,
+			path TEXT NOT NULL UNIQUE
+		);
+		CREATE TABLE IF NOT EXISTS objects (
+			id INTEGER PRIMARY KEY,
+			ino INTEGER NOT NULL,
+			size INTEGER NOT NULL,
+			mtime_ns INTEGER NOT NULL,
+			blocks INTEGER NOT NULL,            -- st_blocks, 512-byte units
+			UNIQUE (ino, size, mtime_ns)
+		);
+		CREATE TABLE IF NOT EXISTS versions (
+			path_id INTEGER NOT NULL,
+			object_id INTEGER NOT NULL,
+			first_seq INTEGER NOT NULL,
+			last_seq INTEGER,                   -- NULL: still in the latest snapshot
+			PRIMARY KEY (path_id, first_seq)
+		) WITHOUT ROWID;
+		CREATE INDEX IF NOT EXISTS idx_versions_object ON versions(object_id);
+		CREATE INDEX IF NOT EXISTS idx_versions_open ON versions(path_id) WHERE last_seq IS NULL;
+		CREATE TEMP TABLE IF NOT EXISTS seen (
+			path TEXT PRIMARY KEY,
+			ino INTEGER NOT NULL,
+			size INTEGER NOT NULL,
+			mtime_ns INTEGER NOT NULL,
+			blocks INTEGER NOT NULL
+		) WITHOUT ROWID;
+		"""
+	)
+	return conn
+
+def snapshot_list(conn: sqlite3.Connection) -> List[Tuple[int, str, float]]:
+	return conn.execute("SELECT seq, name, created_at FROM snapshots ORDER BY seq").fetchall()
+
+def snapshot_created(root: str, name: str) -> float:
+	"""Creation time from a Backup_YYYY-MM-DD_HH-MM-SS name, else the directory mtime."""
+	m = SNAPSHOT_TIME.search(name)
+	if m:
+		return time.mktime(time.strptime(f"{m.group(1)} {m.group(2)}:{m.group(3)}:{m.group(4)}", "%Y-%m-%d %H:%M:%S"))
+	return os.stat(os.path.join(root, "snapshots", name)).st_mtime
+
+# ------------------ Recording ------------------
+def stat_row(rel: str, st: os.stat_result) -> Tuple[str, int, int, int, int]:
+	return (rel, st.st_ino, st.st_size, st.st_mtime_ns, st.st_blocks)
+
+def walk_snapshot(snap_dir: str) -> Iterable[Tuple[str, int, int, int, int]]:
+	stack = [""]
+	while stack:
+		rel = stack.pop()
+		try:
+			with os.scandir(os.path.join(snap_dir, rel)) as it:
+				for entry in it:
+					path = os.path.join(rel, entry.name)
+					try:
+						if entry.is_dir(follow_symlinks=False):
+							stack.append(path)
+						else:
+							yield stat_row(path, entry.stat(follow_symlinks=False))
+					except OSError:
+						continue
+		except OSError as e:
+			logger.warning(f"Can't read {os.path.join(snap_dir, rel)}: {e}")
+
+def stat_changes(snap_dir: str, changed: List[str]) -> Iterable[Tuple[str, int, int, int, int]]:
+	for rel in changed:
+		try:
+			st = os.lstat(os.path.join(snap_dir, rel))
+		except OSError:
+			continue  # Vanished during the backup; its old version gets closed below
+		if not os.path.isdir(os.path.join(snap_dir, rel)) or os.path.islink(os.path.join(snap_dir, rel)):
+			yield stat_row(rel, st)
+
+def load_seen(conn: sqlite3.Connection, rows: Iterable[Tuple[str, int, int, int, int]]) -> int:
+	conn.execute("DELETE FROM seen")
+	batch, count = [], 0
+	for row in rows:
+		batch.append(row)
+		if len(batch) >= WALK_BATCH:
+			conn.executemany("INSERT OR REPLACE INTO seen VALUES (?,?,?,?,?)", batch)
+			count += len(batch)
+			batch.clear()
+	conn.executemany("INSERT OR REPLACE INTO seen VALUES (?,?,?,?,?)", batch)
+	return count + len(batch)
+
+def close_deleted(conn: sqlite3.Connection, prev: int, deleted: List[str]) -> None:
+	"""End the open versions of deleted paths, and of everything under those that were directories."""
+	for path in deleted:
+		conn.execute(
+			"""
+			UPDATE versions SET last_seq = ? WHERE last_seq IS NULL AND path_id IN (
+				SELECT id FROM paths WHERE path = ? OR (path > ? AND path < ?)
+			)
+			""",
+			(prev, path, path + "/", path + "0"),  # "0" sorts right after "/"
+		)
+
+SEEN_IDS = """
+	SELECT p.id AS path_id, o.id AS object_id FROM seen s
+	JOIN paths p ON p.path = s.path
+	JOIN objects o ON o.ino = s.ino AND o.size = s.size AND o.mtime_ns = s.mtime_ns
+"""
+
+def record(conn: sqlite3.Connection, root: str, name: str, base: Optional[str] = None,
+		changes: Optional[Tuple[List[str], List[str]]] = None) -> None:
+	"""Catalog snapshot name. With changes=(changed, deleted) relative to base, only those paths are stat'ed."""
+	snaps = snapshot_list(conn)
+	if any(n == name for _, n, _ in snaps):
+		raise CatalogError(f"{name} is already catalogued")
+	prev = snaps[-1][0] if snaps else None
+	snap_dir = os.path.join(root, "snapshots", name)
+	if not os.path.isdir(snap_dir):
+		raise CatalogError(f"{snap_dir} does not exist")
+	use_changes = changes is not None and snaps and base == snaps[-1][1]
+	if changes is not None and not use_changes:
+		logger.info(f"Catalog's latest is {snaps[-1][1] if snaps else 'nothing'}, not {base}; walking {name}")
+	t = time.monotonic()
+	if use_changes:
+		changed, deleted = changes
+		seen = load_seen(conn, stat_changes(snap_dir, changed))
+	else:
+		seen = load_seen(conn, walk_snapshot(snap_dir))
+	with conn:
+		seq = (prev or 0) + 1
+		conn.execute("INSERT INTO snapshots (seq, name, created_at, recorded_at, mode) VALUES (?,?,?,?,?)",
+			(seq, name, snapshot_created(root, name), time.time(), "changes" if use_changes else "walk"))
+		conn.execute("INSERT OR IGNORE INTO objects (ino, size, mtime_ns, blocks) SELECT ino, size, mtime_ns, blocks FROM seen")
+		conn.execute("INSERT OR IGNORE INTO paths (path) SELECT path FROM seen")
+		conn.execute(f"CREATE TEMP TABLE seen_ids AS {SEEN_IDS}")
+		conn.execute("CREATE INDEX temp.idx_seen_ids ON seen_ids(path_id)")
+		if prev is not None:
+			if use_changes:
+				# Changed paths whose object differs, and deleted paths (with anything under deleted directories)
+				conn.execute(
+					"""
+					UPDATE versions SET last_seq = ? WHERE last_seq IS NULL AND path_id IN (
+						SELECT p.id FROM seen s JOIN paths p ON p.path = s.path
+					) AND NOT EXISTS (
+						SELECT 1 FROM seen_ids i WHERE i.path_id = versions.path_id AND i.object_id = versions.object_id
+					)
+					""",
+					(prev,),
+				)
+				gone = [p for p in changed if conn.execute("SELECT 1 FROM seen WHERE path=?", (p,)).fetchone() is None]
+				close_deleted(conn, prev, deleted + gone)
+			else:
+				conn.execute(
+					"""
+					UPDATE versions SET last_seq = ? WHERE last_seq IS NULL AND NOT EXISTS (
+						SELECT 1 FROM seen_ids i WHERE i.path_id = versions.path_id AND i.object_id = versions.object_id
+					)
+					""",
+					(prev,),
+				)
+		conn.execute(
+			"""
+			INSERT INTO versions (path_id, object_id, first_seq, last_seq)
+			SELECT i.path_id, i.object_id, ?, NULL FROM seen_ids i
+			WHERE NOT EXISTS (SELECT 1 FROM versions v WHERE v.path_id = i.path_id AND v.last_seq IS NULL)
+			""",
+			(seq,),
+		)
+		conn.execute("DROP TABLE seen_ids")
+	logger.info(f"Catalogued {name} ({'changes' if use_changes else 'walk'}: {seen} files stat'ed) in {time.monotonic() - t:.0f}s")
+
+def read_changes(stream) -> Tuple[List[str], List[str]]:
+	"""NUL-separated entries from Backup_Orchestrator.py: "+path" new or changed, "-path" deleted."""
+	changed, deleted = [], []
+	for item in stream.read().split(b"\0"):
+		if item[:1] == b"+":
+			changed.append(os.fsdecode(item[1:]))
+		elif item[:1] == b"-":
+			deleted.append(os.fsdecode(item[1:]))
+	return changed, deleted
+
+def on_disk(root: str) -> List[str]:
+	snaps_dir = os.path.join(root, "snapshots")
+	return sorted(
+		e.name for e in os.scandir(snaps_dir)
+		if e.is_dir(follow_symlinks=False) and not e.name.endswith(".partial") and not e.name.startswith(PRUNING_PREFIX)
+	)
+
+def sync(conn: sqlite3.Connection, root: str) -> None:
+	"""Forget snapshots that are gone and walk the ones not catalogued yet."""
+	present = set(on_disk(root))
+	for seq, name, _ in snapshot_list(conn):
+		if name not in present:
+			logger.info(f"{name} is no longer on disk; dropping it from the catalog")
+			forget(conn, seq)
+	known = {name for _, name, _ in snapshot_list(conn)}
+	snaps = snapshot_list(conn)
+	newest = max(snaps, key=lambda s: s[2])[2] if snaps else None
+	for name in sorted(present - known, key=lambda n: snapshot_created(root, n)):
+		if newest is not None and snapshot_created(root, name) < newest:
+			logger.warning(f"{name} is older than the newest catalogued snapshot and can't be added in order; skipped")
+			continue
+		record(conn, root, name)
+		newest = snapshot_created(root, name)
+
+def forget(conn: sqlite3.Connection, seq: int) -> None:
+	"""Drop a snapshot, the versions only it held, and objects and paths nothing refers to any more."""
+	seqs = [s for s, _, _ in snapshot_list(conn)]
+	i = seqs.index(seq)
+	prev = seqs[i - 1] if i > 0 else None
+	nxt = seqs[i + 1] if i + 1 < len(seqs) else None
+	with conn:
+		# Versions that held no other snapshot: started after prev, ended before next
+		conn.execute(
+			"""
+			DELETE FROM versions WHERE first_seq > ? AND first_seq <= ?
+			AND COALESCE(last_seq, ?) >= ? AND COALESCE(last_seq, ?) < ?
+			""",
+			(prev if prev is not None else -1, seq, seqs[-1], seq, seqs[-1], nxt if nxt is not None else seq + 1),
+		)
+		if nxt is None and prev is not None:
+			# prev becomes the latest: what it held until seq is held "now"
+			conn.execute("UPDATE versions SET last_seq = NULL WHERE last_seq >= ?", (prev,))
+		conn.execute("DELETE FROM snapshots WHERE seq = ?", (seq,))
+		conn.execute("DELETE FROM objects WHERE NOT EXISTS (SELECT 1 FROM versions v WHERE v.object_id = objects.id)")
+		conn.execute("DELETE FROM paths WHERE NOT EXISTS (SELECT 1 FROM versions v WHERE v.path_id = paths.id)")
+
+# ------------------ Lookups ------------------
+def fmt_time(ts: float) -> str:
+	return time.strftime("%Y-%m-%d %H:%M", time.localtime(ts))
+
+def human_bytes(n: float) -> str:
+	for unit in ("B", "KB", "MB", "GB"):
+		if n < 1000:
+			return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+		n /= 1000
+	return f"{n:.2f} TB"
+
+def which(conn: sqlite3.Connection, root: str, path: str, at: Optional[float] = None) -> int:
+	"""Print every version of path and the snapshots holding it; with at, only the copy to restore."""
+	path = path.strip("/")
+	snaps = snapshot_list(conn)
+	if not snaps:
+		print("The catalog is empty; run sync first", file=sys.stderr)
+		return 1
+	seqs = [s for s, _, _ in snaps]
+	rows = conn.execute(
+		"""
+		SELECT v.first_seq, COALESCE(v.last_seq, ?), o.size, o.mtime_ns, o.ino FROM versions v
+		JOIN paths p ON p.id = v.path_id JOIN objects o ON o.id = v.object_id
+		WHERE p.path = ? ORDER BY v.first_seq
+		""",
+		(seqs[-1], path),
+	).fetchall()
+	held = []  # (first snapshot, last snapshot, size, mtime, ino)
+	for first, last, size, mtime_ns, ino in rows:
+		covered = snaps[bisect_left(seqs, first):bisect_right(seqs, last)]
+		if covered:
+			held.append((covered[0], covered[-1], size, mtime_ns, ino))
+	if not held:
+		print(f"{path} is not in any catalogued snapshot", file=sys.stderr)
+		return 1
+	if at is not None:
+		# Newest snapshot taken at or before at that holds the path
+		best = None
+		for first, last, *_ in held:
+			for snap in snaps[seqs.index(first[0]):seqs.index(last[0]) + 1]:
+				if snap[2] <= at:
+					best = snap
+		if best is None:
+			print(f"No snapshot from before {fmt_time(at)} holds {path}", file=sys.stderr)
+			return 1
+		print(os.path.join(root, "snapshots", best[1], path))
+		return 0
+	print(path)
+	for n, (first, last, size, mtime_ns, ino) in enumerate(held):
+		span = first[1] if first == last else f"{first[1]} .. {last[1]}"
+		print(f"  {span}")
+		print(f"      {human_bytes(size)}, modified {fmt_time(mtime_ns / 1e9)}, inode {ino}")
+		nxt = held[n + 1][0] if n + 1 < len(held) else None
+		after = snaps[seqs.index(last[0]) + 1] if last[0] != seqs[-1] else None
+		if after is not None and (nxt is None or nxt[0] != after[0]):
+			print(f"  missing from {after[1]}" + (f" until {nxt[1]}" if nxt else " onwards"))
+	newest = held[-1][1]
+	print(f"Restore from: {os.path.join(root, 'snapshots', newest[1], path)}")
+	return 0
+
+def search(conn: sqlite3.Connection, pattern: str, limit: int) -> int:
+	"""Catalogued paths matching a GLOB; a literal prefix keeps it an index range scan."""
+	literal = re.split(r"[*?\[]", pattern, 1)[0]
+	sql, params = "SELECT path FROM paths WHERE path GLOB ?", [pattern]
+	if literal:
+		sql += " AND path >= ? AND path < ?"
+		params += [literal, literal + "\U0010ffff"]
+	sql += " ORDER BY path LIMIT ?"
+	found = 0
+	for (path,) in conn.execute(sql, (*params, limit)):
+		print(path)
+		found += 1
+	return 0 if found else 1
+
+def snapshot_usage(conn: sqlite3.Connection) -> Dict[int, List[int]]:
+	"""seq -> [files, apparent bytes, bytes only this snapshot holds], from one pass over versions."""
+	snaps = snapshot_list(conn)
+	seqs = [s for s, _, _ in snaps]
+	usage = {s: [0, 0, 0] for s in seqs}
+	if not seqs:
+		return usage
+	current, covered, blocks = None, set(), 0
+
+	def settle() -> None:
+		if len(covered) == 1:
+			usage[next(iter(covered))][2] += blocks * 512
+
+	for object_id, obj_blocks, size, first, last in conn.execute(
+		"""
+		SELECT v.object_id, o.blocks, o.size, v.first_seq, COALESCE(v.last_seq, ?)
+		FROM versions v JOIN objects o ON o.id = v.object_id ORDER BY v.object_id
+		""",
+		(seqs[-1],),
+	):
+		if object_id != current:
+			settle()
+			current, covered, blocks = object_id, set(), obj_blocks
+		span = seqs[bisect_left(seqs, first):bisect_right(seqs, last)]
+		for s in span:
+			usage[s][0] += 1
+			usage[s][1] += size
+		covered.update(span)
+	settle()
+	return usage
+
+def report(conn: sqlite3.Connection) -> int:
+	usage = snapshot_usage(conn)
+	print(f"{'snapshot':32s} {'created':16s} {'files':>10s} {'size':>10s} {'only here':>10s}")
+	for seq, name, created in snapshot_list(conn):
+		files, size, unique = usage[seq]
+		print(f"{name:32s} {fmt_time(created):16s} {files:10d} {human_bytes(size):>10s} {human_bytes(unique):>10s}")
+	return 0
+
+# ------------------ Pruning ------------------
+def latest_target(root: str) -> Optional[str]:
+	link = os.path.join(root, "latest")
+	return os.path.basename(os.path.realpath(link)) if os.path.lexists(link) else None
+
+def delete_trees(root: str, workers: int) -> None:
+	"""Delete every .pruning-* snapshot, splitting each into its top-level subtrees for the workers."""
+	snaps_dir = os.path.join(root, "snapshots")
+	doomed = [os.path.join(snaps_dir, n) for n in os.listdir(snaps_dir) if n.startswith(PRUNING_PREFIX)]
+	if not doomed:
+		return
+	subtrees = []
+	for d in doomed:
+		with os.scandir(d) as it:
+			subtrees.extend(e.path for e in it)
+
+	def remove(path: str) -> None:
+		r = subprocess.run(["rm", "-rf", "--", path], capture_output=True, text=True)
+		if r.returncode != 0:
+			logger.warning(f"rm -rf {path}: {r.stderr.strip()}")
+
+	t = time.monotonic()
+	with ThreadPoolExecutor(max_workers=workers) as pool:
+		list(pool.map(remove, subtrees))
+	for d in doomed:
+		shutil.rmtree(d, ignore_errors=True)
+	logger.info(f"Deleted {len(doomed)} snapshots ({len(subtrees)} subtrees) in {time.monotonic() - t:.0f}s")
+
+def prune(conn: sqlite3.Connection, root: str, names: List[str], older_than_days: Optional[float],
+		workers: int, dry_run: bool) -> int:
+	snaps = snapshot_list(conn)
+	by_name = {name: seq for seq, name, _ in snaps}
+	# Snapshots older than the catalog's first entry can't be catalogued in order; prune them by name time
+	uncatalogued = [n for n in on_disk(root) if n not in by_name]
+	keep = {latest_target(root)}
+	if snaps:
+		keep.add(snaps[-1][1])
+	chosen = set(names)
+	missing = sorted(n for n in chosen if n not in by_name and n not in uncatalogued)
+	if missing:
+		raise CatalogError(f"No such snapshot: {', '.join(missing)}")
+	if older_than_days is not None:
+		cutoff = time.time() - older_than_days * 86400
+		chosen |= {name for _, name, created in snaps if created < cutoff}
+		chosen |= {name for name in uncatalogued if snapshot_created(root, name) < cutoff}
+	for name in sorted(chosen & keep):
+		logger.info(f"Keeping {name}: it is the latest snapshot")
+	chosen -= keep
+	usage = snapshot_usage(conn)
+	snaps_dir = os.path.join(root, "snapshots")
+	for name in sorted(chosen, key=lambda n: snapshot_created(root, n)):
+		if name in by_name:
+			# Space only this snapshot holds; pruning several frees more where they share files
+			logger.info(f"{'Would prune' if dry_run else 'Pruning'} {name}, freeing at least {human_bytes(usage[by_name[name]][2])}")
+		else:
+			logger.info(f"{'Would prune' if dry_run else 'Pruning'} {name} (not catalogued)")
+		if dry_run:
+			continue
+		# Renamed first, so a half-deleted snapshot never looks like a usable one
+		os.rename(os.path.join(snaps_dir, name), os.path.join(snaps_dir, PRUNING_PREFIX + name))
+		if name in by_name:
+			forget(conn, by_name[name])
+	if not dry_run:
+		delete_trees(root, workers)  # Also finishes prunes an earlier run was interrupted in
+	return 0
+
+# ------------------ Main ------------------
+def parse_date(text: str) -> float:
+	import argparse
+	for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d"):
+		try:
+			t = time.strptime(text, fmt)
+			# A bare date means the end of that day
+			return time.mktime(t) + (86399 if fmt == "%Y-%m-%d" else 0)
+		except ValueError:
+			continue
+	raise argparse.ArgumentTypeError(f"expected YYYY-MM-DD or 'YYYY-MM-DD HH:MM', got {text!r}")
+
+def parse_args(argv: List[str]):
+	import argparse
+	p = argparse.ArgumentParser(description="Snapshot catalog for restores and retention on the backup device")
+	p.add_argument("--root", required=True, help="Backup destination holding snapshots/ and latest")
+	p.add_argument("--db", help=f"Catalog database (default ROOT/{CATALOG_NAME})")
+	p.add_argument("--debug", action="store_true")
+	sub = p.add_subparsers(dest="command", required=True)
+	r = sub.add_parser("record", help="Catalog a newly promoted snapshot")
+	r.add_argument("name")
+	r.add_argument("--base", help="Snapshot the change list is relative to")
+	r.add_argument("--changes", help="Change list from Backup_Orchestrator.py ('-' for stdin)")
+	sub.add_parser("sync", help="Catch up with the snapshots on disk")
+	w = sub.add_parser("which", help="Snapshots holding a path, and where it changed")
+	w.add_argument("path", help="Path relative to the snapshot root, e.g. user_1/Documents/a.pdf")
+	w.add_argument("--at", type=parse_date, help="Print only the copy to restore as of this date")
+	s = sub.add_parser("search", help="Catalogued paths matching a glob")
+	s.add_argument("pattern", help="e.g. 'user_1/Photos/2019/*.jpg'")
+	s.add_argument("--limit", type=int, default=1000)
+	sub.add_parser("report", help="Size of each snapshot and the space only it uses")
+	pr = sub.add_parser("prune", help="Delete snapshots (never the latest)")
+	pr.add_argument("names", nargs="*")
+	pr.add_argument("--older-than-days", type=float)
+	pr.add_argument("--workers", type=int, default=PRUNE_WORKERS)
+	pr.add_argument("--dry-run", action="store_true")
+	return p.parse_args(argv)
+
+def main(argv: List[str]) -> int:
+	args = parse_args(argv)
+	setup_logging(args.debug)
+	conn = open_catalog(args.db or os.path.join(args.root, CATALOG_NAME))
+	try:
+		if args.command == "record":
+			changes = None
+			if args.changes:
+				if args.changes == "-":
+					changes = read_changes(sys.stdin.buffer)
+				else:
+					with open(args.changes, "rb") as f:
+						changes = read_changes(f)
+			record(conn, args.root, args.name, args.base, changes)
+		elif args.command == "sync":
+			sync(conn, args.root)
+		elif args.command == "which":
+			return which(conn, args.root, args.path, args.at)
+		elif args.command == "search":
+			return search(conn, args.pattern, args.limit)
+		elif args.command == "report":
+			return report(conn)
+		elif args.command == "prune":
+			return prune(conn, args.root, args.names, args.older_than_days, args.workers, args.dry_run)
+	except CatalogError as e:
+		logger.error(str(e))
+		return 1
+	finally:
+		conn.close()
+	return 0
+
+if __name__ == "__main__":
+	raise SystemExit(main(sys.argv[1:]))
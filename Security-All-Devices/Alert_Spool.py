@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""Local alert spool in front of Email_Sender.py.
+
+Backupscript.sh, RmS.sh, Entropy_Watch.py and the detection script hand their
+alerts to this spool instead of starting Email_Sender.py for each one. The
+"send" command only talks to a Unix socket (stdlib, any python3), so an alert
+costs milliseconds and never needs the Gmail environment.
+
+The daemon ("serve", run with the gmailenv python) keeps every alert in an
+SQLite queue until it has been emailed, and:
+    - builds the Gmail client once and reuses it, rebuilding it after an error;
+    - waits HOLD_SEC after an alert for the rest of its burst, then sends
+      everything queued under that subject as one digest email;
+    - sends at most one email per subject every RATE_LIMIT_SEC; alerts that
+      arrive in between are merged into the next digest, not dropped;
+    - keeps failed sends queued and retries them with exponential backoff,
+      so alerts raised while the network is down go out once it is back.
+
+If the daemon isn't running, "send" writes the alert into the queue itself
+and the daemon emails it when it starts.
+
+Examples:
+    /path/to/gmailenv/bin/python3 Alert_Spool.py serve
+    python3 Alert_Spool.py send --source Backupscript.sh --subject "Backup Error" --body-file /tmp/log
+    python3 Alert_Spool.py status
+    python3 Alert_Spool.py serve --smtp localhost:1025 --to me@example.com   # test against a local SMTP server
+    python3 -m aiosmtpd -n -l localhost:1025                                 # ...such as this one
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import sqlite3
+import logging
+import threading
+import importlib.util
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+EMAIL_SENDER = os.path.join(SCRIPT_DIR, "Email_Sender.py")      # Gmail client, credentials and recipients
+SOCKET_PATH = os.path.join(SCRIPT_DIR, "alert_spool.sock")
+QUEUE_PATH = os.path.join(SCRIPT_DIR, "alert_queue.db")
+
+HOLD_SEC = 15.0                     # Quiet time after an alert before its subject is sent...
+MAX_HOLD_SEC = 120.0                # ...but never held longer than this during a steady stream
+RATE_LIMIT_SEC = 900.0              # At most one email per subject this often
+BACKOFF_BASE_SEC = 30.0             # First retry after a failed send; doubles per failure
+BACKOFF_MAX_SEC = 3600.0
+MAX_AGE_DAYS = 7.0                  # Alerts still unsent after this long are dropped (and logged)
+DIGEST_ITEM_CHARS = 20000           # Longer alert bodies are cut in a digest
+CLIENT_TIMEOUT_SEC = 5.0            # "send" falls back to writing the queue after this
+SMTP_TIMEOUT_SEC = 30.0
+
+logger = logging.getLogger("alert_spool")
+
+def setup_logging(debug):
+    logging.basicConfig(level=logging.DEBUG if debug else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+
+# ------------------ Queue ------------------
+def open_queue(path):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(
+        """
+        CREATE TABLE IF NOT EXISTS alerts (
+            id INTEGER PRIMARY KEY,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            source TEXT NOT NULL,
+            received_at REAL NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_alerts_subject ON alerts(subject);
+        CREATE TABLE IF NOT EXISTS sent (
+            subject TEXT PRIMARY KEY,
+            sent_at REAL NOT NULL
+        );
+        """
+    )
+    return conn
+
+def enqueue(conn, subject, body, source):
+    now = time.time()
+    with conn:
+        cur = conn.execute(
+            "INSERT INTO alerts (subject, body, source, received_at, next_attempt) VALUES (?,?,?,?,?)",
+            (subject, body, source, now, now),
+        )
+    return cur.lastrowid
+
+def pending_groups(conn, now):
+    """[(subject, due_at, rows)] for every subject with queued alerts; rows are (id, body, source, received_at, attempts)."""
+    last_sent = dict(conn.execute("SELECT subject, sent_at FROM sent"))
+    groups = {}
+    for row in conn.execute(
+        "SELECT subject, id, body, source, received_at, attempts, next_attempt FROM alerts ORDER BY id"
+    ):
+        groups.setdefault(row[0], []).append(row[1:])
+    result = []
+    for subject, rows in groups.items():
+        oldest = rows[0][3]
+        newest = max(r[3] for r in rows)
+        due_at = max(
+            min(newest + HOLD_SEC, oldest + MAX_HOLD_SEC),
+            last_sent.get(subject, 0.0) + RATE_LIMIT_SEC,
+            max(r[5] for r in rows),
+        )
+        result.append((subject, due_at, [r[:5] for r in rows]))
+    return result
+
+def digest(subject, rows):
+    """One email for everything queued under subject."""
+    if len(rows) == 1:
+        return subject, rows[0][1]
+    stamp = lambda t: time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t))
+    lines = [f"{len(rows)} alerts between {stamp(rows[0][3])} and {stamp(rows[-1][3])}.", ""]
+    for _, body, source, received_at, _ in rows:
+        if len(body) > DIGEST_ITEM_CHARS:
+            body = body[:DIGEST_ITEM_CHARS] + f"\n[... {len(body) - DIGEST_ITEM_CHARS} more characters]"
+        lines += [f"=== {stamp(received_at)} from {source} ===", body.rstrip("\n"), ""]
+    return f"{subject} ({len(rows)} alerts)", "\n".join(lines)
+
+# ------------------ Transports ------------------
+class GmailTransport:
+    """Email_Sender.py's Gmail API client, built once and kept for every send."""
+
+    def __init__(self, sender_path):
+        spec = importlib.util.spec_from_file_location("Email_Sender", sender_path)
+        self.es = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(self.es)
+        self.service = None
+
+    def connect(self):
+        credentials = self.es.get_credentials()
+        http = credentials.authorize(self.es.httplib2.Http())
+        self.service = self.es.discovery.build("gmail", "v1", http=http)
+        logger.info("Gmail client ready")
+
+    def send(self, subject, body):
+        if self.service is None:
+            self.connect()
+        message = self.es.CreateMessageText(self.es.SENDER, self.es.RECIPIENTS, subject, body)
+        try:
+            self.service.users().messages().send(userId="me", body=message).execute()
+        except Exception:
+            self.service = None  # Rebuilt on the next attempt
+            raise
+
+class SmtpTransport:
+    """Plain SMTP with one connection kept open between sends; for a local stand-in or a relay."""
+
+    def __init__(self, address, sender, recipients, starttls=False, username=None, password=None):
+        host, _, port = address.rpartition(":")
+        self.host, self.port = host or "localhost", int(port)
+        self.sender, self.recipients = sender, recipients
+        self.starttls, self.username, self.password = starttls, username, password
+        self.smtp = None
+
+    def connect(self):
+        import smtplib
+        smtp = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT_SEC)
+        if self.starttls:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password or "")
+        self.smtp = smtp
+
+    def send(self, subject, body):
+        import smtplib
+        from email.message import EmailMessage
+        msg = EmailMessage()
+        msg["Subject"] = subject
+        msg["From"] = self.sender
+        msg["To"] = ", ".join(self.recipients)
+        msg.set_content(body)
+        for fresh in (False, True):
+            # The server may have dropped an idle connection; reconnect once
+            if self.smtp is None or fresh:
+                self.close()
+                self.connect()
+            try:
+                self.smtp.send_message(msg)
+                return
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                if fresh:
+                    self.close()
+                    raise
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except Exception:
+                pass
+            self.smtp = None
+
+class LogTransport:
+    """--dry-run: log the emails instead of sending them."""
+
+    def send(self, subject, body):
+        logger.info(f"Would email: {subject}\n{body}")
+
+# ------------------ Daemon ------------------
+class Daemon:
+    def __init__(self, queue_path, socket_path, transport):
+        self.queue_path = queue_path
+        self.socket_path = socket_path
+        self.transport = transport
+        self.wake = threading.Event()
+        self.server = None
+
+    def listen(self):
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                raise SystemExit(f"Another spool is already listening on {self.socket_path}")
+            except OSError:
+                os.unlink(self.socket_path)  # Left over from a daemon that died
+            finally:
+                probe.close()
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o660)
+        self.server.listen(16)
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+
+    def accept_loop(self):
+        conn = open_queue(self.queue_path)
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except OSError:
+                return
+            with client:
+                client.settimeout(CLIENT_TIMEOUT_SEC)
+                try:
+                    request = json.loads(client.makefile("rb").readline())
+                    alert_id = enqueue(conn, str(request["subject"]), str(request.get("body", "")),
+                                       str(request.get("source", "unknown")))
+                    reply = {"ok": True, "id": alert_id}
+                    logger.info(f"Queued alert {alert_id} from {request.get('source', 'unknown')}: {request['subject']}")
+                    self.wake.set()
+                except (OSError, ValueError, KeyError, TypeError, sqlite3.Error) as e:
+                    reply = {"ok": False, "error": str(e)}
+                try:
+                    client.sendall(json.dumps(reply).encode() + b"\n")
+                except OSError:
+                    pass
+
+    def flush(self, conn):
+        """Send every subject that is due; returns seconds until the next one is."""
+        now = time.time()
+        with conn:
+            stale = conn.execute("SELECT id, subject FROM alerts WHERE received_at < ?",
+                                 (now - MAX_AGE_DAYS * 86400,)).fetchall()
+            for alert_id, subject in stale:
+                logger.error(f"Dropping alert {alert_id} ({subject}): unsent after {MAX_AGE_DAYS:g} days")
+            conn.execute("DELETE FROM alerts WHERE received_at < ?", (now - MAX_AGE_DAYS * 86400,))
+        wait = None
+        for subject, due_at, rows in pending_groups(conn, now):
+            if due_at > now:
+                wait = due_at - now if wait is None else min(wait, due_at - now)
+                continue
+            title, body = digest(subject, rows)
+            ids = [r[0] for r in rows]
+            marks = ",".join("?" * len(ids))
+            try:
+                self.transport.send(title, body)
+            except Exception as e:
+                attempts = max(r[4] for r in rows) + 1
+                delay = min(BACKOFF_BASE_SEC * 2 ** (attempts - 1), BACKOFF_MAX_SEC)
+                logger.warning(f"Sending '{title}' failed (attempt {attempts}): {e}; retrying in {delay:.0f}s")
+                with conn:
+                    conn.execute(f"UPDATE alerts SET attempts = ?, next_attempt = ? WHERE id IN ({marks})",
+                                 (attempts, time.time() + delay, *ids))
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            logger.info(f"Sent '{title}'")
+            with conn:
+                conn.execute(f"DELETE FROM alerts WHERE id IN ({marks})", ids)
+                conn.execute("INSERT OR REPLACE INTO sent (subject, sent_at) VALUES (?,?)", (subject, time.time()))
+        return wait
+
+    def run(self, poll_sec):
+        self.listen()
+        conn = open_queue(self.queue_path)
+        logger.info(f"Alert spool listening on {self.socket_path}")
+        try:
+            while True:
+                wait = self.flush(conn)
+                # Also wake up now and then for alerts "send" wrote straight into the queue
+                self.wake.wait(poll_sec if wait is None else min(wait, poll_sec))
+                self.wake.clear()
+        finally:
+            self.server.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            if hasattr(self.transport, "close"):
+                self.transport.close()
+            conn.close()
+
+# ------------------ Client ------------------
+def submit(subject, body, source, socket_path=SOCKET_PATH, queue_path=QUEUE_PATH):
+    """Hand one alert to the daemon, or queue it on disk if the daemon can't be reached."""
+    request = json.dumps({"subject": subject, "body": body, "source": source}).encode() + b"\n"
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(CLIENT_TIMEOUT_SEC)
+            s.connect(socket_path)
+            s.sendall(request)
+            reply = json.loads(s.makefile("rb").readline())
+        if reply.get("ok"):
+            return True
+        logger.warning(f"Alert spool refused the alert: {reply.get('error')}")
+    except (OSError, ValueError) as e:
+        logger.warning(f"Alert spool not reachable at {socket_path} ({e}); queueing in {queue_path}")
+    conn = open_queue(queue_path)
+    try:
+        enqueue(conn, subject, body, source)
+    finally:
+        conn.close()
+    return False
+
+def status(queue_path):
+    conn = open_queue(queue_path)
+    now = time.time()
+    groups = pending_groups(conn, now)
+    if not groups:
+        print("No alerts queued")
+    for subject, due_at, rows in sorted(groups, key=lambda g: g[1]):
+        attempts = max(r[4] for r in rows)
+        when = "now" if due_at <= now else f"in {due_at - now:.0f}s"
+        print(f"{len(rows):4d} queued, next email {when}" + (f", {attempts} failed attempts" if attempts else "") + f": {subject}")
+    conn.close()
+    return 0
+
+# ------------------ Main ------------------
+def parse_args(argv):
+    import argparse
+    p = argparse.ArgumentParser(description="Spool, batch and email alerts through Email_Sender.py")
+    p.add_argument("--socket", default=SOCKET_PATH, help="Unix socket the daemon listens on")
+    p.add_argument("--queue", default=QUEUE_PATH, help="SQLite queue of unsent alerts")
+    p.add_argument("--debug", action="store_true")
+    sub = p.add_subparsers(dest="command", required=True)
+    s = sub.add_parser("send", help="Queue an alert (what the scripts call)")
+    s.add_argument("--subject", required=True)
+    body = s.add_mutually_exclusive_group(required=True)
+    body.add_argument("--body")
+    body.add_argument("--body-file", help="File whose contents become the body ('-' for stdin)")
+    s.add_argument("--source", default="unknown", help="Script raising the alert, shown in digests")
+    d = sub.add_parser("serve", help="Run the daemon")
+    d.add_argument("--email-sender", default=EMAIL_SENDER, help="Email_Sender.py providing the Gmail client")
+    d.add_argument("--smtp", metavar="HOST:PORT", help="Send through this SMTP server instead of Gmail")
+    d.add_argument("--starttls", action="store_true", help="Use STARTTLS with --smtp")
+    d.add_argument("--smtp-user")
+    d.add_argument("--smtp-password-env", default="ALERT_SPOOL_SMTP_PASSWORD",
+                   help="Environment variable holding the SMTP password")
+    d.add_argument("--sender", default=f"alert-spool@{socket.gethostname()}", help="From address with --smtp")
+    d.add_argument("--to", action="append", default=[], help="Recipient with --smtp (repeatable)")
+    d.add_argument("--dry-run", action="store_true", help="Log emails instead of sending them")
+    d.add_argument("--poll", type=float, default=30.0, help="Seconds between queue checks while idle")
+    sub.add_parser("status", help="Show queued alerts")
+    args = p.parse_args(argv)
+    if args.command == "serve" and args.smtp and not args.to:
+        p.error("--smtp needs at least one --to")
+    return args
+
+def main(argv):
+    args = parse_args(argv)
+    setup_logging(args.debug)
+    if args.command == "send":
+        if args.body_file == "-":
+            body = sys.stdin.read()
+        elif args.body_file:
+            try:
+                with open(args.body_file, "r", encoding="utf-8", errors="replace") as f:
+                    body = f.read()
+            except OSError as e:
+                logger.error(f"Failed to read body file: {e}")
+                return 1
+        else:
+            body = args.body
+        submit(args.subject, body, args.source, args.socket, args.queue)
+        return 0
+    if args.command == "status":
+        return status(args.queue)
+    if args.dry_run:
+        transport = LogTransport()
+    elif args.smtp:
+        transport = SmtpTransport(args.smtp, args.sender, args.to, args.starttls,
+                                  args.smtp_user, os.environ.get(args.smtp_password_env))
+    else:
+        transport = GmailTransport(args.email_sender)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        Daemon(args.queue, args.socket, transport).run(args.poll)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
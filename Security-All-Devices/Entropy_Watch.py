@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+"""Early warning of mass file modification (ransomware) on the NAS shares.
+
+Watches the share directories with inotify, counting file rewrites, renames
+and deletes in a sliding window. A few small blocks (start, middle, end) of
+each rewritten file are read after it settles and their Shannon entropy is
+measured; the whole file is never read. A rewrite is suspicious when:
+
+    - a known format no longer starts with its magic bytes (an encrypted .jpg
+      is not a JPEG any more),
+    - the sample looks random (close to 8 bits/byte) and the extension is not
+      an already-compressed format, or
+    - the file's entropy jumped well above what it was last time it was seen.
+
+An alert is emailed through Alert_Spool.py when the change rate or the share
+of suspicious rewrites in the window crosses its threshold, then alerts are
+held back for ALERT_COOLDOWN_SEC. RmS.sh still does the full checksum check;
+this only shortens the time to notice.
+
+If inotify can't be used, or runs out of watches on a large tree, the
+uncovered trees are stat-scanned every POLL_INTERVAL_SEC instead. An inotify
+queue overflow means more events than the kernel would hold, and is
+reported as a burst in its own right.
+
+Example:
+    python3 Entropy_Watch.py /mnt/nasdata/user1 /mnt/nasdata/user2 /mnt/nasdata/common
+    python3 Entropy_Watch.py --dry-run --debug /tmp/testshare   # log alerts instead of emailing
+"""
+
+import os
+import sys
+import math
+import time
+import errno
+import fnmatch
+import select
+import struct
+import socket
+import ctypes
+import ctypes.util
+import logging
+import threading
+import subprocess
+from collections import Counter, OrderedDict, deque
+
+WATCH_PATHS = ["/mnt/nasdata/user1", "/mnt/nasdata/user2", "/mnt/nasdata/common"]
+IGNORE_GLOBS = []                   # fnmatch patterns of paths to ignore, e.g. "*/.recycle/*"
+ALERT_SPOOL = "/path/to/Alert_Spool.py"
+
+WINDOW_SEC = 60.0                   # Sliding window for the thresholds below
+RATE_THRESHOLD = 300                # Rewrites + renames + deletes per window
+SHARE_THRESHOLD = 0.5               # Suspicious share of sampled rewrites per window...
+MIN_SAMPLED = 20                    # ...once at least this many were sampled
+ALERT_COOLDOWN_SEC = 3600.0         # Quiet time after an alert
+
+BLOCK_SIZE = 4096                   # Bytes per sampled block
+SAMPLE_BLOCKS = 3                   # Blocks per file, spread from start to end
+MIN_SAMPLE_BYTES = 1024             # Smaller files are counted but not sampled
+HIGH_ENTROPY_BITS = 7.5             # Bits/byte treated as random (max 8)
+ENTROPY_JUMP_BITS = 1.5             # Rise from a file's previous sample that counts as suspicious
+SETTLE_SEC = 2.0                    # Wait after the last write before sampling a file
+MAX_SAMPLES_PER_WINDOW = 600        # Cap on sampling I/O during a burst; rates are still counted
+REMEMBERED_FILES = 200000           # Previous entropy kept for this many files (LRU)
+POLL_INTERVAL_SEC = 300.0           # Stat-scan interval for trees inotify doesn't cover
+
+# Formats whose content is normally near-random already
+COMPRESSED_EXTS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".heif", ".mp4", ".mov", ".m4v", ".mkv",
+    ".avi", ".mp3", ".m4a", ".aac", ".ogg", ".flac", ".zip", ".7z", ".gz", ".bz2", ".xz", ".rar",
+    ".docx", ".xlsx", ".pptx", ".odt", ".ods", ".pdf", ".jar", ".apk", ".deb", ".dng", ".cr2", ".nef",
+}
+# Extension -> (offset, magic bytes) that an intact file starts with
+MAGIC = {
+    ".jpg": (0, b"\xff\xd8\xff"), ".jpeg": (0, b"\xff\xd8\xff"),
+    ".png": (0, b"\x89PNG"), ".gif": (0, b"GIF8"), ".pdf": (0, b"%PDF"),
+    ".zip": (0, b"PK"), ".docx": (0, b"PK"), ".xlsx": (0, b"PK"), ".pptx": (0, b"PK"),
+    ".odt": (0, b"PK"), ".ods": (0, b"PK"), ".7z": (0, b"7z\xbc\xaf"), ".gz": (0, b"\x1f\x8b"),
+    ".mp4": (4, b"ftyp"), ".mov": (4, b"ftyp"), ".m4v": (4, b"ftyp"), ".heic": (4, b"ftyp"),
+    ".mkv": (0, b"\x1a\x45\xdf\xa3"),
+}
+
+logger = logging.getLogger("entropy_watch")
+
+def setup_logging(debug):
+    logging.basicConfig(level=logging.DEBUG if debug else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+
+def shannon_entropy(data):
+    """Bits per byte of data, 0 to 8."""
+    if not data:
+        return 0.0
+    n = len(data)
+    return -sum(c / n * math.log2(c / n) for c in Counter(data).values())
+
+def sample_file(path):
+    """(entropy of a few spread-out blocks, first block), or None if unreadable or too small."""
+    try:
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < MIN_SAMPLE_BYTES:
+                return None
+            if size <= BLOCK_SIZE * SAMPLE_BLOCKS:
+                data = f.read(size)
+                return shannon_entropy(data), data[:BLOCK_SIZE]
+            step = (size - BLOCK_SIZE) // (SAMPLE_BLOCKS - 1) if SAMPLE_BLOCKS > 1 else 0
+            blocks = []
+            for i in range(SAMPLE_BLOCKS):
+                f.seek(i * step)
+                blocks.append(f.read(BLOCK_SIZE))
+            return shannon_entropy(b"".join(blocks)), blocks[0]
+    except OSError:
+        return None
+
+# ------------------ inotify ------------------
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+class Inotify:
+    """Recursive inotify watches through libc; raises OSError where inotify is unavailable."""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            e = ctypes.get_errno()
+            raise OSError(e, os.strerror(e))
+        self.paths = {}         # wd -> directory
+        self.uncovered = set()  # Trees left to the stat poller after hitting the watch limit
+
+    def add_tree(self, root):
+        """Watch root and every directory under it. If the watch limit is hit part way, the
+        tree's watches are dropped again and the whole tree goes to the stat poller."""
+        added = []
+        for dirpath, _, _ in os.walk(root):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), WATCH_MASK)
+            if wd < 0:
+                e = ctypes.get_errno()
+                if e == errno.ENOSPC:
+                    if not self.uncovered:
+                        logger.warning("inotify watch limit reached (raise fs.inotify.max_user_watches); "
+                                       f"stat-polling {root} instead")
+                    for wd in added:
+                        self.libc.inotify_rm_watch(self.fd, wd)
+                        self.paths.pop(wd, None)
+                    self.uncovered.add(root)
+                    return False
+                if e not in (errno.ENOENT, errno.EACCES):
+                    logger.warning(f"Can't watch {dirpath}: {os.strerror(e)}")
+                continue
+            self.paths[wd] = dirpath
+            added.append(wd)
+        return True
+
+    def read_events(self):
+        """Yield (mask, path) for the events queued right now."""
+        try:
+            buf = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return
+        pos = 0
+        while pos + EVENT_HEADER.size <= len(buf):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buf, pos)
+            pos += EVENT_HEADER.size
+            name = buf[pos:pos + length].rstrip(b"\0")
+            pos += length
+            if mask & IN_Q_OVERFLOW:
+                yield mask, None
+                continue
+            directory = self.paths.get(wd)
+            if mask & IN_IGNORED:
+                self.paths.pop(wd, None)
+                continue
+            if directory is None:
+                continue
+            yield mask, os.path.join(directory, os.fsdecode(name)) if name else directory
+
+    def close(self):
+        os.close(self.fd)
+
+class StatPoller:
+    """Finds changed, new and removed files by comparing stat snapshots."""
+
+    def __init__(self):
+        self.snapshot = {}     # root -> {path: (mtime_ns, size, inode)}
+
+    def scan(self, roots):
+        """Yield (kind, path) for each root since its last scan; a root's first scan only records."""
+        for root in roots:
+            seen = {}
+            stack = [root]
+            while stack:
+                try:
+                    with os.scandir(stack.pop()) as it:
+                        for entry in it:
+                            try:
+                                if entry.is_dir(follow_symlinks=False):
+                                    stack.append(entry.path)
+                                elif entry.is_file(follow_symlinks=False):
+                                    st = entry.stat(follow_symlinks=False)
+                                    seen[entry.path] = (st.st_mtime_ns, st.st_size, st.st_ino)
+                            except OSError:
+                                continue
+                except OSError:
+                    continue
+            old = self.snapshot.get(root)
+            self.snapshot[root] = seen
+            if old is None:
+                continue
+            for path, sig in seen.items():
+                before = old.get(path)
+                if before is None:
+                    yield "renamed", path  # A new name: created or moved in
+                elif before != sig:
+                    yield "modified", path
+            for path in old.keys() - seen.keys():
+                yield "deleted", path
+
+# ------------------ Detection ------------------
+class Detector:
+    """Sliding-window counts and the alert decision."""
+
+    def __init__(self, window, rate_threshold, share_threshold):
+        self.window = window
+        self.rate_threshold = rate_threshold
+        self.share_threshold = share_threshold
+        self.changes = deque()     # (time, kind, path)
+        self.samples = deque()     # (time, path, entropy, reason or None)
+        self.pending = OrderedDict()  # path -> time of last write, sampled after SETTLE_SEC
+        self.previous = OrderedDict()  # path -> last entropy seen
+        self.last_alert = None
+        self.overflowed = None     # Time the inotify queue last overflowed
+
+    def record(self, kind, path, now):
+        if kind == "overflow":
+            self.overflowed = now
+            return
+        self.changes.append((now, kind, path))
+        if kind in ("modified", "renamed"):
+            self.pending[path] = now
+            self.pending.move_to_end(path)
+        elif kind == "deleted":
+            self.pending.pop(path, None)
+            self.previous.pop(path, None)
+
+    def expire(self, now):
+        cutoff = now - self.window
+        while self.changes and self.changes[0][0] < cutoff:
+            self.changes.popleft()
+        while self.samples and self.samples[0][0] < cutoff:
+            self.samples.popleft()
+
+    def classify(self, path, entropy, head):
+        ext = os.path.splitext(path)[1].lower()
+        magic = MAGIC.get(ext)
+        if magic and head[magic[0]:magic[0] + len(magic[1])] != magic[1]:
+            return "header"
+        if entropy >= HIGH_ENTROPY_BITS and ext not in COMPRESSED_EXTS:
+            return "random"
+        prev = self.previous.get(path)
+        if prev is not None and entropy - prev >= ENTROPY_JUMP_BITS:
+            return "jump"
+        return None
+
+    def sample_due(self, now):
+        """Sample files that have been quiet for SETTLE_SEC, within the per-window budget."""
+        while self.pending:
+            path, written = next(iter(self.pending.items()))
+            if now - written < SETTLE_SEC:
+                break
+            del self.pending[path]
+            if len(self.samples) >= MAX_SAMPLES_PER_WINDOW:
+                continue
+            sampled = sample_file(path)
+            if sampled is None:
+                continue
+            entropy, head = sampled
+            reason = self.classify(path, entropy, head)
+            self.samples.append((now, path, entropy, reason))
+            self.previous[path] = entropy
+            self.previous.move_to_end(path)
+            while len(self.previous) > REMEMBERED_FILES:
+                self.previous.popitem(last=False)
+            if reason:
+                logger.debug(f"Suspicious rewrite ({reason}, {entropy:.2f} bits/byte): {path}")
+
+    def check(self, now):
+        """Alert text if a threshold is crossed and the cooldown has passed, else None."""
+        self.expire(now)
+        if self.last_alert is not None and now - self.last_alert < ALERT_COOLDOWN_SEC:
+            return None
+        reasons = []
+        if self.overflowed is not None and now - self.overflowed < self.window:
+            reasons.append("more file events than the kernel could queue (inotify overflow)")
+        if len(self.changes) >= self.rate_threshold:
+            reasons.append(f"{len(self.changes)} files changed in {self.window:.0f}s (threshold {self.rate_threshold})")
+        suspicious = [s for s in self.samples if s[3]]
+        if len(self.samples) >= MIN_SAMPLED and len(suspicious) / len(self.samples) >= self.share_threshold:
+            reasons.append(f"{len(suspicious)}/{len(self.samples)} sampled rewrites look encrypted "
+                           f"(threshold {self.share_threshold:.0%})")
+        if not reasons:
+            return None
+        self.last_alert = now
+        return self.report(reasons, suspicious)
+
+    def report(self, reasons, suspicious):
+        kinds = Counter(kind for _, kind, _ in self.changes)
+        dirs = Counter(os.path.dirname(path) for _, _, path in self.changes)
+        lines = ["Possible ransomware activity detected:", ""]
+        lines += [f"  - {r}" for r in reasons]
+        lines += ["", f"Changes in the last {self.window:.0f}s: " +
+                  ", ".join(f"{n} {k}" for k, n in kinds.most_common())]
+        lines += ["", "Busiest directories:"] + [f"  {n:6d}  {d}" for d, n in dirs.most_common(10)]
+        if suspicious:
+            lines += ["", "Suspicious rewrites (reason, bits/byte):"]
+            lines += [f"  {reason:6s} {entropy:.2f}  {path}" for _, path, entropy, reason in suspicious[:20]]
+        lines += ["", "Check the shares now, and stop Samba if files are being encrypted."]
+        return "\n".join(lines)
+
+def send_alert(body, dry_run):
+    subject = f"Ransomware warning on {socket.gethostname()}"
+    logger.warning(f"{subject}\n{body}")
+    if dry_run:
+        return
+    if not os.path.isfile(ALERT_SPOOL):
+        logger.error(f"Can't email the alert: {ALERT_SPOOL} missing")
+        return
+    # Same call as RmS.sh; runs in a thread so the event queue keeps draining
+    def run():
+        try:
+            subprocess.run([sys.executable, ALERT_SPOOL, "send", "--source", "Entropy_Watch.py",
+                            "--subject", subject, "--body-file", "-"],
+                           input=body, text=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.error(f"Failed to send alert email: {e}")
+    threading.Thread(target=run, daemon=True).start()
+
+def ignored(path):
+    return any(fnmatch.fnmatch(path, g) for g in IGNORE_GLOBS)
+
+def watch(roots, detector, use_inotify, poll_interval, dry_run):
+    notify = None
+    if use_inotify:
+        try:
+            notify = Inotify()
+            for root in roots:
+                notify.add_tree(root)
+            logger.info(f"Watching {len(notify.paths)} directories with inotify")
+        except OSError as e:
+            logger.warning(f"inotify unavailable ({e}); stat-polling every {poll_interval:.0f}s")
+            notify = None
+    poller = StatPoller()
+
+    def poll_roots():
+        return list(roots) if notify is None else sorted(notify.uncovered)
+
+    for _ in poller.scan(poll_roots()):
+        pass  # Baseline
+    next_poll = time.monotonic() + poll_interval
+
+    while True:
+        if notify is not None:
+            ready, _, _ = select.select([notify.fd], [], [], 1.0)
+            if ready:
+                for mask, path in notify.read_events():
+                    now = time.monotonic()
+                    if path is None:
+                        logger.warning("inotify queue overflowed")
+                        detector.record("overflow", None, now)
+                    elif ignored(path):
+                        continue
+                    elif mask & IN_ISDIR:
+                        if mask & (IN_CREATE | IN_MOVED_TO) and not notify.add_tree(path):
+                            for _ in poller.scan([path]):
+                                pass  # Baseline for the newly polled tree
+                    elif mask & IN_CLOSE_WRITE:
+                        detector.record("modified", path, now)
+                    elif mask & IN_MOVED_TO:
+                        detector.record("renamed", path, now)
+                    elif mask & (IN_DELETE | IN_MOVED_FROM):
+                        detector.record("deleted", path, now)
+        else:
+            time.sleep(1.0)
+        now = time.monotonic()
+        if now >= next_poll:
+            for kind, path in poller.scan(poll_roots()):
+                if not ignored(path):
+                    detector.record(kind, path, now)
+            next_poll = now + poll_interval
+        detector.sample_due(now)
+        alert = detector.check(now)
+        if alert:
+            send_alert(alert, dry_run)
+
+def parse_args(argv):
+    import argparse
+    p = argparse.ArgumentParser(description="Alert on mass, high-entropy file rewrites in the NAS shares")
+    p.add_argument("paths", nargs="*", default=WATCH_PATHS, help="Directories to watch (default: WATCH_PATHS)")
+    p.add_argument("--window", type=float, default=WINDOW_SEC, help="Sliding window in seconds")
+    p.add_argument("--rate", type=int, default=RATE_THRESHOLD, help="Changed files per window that trigger an alert")
+    p.add_argument("--share", type=float, default=SHARE_THRESHOLD,
+                   help="Share of sampled rewrites that look encrypted that triggers an alert")
+    p.add_argument("--poll", action="store_true", help="Use stat polling only, not inotify")
+    p.add_argument("--poll-interval", type=float, default=POLL_INTERVAL_SEC, help="Seconds between stat scans")
+    p.add_argument("--dry-run", action="store_true", help="Log alerts without emailing")
+    p.add_argument("--debug", action="store_true")
+    return p.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    setup_logging(args.debug)
+    roots = [os.path.abspath(p) for p in args.paths if os.path.isdir(p)]
+    for p in set(args.paths) - {r for r in args.paths if os.path.isdir(r)}:
+        logger.error(f"Not a directory, skipped: {p}")
+    if not roots:
+        return 1
+    detector = Detector(args.window, args.rate, args.share)
+    try:
+        watch(roots, detector, not args.poll, args.poll_interval, args.dry_run)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
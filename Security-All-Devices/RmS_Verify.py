@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""Batched remote checksum verification for RmS.sh.
+
+Each host gets one SSH connection (a ControlMaster that the connectivity
+check opens and the verification session reuses). A small agent script is
+run there with python3, the whole manifest is streamed to it on stdin, and
+it hashes the files on a thread pool and streams one result line back per
+file as each finishes. All hosts are checked at the same time.
+
+Manifests are md5sum-style files ("<digest>  <path>"). The hash algorithm is
+picked from the digest length (md5, sha1, sha256, b2sum's blake2b, xxh64)
+unless --algo is given, so switching a host to b2sum or xxhsum manifests only
+means regenerating them. xxhash needs the python3-xxhash package on the host.
+
+With --incremental, the size and mtime of every file that hashed OK are kept
+in a local cache. Next time, files whose size and mtime are unchanged are
+not hashed again, unless their last full hash is older than --max-cache-age
+days. Anything that rewrites a file and puts its mtime back gets past the
+cache until then, so keep a full check on a schedule too.
+
+Examples:
+    python3 RmS_Verify.py --ssh "ssh -i ~/.ssh/rms" pi@10.0.0.2=/srv/sums/pi2.md5 pi@10.0.0.3=/srv/sums/pi3.md5
+    python3 RmS_Verify.py --transport local localhost=/tmp/test.md5   # no SSH, agent runs here
+"""
+
+import re
+import sys
+import json
+import time
+import shlex
+import shutil
+import sqlite3
+import tempfile
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+SSH_COMMAND = "ssh"                 # Overridden with --ssh, e.g. "ssh -i /path/to/key"
+REMOTE_PYTHON = "python3"           # Interpreter on the checked hosts
+HASH_WORKERS = 4                    # Parallel hashing threads on each host
+CONNECT_ATTEMPTS = 5                # Connectivity check retries, 1 second apart (as RmS.sh did)
+SESSION_ATTEMPTS = 3                # Reruns for files a dropped session never reported
+CONTROL_PERSIST = 60                # Seconds the SSH master outlives its last session
+CACHE_PATH = "rms_verify_cache.db"  # Used with --incremental
+CACHE_MAX_AGE_DAYS = 7.0            # Rehash cached files after this long regardless of mtime
+
+# Digest length (hex characters) -> algorithm, for --algo auto
+ALGORITHMS_BY_LENGTH = {32: "md5", 40: "sha1", 64: "sha256", 128: "blake2b", 16: "xxh64"}
+ALGORITHMS = ("md5", "sha1", "sha256", "sha512", "blake2b", "blake2b-256", "blake2s",
+              "xxh64", "xxh3_64", "xxh128")
+
+# Runs on the checked host. Reads one JSON object per line from stdin:
+# {"p": path} or {"p": path, "s": size, "m": mtime_ns} to skip hashing when the
+# file still has that size and mtime. Writes one JSON object per file with
+# "st" ok / unchanged / missing / error, in completion order. Kept to
+# python3.5-compatible stdlib so any Pi image can run it.
+AGENT = r'''
+import os, sys, json, stat, hashlib, threading
+from concurrent.futures import ThreadPoolExecutor
+
+algo, workers = sys.argv[1], int(sys.argv[2])
+CHUNK = 1 << 20
+
+def new_hash():
+    name, _, bits = algo.partition("-")
+    if name.startswith("xxh"):
+        import xxhash
+        return getattr(xxhash, name)()
+    if bits:
+        return getattr(hashlib, name)(digest_size=int(bits) // 8)
+    return hashlib.new(name)
+
+out_lock = threading.Lock()
+slots = threading.BoundedSemaphore(workers * 4)
+
+def emit(rec):
+    line = json.dumps(rec) + "\n"
+    with out_lock:
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+def check(item):
+    path = item["p"]
+    try:
+        try:
+            st = os.stat(path)
+        except (FileNotFoundError, NotADirectoryError):
+            emit({"p": path, "st": "missing"})
+            return
+        if not stat.S_ISREG(st.st_mode):
+            emit({"p": path, "st": "missing"})
+            return
+        if item.get("s") == st.st_size and item.get("m") == st.st_mtime_ns:
+            emit({"p": path, "st": "unchanged"})
+            return
+        h = new_hash()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK), b""):
+                h.update(chunk)
+        emit({"p": path, "st": "ok", "d": h.hexdigest(), "s": st.st_size, "m": st.st_mtime_ns})
+    except Exception as e:
+        emit({"p": path, "st": "error", "e": "%s: %s" % (type(e).__name__, e)})
+    finally:
+        slots.release()
+
+try:
+    new_hash()
+except Exception as e:
+    emit({"fatal": "hash %s unavailable: %s" % (algo, e)})
+    sys.exit(3)
+
+with ThreadPoolExecutor(max_workers=workers) as pool:
+    for line in sys.stdin.buffer:
+        if line.strip():
+            slots.acquire()
+            pool.submit(check, json.loads(line.decode("ascii")))
+'''
+
+# GNU coreutils format, with the leading backslash it adds for names containing \ or newline
+MANIFEST_LINE = re.compile(r"^(\\?)([0-9A-Fa-f]+) [ *](.*)$")
+
+print_lock = threading.Lock()
+
+def say(msg):
+    with print_lock:
+        print(msg, flush=True)
+
+def read_manifest(path):
+    """Return ({file: digest}, [bad line numbers]) for an md5sum-style manifest."""
+    entries, bad = {}, []
+    with open(path, "r", encoding="utf-8", errors="surrogateescape") as f:
+        for n, line in enumerate(f, 1):
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            m = MANIFEST_LINE.match(line)
+            if not m:
+                bad.append(n)
+                continue
+            name = m.group(3)
+            if m.group(1):
+                name = name.replace("\\n", "\n").replace("\\\\", "\\")
+            entries[name] = m.group(2).lower()
+    return entries, bad
+
+def detect_algorithm(entries):
+    lengths = {len(d) for d in entries.values()}
+    if len(lengths) == 1:
+        return ALGORITHMS_BY_LENGTH.get(lengths.pop())
+    return None
+
+# ------------------ Cache ------------------
+def open_cache(path):
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS verified (
+            host TEXT NOT NULL,
+            path TEXT NOT NULL,
+            algo TEXT NOT NULL,
+            digest TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            verified_at REAL NOT NULL,
+            PRIMARY KEY (host, path)
+        )""")
+    return conn
+
+def cache_hints(conn, host, algo, entries, max_age_days):
+    """{path: (size, mtime_ns)} for files last hashed OK with the digest the manifest still expects."""
+    cutoff = time.time() - max_age_days * 86400
+    hints = {}
+    for path, digest, size, mtime_ns in conn.execute(
+        "SELECT path, digest, size, mtime_ns FROM verified WHERE host=? AND algo=? AND verified_at>=?",
+        (host, algo, cutoff),
+    ):
+        if entries.get(path) == digest:
+            hints[path] = (size, mtime_ns)
+    return hints
+
+def storable(path):
+    # sqlite can't hold the lone surrogates that undecodable file names read as
+    try:
+        path.encode("utf-8")
+        return True
+    except UnicodeEncodeError:
+        return False
+
+def update_cache(conn, result):
+    now = time.time()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO verified (host, path, algo, digest, size, mtime_ns, verified_at) VALUES (?,?,?,?,?,?,?)",
+            [(result.host, p, result.algo, d, s, m, now) for p, (d, s, m) in result.hashed.items() if storable(p)],
+        )
+        conn.executemany("DELETE FROM verified WHERE host=? AND path=?", [(result.host, p) for p in result.bad if storable(p)])
+
+# ------------------ Transport ------------------
+class SshTransport:
+    """One ControlMaster connection per host, shared by the check and the session."""
+
+    def __init__(self, ssh_command):
+        self.base = shlex.split(ssh_command)
+        self.control_dir = tempfile.mkdtemp(prefix="rms-verify-")
+
+    def options(self):
+        return self.base + [
+            "-o", "BatchMode=yes",
+            "-o", "ControlMaster=auto",
+            "-o", f"ControlPath={self.control_dir}/%C",
+            "-o", f"ControlPersist={CONTROL_PERSIST}",
+            "-o", "ServerAliveInterval=15",
+            "-o", "ServerAliveCountMax=4",
+        ]
+
+    def connect(self, host):
+        for attempt in range(CONNECT_ATTEMPTS):
+            if attempt:
+                time.sleep(1)
+            r = subprocess.run(self.options() + ["-n", host, "true"],
+                               stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            if r.returncode == 0:
+                return True
+        return False
+
+    def agent_command(self, host, algo, workers):
+        remote = f"{REMOTE_PYTHON} -c {shlex.quote(AGENT)} {shlex.quote(algo)} {int(workers)}"
+        return self.options() + [host, remote]
+
+    def close(self, hosts):
+        for host in hosts:
+            subprocess.run(self.options() + ["-O", "exit", host],
+                           stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        shutil.rmtree(self.control_dir, ignore_errors=True)
+
+class LocalTransport:
+    """Runs the agent as a local subprocess; the host name is only a label."""
+
+    def connect(self, host):
+        return True
+
+    def agent_command(self, host, algo, workers):
+        return [sys.executable, "-c", AGENT, algo, str(int(workers))]
+
+    def close(self, hosts):
+        pass
+
+# ------------------ Verification ------------------
+class HostResult:
+    def __init__(self, host, manifest):
+        self.host = host
+        self.manifest = manifest
+        self.algo = None
+        self.errors = []     # Lines for the RmS error log
+        self.ok = 0
+        self.unchanged = 0
+        self.hashed = {}     # path -> (digest, size, mtime_ns) for files that hashed OK
+        self.bad = set()     # Paths to drop from the cache
+        self.seconds = 0.0
+
+def run_session(transport, host, algo, workers, items, on_record):
+    """Stream items to one agent session; returns (exit status, stderr tail)."""
+    proc = subprocess.Popen(transport.agent_command(host, algo, workers),
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stderr_tail = deque(maxlen=5)
+
+    def feed():
+        try:
+            for item in items:
+                proc.stdin.write(json.dumps(item).encode("ascii") + b"\n")
+            proc.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass  # Session died; the unreported files are retried
+
+    def drain_stderr():
+        for line in proc.stderr:
+            stderr_tail.append(line.decode("utf-8", "replace").rstrip())
+
+    threads = [threading.Thread(target=feed, daemon=True), threading.Thread(target=drain_stderr, daemon=True)]
+    for t in threads:
+        t.start()
+    for line in proc.stdout:
+        try:
+            on_record(json.loads(line))
+        except ValueError:
+            stderr_tail.append(line.decode("utf-8", "replace").rstrip())
+    status = proc.wait()
+    for t in threads:
+        t.join(timeout=5)
+    return status, list(stderr_tail)
+
+def verify_host(transport, host, manifest, algo, workers, hints, verbose):
+    result = HostResult(host, manifest)
+    started = time.monotonic()
+    say(f"Checking files on {host} using {manifest}")
+    try:
+        entries, bad_lines = read_manifest(manifest)
+    except OSError as e:
+        result.errors.append(f"{host}: cannot read manifest {manifest}: {e}")
+        return result
+    for n in bad_lines:
+        result.errors.append(f"{host}: unreadable line {n} in {manifest}")
+    result.algo = algo if algo != "auto" else detect_algorithm(entries)
+    if entries and result.algo is None:
+        result.errors.append(f"{host}: cannot tell the hash algorithm of {manifest}; pass --algo")
+        return result
+    if not entries:
+        return result
+    if not transport.connect(host):
+        say(f"Could not connect to {host}, skipping.")
+        result.errors.append(f"{host}: connection failed after retries")
+        return result
+
+    pending = set(entries)
+
+    def on_record(rec):
+        if "fatal" in rec:
+            result.errors.append(f"{host}: {rec['fatal']}")
+            return
+        path, status = rec["p"], rec["st"]
+        if path not in pending:
+            return
+        pending.discard(path)
+        if status == "unchanged":
+            result.ok += 1
+            result.unchanged += 1
+            if verbose:
+                say(f"{host}: {path}: OK (unchanged)")
+        elif status == "ok" and rec["d"] == entries[path]:
+            result.ok += 1
+            result.hashed[path] = (rec["d"], rec["s"], rec["m"])
+            if verbose:
+                say(f"{host}: {path}: OK")
+        elif status == "ok":
+            result.bad.add(path)
+            say(f"{host}: {path}: FAILED")
+            result.errors.append(f"{host}: checksum mismatch for {path} file tampered with or corrupted check device")
+        elif status == "missing":
+            result.bad.add(path)
+            say(f"{host}: {path}: MISSING")
+            result.errors.append(f"{host}: {path} missing")
+        else:
+            result.bad.add(path)
+            say(f"{host}: {path}: ERROR ({rec.get('e')})")
+            result.errors.append(f"{host}: failed to compute checksum for {path}")
+
+    for attempt in range(SESSION_ATTEMPTS):
+        if attempt:
+            time.sleep(1)
+            say(f"{host}: session ended with {len(pending)} files unchecked, retrying")
+        items = [dict(p=p, s=hints[p][0], m=hints[p][1]) if p in hints else {"p": p} for p in sorted(pending)]
+        status, stderr_tail = run_session(transport, host, result.algo, workers, items, on_record)
+        if not pending or status == 3:  # 3: the agent cannot use this hash, retrying won't help
+            break
+    if pending:
+        detail = f" ({stderr_tail[-1]})" if stderr_tail else ""
+        result.errors.append(f"{host}: session failed{detail}, {len(pending)} files unchecked")
+    if pending and status != 3:
+        for path in sorted(pending):
+            result.errors.append(f"{host}: failed to compute checksum for {path}")
+    result.seconds = time.monotonic() - started
+    return result
+
+def parse_target(spec):
+    import argparse
+    host, sep, manifest = spec.partition("=")
+    if not sep or not host or not manifest:
+        raise argparse.ArgumentTypeError(f"expected HOST=MANIFEST, got {spec!r}")
+    return host, manifest
+
+def parse_args(argv):
+    import argparse
+    p = argparse.ArgumentParser(description="Verify checksum manifests on remote hosts, one batched session per host")
+    p.add_argument("targets", nargs="+", type=parse_target, metavar="HOST=MANIFEST",
+                   help="SSH destination and the manifest of files to check on it")
+    p.add_argument("--ssh", default=SSH_COMMAND, help="SSH command, e.g. \"ssh -i /path/to/key\"")
+    p.add_argument("--transport", choices=("ssh", "local"), default="ssh",
+                   help="local runs the agent here instead of over SSH (for testing)")
+    p.add_argument("--algo", choices=("auto",) + ALGORITHMS, default="auto",
+                   help="Hash used in the manifests (default: from the digest length)")
+    p.add_argument("--workers", type=int, default=HASH_WORKERS, help="Hashing threads per host")
+    p.add_argument("--incremental", action="store_true",
+                   help="Skip files whose size and mtime match their last good hash")
+    p.add_argument("--cache", default=CACHE_PATH, help="Cache database for --incremental")
+    p.add_argument("--max-cache-age", type=float, default=CACHE_MAX_AGE_DAYS,
+                   help="Days before a cached file is hashed again anyway")
+    p.add_argument("--errors-file", help="Write one line per error here (for RmS.sh)")
+    p.add_argument("--verbose", action="store_true", help="Also print files that checked OK")
+    return p.parse_args(argv)
+
+def main(argv):
+    args = parse_args(argv)
+    transport = LocalTransport() if args.transport == "local" else SshTransport(args.ssh)
+    cache = open_cache(args.cache) if args.incremental else None
+    hosts = [host for host, _ in args.targets]
+
+    jobs = []
+    try:
+        with ThreadPoolExecutor(max_workers=len(args.targets)) as pool:
+            for host, manifest in args.targets:
+                hints = {}
+                if cache is not None:
+                    try:
+                        entries, _ = read_manifest(manifest)
+                        algo = args.algo if args.algo != "auto" else detect_algorithm(entries)
+                        hints = cache_hints(cache, host, algo, entries, args.max_cache_age)
+                    except OSError:
+                        pass  # verify_host reports the unreadable manifest
+                jobs.append(pool.submit(verify_host, transport, host, manifest, args.algo,
+                                        args.workers, hints, args.verbose))
+        results = [j.result() for j in jobs]
+    finally:
+        transport.close(hosts)
+
+    errors = []
+    for r in results:
+        errors.extend(r.errors)
+        if cache is not None and r.algo:
+            update_cache(cache, r)
+        checked = r.ok + len(r.bad)
+        cached = f" ({r.unchanged} unchanged since last check)" if args.incremental else ""
+        say(f"{r.host}: {r.ok}/{checked} OK{cached}, {len(r.errors)} errors in {r.seconds:.1f}s")
+    if cache is not None:
+        cache.close()
+    say("All files checked.")
+
+    if args.errors_file:
+        with open(args.errors_file, "w", encoding="utf-8", errors="surrogateescape") as f:
+            for e in errors:
+                f.write(e.replace("\n", "\\n") + "\n")
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main(sys.argv[1:]))
@@ -0,0 +1,775 @@
+#!/usr/bin/env python3
+"""Size-balanced, memory-aware parallel rsync for Backupscript.sh.
+
+Backupscript.sh used to start one rsync per user directory, all at once. The
+biggest user set the finishing time, and the parallel receivers pushed the
+1 GB backup Pi into memory pressure. This script instead:
+
+	1. Walks SOURCE/<dir> for every backup directory and splits it, below the
+	   user level, into work units of about --unit-gb each. A directory that
+	   fits becomes one entry; a bigger one is split into its subdirectories
+	   and its loose files, recursively. The pieces are packed first-fit
+	   decreasing into units, so every unit is close to the target size.
+	2. Runs the units largest-first from a shared queue, so whichever rsync
+	   finishes first picks up the next piece and small units fill the tail.
+	   Each unit is one rsync -r --files-from into SNAPSHOT.partial/, hard
+	   linking unchanged files against latest/ as before.
+	3. Every PROBE_INTERVAL_SEC, reads MemAvailable on the receiver (which is
+	   also the health check) and the transfer rate. Concurrency drops when
+	   the receiver is short of memory, and rises by one while it has memory
+	   to spare and the last increase paid off in throughput. If memory goes
+	   critical, the newest rsync is stopped and its unit requeued.
+	4. Promotes the snapshot atomically once every unit has succeeded:
+	   SNAPSHOT.partial is renamed to SNAPSHOT, and latest is replaced by
+	   renaming a new symlink over it. Then stale .partial directories are
+	   removed and the retention policy is applied.
+
+Most runs don't need rsync to walk both trees at all. A local index
+(backup_index.db, modelled on the files/directories tables of
+share_detections.db) records the path, size and mtime of everything the
+latest snapshot holds. Each run stats the source into temp tables and
+diffs them against the index. The new snapshot is then built on the
+receiver as a cp -al copy of latest, with deleted paths removed, and only
+the new and changed files are sent with --files-from. The index is updated
+only after the snapshot is promoted. A full link-dest run as above happens
+instead when there is no index or latest isn't the indexed snapshot, when
+part of the source can't be read (so it isn't mistaken for deleted), every
+--full-every-days as a safety net, or with --full. The index compares only
+size and mtime, so permission and ownership changes, and directory metadata,
+reach the backup with the next full run.
+
+With --catalog, the snapshot is also recorded in Snapshot_Catalog.py on the
+receiver once promoted (from the change list on change-set runs), and the
+catalog applies the retention policy instead of find.
+
+On failure it exits non-zero with the reason on stderr (and in --details-file),
+and Backupscript.sh emails it as before.
+
+Example:
+	python3 Backup_Orchestrator.py --source /mnt/nasdata --destination /mnt/backup \\
+		--ssh "ssh -i /home/pi/.ssh/backup" --device pi@backup.local user_1 user_2 common
+	python3 Backup_Orchestrator.py --source /mnt/nasdata --plan user_1 user_2   # print the units only
+"""
+import os
+import re
+import sys
+import time
+import shlex
+import signal
+import sqlite3
+import logging
+import tempfile
+import threading
+import subprocess
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+# ------------------ Configuration Constants ------------------
+SSH_COMMAND: str = "ssh"                    # Backupscript.sh passes its SSHKEY
+SSH_KEEPALIVE_OPTS: List[str] = ["-o", "ServerAliveInterval=60", "-o", "ServerAliveCountMax=5", "-o", "TCPKeepAlive=yes"]
+RETENTION_DAYS: int = 56                    # Snapshots older than this are deleted
+UNIT_GB: float = 8.0                        # Target size of one work unit
+UNIT_MAX_FILES: int = 20000                 # ...and most files in one unit
+MIN_JOBS: int = 1                           # Concurrent rsyncs never drop below this
+MAX_JOBS: int = 4                           # ...or rise above this
+START_JOBS: int = 2
+MEM_CRITICAL_MB: int = 80                   # Receiver MemAvailable below this: stop the newest rsync
+MEM_LOW_MB: int = 160                       # ...below this: one rsync fewer
+MEM_HIGH_MB: int = 320                      # ...above this: one more may be tried
+GAIN_REQUIRED: float = 1.10                 # An extra rsync must raise throughput by 10% to stay
+GROW_HOLD_PROBES: int = 5                   # Probes to wait after an increase that didn't pay off
+PROBE_INTERVAL_SEC: float = 30.0
+HEALTH_ATTEMPTS: int = 3                    # Failed probes in a row before the backup is aborted
+UNIT_ATTEMPTS: int = 3                      # rsync attempts per unit
+RETRY_DELAY_SEC: float = 15.0
+RSYNC_OPTS: List[str] = ["-a", "-r", "-z", "--partial", "--append-verify", "--timeout=120", "--info=progress2", "--from0"]
+RSYNC_VANISHED: int = 24                    # "some files vanished before they could be transferred"
+# Change-set runs write into a cp -al copy of latest, whose files are shared with older snapshots:
+# rsync must replace changed files (never --append into them) and not recurse into listed directories
+CHANGESET_RSYNC_OPTS: List[str] = [o for o in RSYNC_OPTS if o not in ("-r", "--append-verify")]
+INDEX_PATH: str = "backup_index.db"         # What the latest snapshot holds, per file
+FULL_EVERY_DAYS: float = 28.0               # Full link-dest backup at least this often, as a safety net
+INDEX_BATCH: int = 5000                     # Rows per executemany while walking
+REMOTE_PYTHON: str = "python3"              # Runs Snapshot_Catalog.py on the receiver
+
+logger = logging.getLogger("backup")
+
+def setup_logging(debug: bool) -> None:
+	handler = logging.StreamHandler(sys.stdout)
+	handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", "%Y-%m-%d %H:%M:%S"))
+	logger.addHandler(handler)
+	logger.setLevel(logging.DEBUG if debug else logging.INFO)
+
+class BackupError(Exception):
+	pass
+
+def human_bytes(n: float) -> str:
+	for unit in ("B", "KB", "MB", "GB"):
+		if n < 1000:
+			return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+		n /= 1000
+	return f"{n:.2f} TB"
+
+# ------------------ Planning ------------------
+class DirNode:
+	__slots__ = ("rel", "own_bytes", "own_files", "total_bytes", "total_files", "children")
+
+	def __init__(self, rel: str):
+		self.rel = rel
+		self.own_bytes = 0
+		self.own_files = 0
+		self.total_bytes = 0
+		self.total_files = 0
+		self.children: List["DirNode"] = []
+
+def scan_tree(source: str, rel: str) -> DirNode:
+	"""Sizes of rel (relative to source) and everything below it, per directory."""
+	node = DirNode(rel)
+	try:
+		with os.scandir(os.path.join(source, rel)) as it:
+			for entry in it:
+				try:
+					if entry.is_dir(follow_symlinks=False):
+						node.children.append(scan_tree(source, os.path.join(rel, entry.name)))
+					else:
+						node.own_bytes += entry.stat(follow_symlinks=False).st_size
+						node.own_files += 1
+				except OSError:
+					continue
+	except OSError as e:
+		logger.warning(f"Can't read {os.path.join(source, rel)}: {e}")
+	node.total_bytes = node.own_bytes + sum(c.total_bytes for c in node.children)
+	node.total_files = node.own_files + 1 + sum(c.total_files for c in node.children)
+	return node
+
+class Unit:
+	"""One rsync: entries relative to SOURCE; directories ending in / are copied recursively."""
+
+	def __init__(self):
+		self.entries: List[str] = []
+		self.bytes = 0
+		self.files = 0
+		self.attempts = 0
+
+	def describe(self) -> str:
+		first = self.entries[0].rstrip("/") if self.entries else "-"
+		more = f" +{len(self.entries) - 1}" if len(self.entries) > 1 else ""
+		return f"{first}{more} ({human_bytes(self.bytes)}, {self.files} files)"
+
+def split_items(source: str, node: DirNode, target_bytes: int, max_files: int) -> List[Tuple[List[str], int, int]]:
+	"""(entries, bytes, files) pieces no bigger than the targets, unless a single file is."""
+	if node.total_bytes <= target_bytes and node.total_files <= max_files:
+		return [([node.rel + "/"], node.total_bytes, node.total_files)]
+	items = []
+	for child in node.children:
+		items.extend(split_items(source, child, target_bytes, max_files))
+	if node.own_files:
+		# Loose files of an oversized directory, chunked by name
+		files = []
+		try:
+			with os.scandir(os.path.join(source, node.rel)) as it:
+				for entry in it:
+					try:
+						if not entry.is_dir(follow_symlinks=False):
+							files.append((entry.name, entry.stat(follow_symlinks=False).st_size))
+					except OSError:
+						continue
+		except OSError as e:
+			logger.warning(f"Can't read {os.path.join(source, node.rel)}: {e}")
+		files.sort()
+		chunk, size = [], 0
+		for name, st_size in files:
+			if chunk and (size + st_size > target_bytes or len(chunk) >= max_files):
+				items.append((chunk, size, len(chunk)))
+				chunk, size = [], 0
+			chunk.append(os.path.join(node.rel, name))
+			size += st_size
+		if chunk:
+			items.append((chunk, size, len(chunk)))
+	elif not node.children:
+		items.append(([node.rel + "/"], 0, 1))
+	return items
+
+def plan_units(source: str, directories: List[str], target_bytes: int, max_files: int) -> List[Unit]:
+	"""Size-balanced units for all directories, largest first."""
+	items = []
+	for d in directories:
+		if not os.path.isdir(os.path.join(source, d)):
+			raise BackupError(f"Backup directory {os.path.join(source, d)} does not exist")
+		items.extend(split_items(source, scan_tree(source, d), target_bytes, max_files))
+	items.sort(key=lambda it: it[1], reverse=True)
+	units: List[Unit] = []
+	for entries, size, files in items:
+		# First fit decreasing; units are few, so a linear search is fine
+		for unit in units:
+			if unit.bytes + size <= target_bytes and unit.files + files <= max_files:
+				break
+		else:
+			unit = Unit()
+			units.append(unit)
+		unit.entries.extend(entries)
+		unit.bytes += size
+		unit.files += files
+	units.sort(key=lambda u: u.bytes, reverse=True)
+	return units
+
+# ------------------ File Index ------------------
+def open_index(path: str) -> sqlite3.Connection:
+	"""Backup index: the files and directories the latest snapshot holds, as last seen here."""
+	conn = sqlite3.connect(path, timeout=30)
+	conn.execute("PRAGMA journal_mode=WAL")
+	conn.executescript(
+		"""
+		CREATE TABLE IF NOT EXISTS files (
+			path TEXT PRIMARY KEY,
+			size INTEGER NOT NULL,
+			mtime_ns INTEGER NOT NULL
+		) WITHOUT ROWID;
+		CREATE TABLE IF NOT EXISTS dirs (
+			path TEXT PRIMARY KEY
+		) WITHOUT ROWID;
+		CREATE TABLE IF NOT EXISTS meta (
+			key TEXT PRIMARY KEY,
+			value TEXT
+		);
+		CREATE TEMP TABLE IF NOT EXISTS seen_files (
+			path TEXT PRIMARY KEY,
+			size INTEGER NOT NULL,
+			mtime_ns INTEGER NOT NULL
+		) WITHOUT ROWID;
+		CREATE TEMP TABLE IF NOT EXISTS seen_dirs (
+			path TEXT PRIMARY KEY
+		) WITHOUT ROWID;
+		"""
+	)
+	return conn
+
+def get_meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+	row = conn.execute("SELECT value FROM meta WHERE key=?", (key,)).fetchone()
+	return row[0] if row else None
+
+def walk_source(conn: sqlite3.Connection, source: str, directories: List[str]) -> Tuple[int, List[str]]:
+	"""Stat everything under the backup directories into the seen_* temp tables; returns (files seen, unreadable paths)."""
+	conn.execute("DELETE FROM seen_files")
+	conn.execute("DELETE FROM seen_dirs")
+	files: List[Tuple[str, int, int]] = []
+	dirs: List[Tuple[str]] = []
+	errors: List[str] = []
+	count = 0
+
+	def flush() -> None:
+		conn.executemany("INSERT OR REPLACE INTO seen_files VALUES (?,?,?)", files)
+		conn.executemany("INSERT OR REPLACE INTO seen_dirs VALUES (?)", dirs)
+		files.clear()
+		dirs.clear()
+
+	for top in directories:
+		stack = [top]
+		while stack:
+			rel = stack.pop()
+			dirs.append((rel,))
+			try:
+				with os.scandir(os.path.join(source, rel)) as it:
+					for entry in it:
+						try:
+							if entry.is_dir(follow_symlinks=False):
+								stack.append(os.path.join(rel, entry.name))
+							else:
+								st = entry.stat(follow_symlinks=False)
+								files.append((os.path.join(rel, entry.name), st.st_size, st.st_mtime_ns))
+								count += 1
+						except OSError as e:
+							logger.warning(f"Can't stat {entry.path}: {e}")
+							errors.append(os.path.join(rel, entry.name))
+			except OSError as e:
+				logger.warning(f"Can't read {os.path.join(source, rel)}: {e}")
+				errors.append(rel)
+			if len(files) >= INDEX_BATCH:
+				flush()
+	flush()
+	return count, errors
+
+def index_changes(conn: sqlite3.Connection) -> Tuple[List[Tuple[str, int]], List[str], List[str]]:
+	"""(changed or new files with sizes, new directories, deleted paths) since the index was committed."""
+	changed = conn.execute(
+		"""
+		SELECT s.path, s.size FROM seen_files s LEFT JOIN files f ON f.path = s.path
+		WHERE f.path IS NULL OR f.size != s.size OR f.mtime_ns != s.mtime_ns
+		"""
+	).fetchall()
+	new_dirs = [r[0] for r in conn.execute(
+		"SELECT path FROM seen_dirs s WHERE NOT EXISTS (SELECT 1 FROM dirs d WHERE d.path = s.path)")]
+	deleted = [r[0] for r in conn.execute(
+		"SELECT path FROM files f WHERE NOT EXISTS (SELECT 1 FROM seen_files s WHERE s.path = f.path)")]
+	# Directories last, deepest first, so each is empty or already gone when removed
+	deleted += sorted((r[0] for r in conn.execute(
+		"SELECT path FROM dirs d WHERE NOT EXISTS (SELECT 1 FROM seen_dirs s WHERE s.path = d.path)")), reverse=True)
+	return changed, new_dirs, deleted
+
+def commit_index(conn: sqlite3.Connection, snapshot: str, directories: List[str], full: bool) -> None:
+	"""Make the walk the new index, once its snapshot is promoted."""
+	with conn:
+		conn.execute("DELETE FROM files WHERE NOT EXISTS (SELECT 1 FROM seen_files s WHERE s.path = files.path)")
+		conn.execute(
+			"""
+			INSERT OR REPLACE INTO files (path, size, mtime_ns)
+			SELECT s.path, s.size, s.mtime_ns FROM seen_files s LEFT JOIN files f ON f.path = s.path
+			WHERE f.path IS NULL OR f.size != s.size OR f.mtime_ns != s.mtime_ns
+			"""
+		)
+		conn.execute("DELETE FROM dirs WHERE NOT EXISTS (SELECT 1 FROM seen_dirs s WHERE s.path = dirs.path)")
+		conn.execute("INSERT OR IGNORE INTO dirs (path) SELECT path FROM seen_dirs")
+		meta = {"snapshot": snapshot, "directories": "\n".join(directories)}
+		if full:
+			meta["last_full"] = str(time.time())
+		conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", meta.items())
+
+def change_units(changed: List[Tuple[str, int]], new_dirs: List[str], target_bytes: int, max_files: int) -> List[Unit]:
+	"""Chunk the change list in path order, so each unit mostly touches a few directories."""
+	entries = sorted([(d, 0) for d in new_dirs] + changed)
+	units: List[Unit] = []
+	unit = Unit()
+	for path, size in entries:
+		if unit.entries and (unit.bytes + size > target_bytes or unit.files >= max_files):
+			units.append(unit)
+			unit = Unit()
+		unit.entries.append(path)
+		unit.bytes += size
+		unit.files += 1
+	if unit.entries:
+		units.append(unit)
+	units.sort(key=lambda u: u.bytes, reverse=True)
+	return units
+
+def full_reason(args, conn: sqlite3.Connection, latest_snapshot: Optional[str], unreadable: List[str]) -> Optional[str]:
+	"""Why this run must be a full link-dest backup, or None for a change-set run."""
+	if args.full:
+		return "--full given"
+	if unreadable:
+		# What the walk missed would look deleted; never turn that into deletions
+		return f"{len(unreadable)} paths could not be read, e.g. {unreadable[0]}"
+	if latest_snapshot is None:
+		return "no latest snapshot"
+	indexed = get_meta(conn, "snapshot")
+	if indexed is None:
+		return "no backup index yet"
+	if indexed != latest_snapshot:
+		return f"index is for {indexed}, latest is {latest_snapshot}"
+	if get_meta(conn, "directories") != "\n".join(args.directories):
+		return "backup directories changed"
+	last_full = float(get_meta(conn, "last_full") or 0)
+	if time.time() - last_full > args.full_every_days * 86400:
+		return f"last full backup over {args.full_every_days:g} days ago"
+	return None
+
+# ------------------ Remote ------------------
+class Remote:
+	def __init__(self, ssh_command: str, device: str):
+		self.ssh = shlex.split(ssh_command) + SSH_KEEPALIVE_OPTS
+		self.device = device
+
+	def run(self, cmd: str, attempts: int = 3, delay: float = 2.0, timeout: Optional[float] = 120.0, data: Optional[bytes] = None) -> str:
+		"""Run cmd on the receiver with retries, like ssh_run in Backupscript.sh; data goes to its stdin."""
+		err = ""
+		stdin_opts = [] if data is not None else ["-n"]
+		for attempt in range(1, attempts + 1):
+			try:
+				r = subprocess.run(self.ssh + ["-o", "ConnectTimeout=10", *stdin_opts, self.device, cmd],
+					input=data, capture_output=True, timeout=timeout)
+				if r.returncode == 0:
+					return r.stdout.decode("utf-8", "replace")
+				err = r.stderr.decode("utf-8", "replace").strip() or f"exit {r.returncode}"
+			except subprocess.TimeoutExpired:
+				err = f"timed out after {timeout:.0f}s"
+			logger.info(f"SSH attempt {attempt}/{attempts} failed for: {cmd}")
+			if attempt < attempts:
+				time.sleep(delay)
+		raise BackupError(f"ssh {self.device} -- {cmd} failed: {err}")
+
+	def probe(self, destination: str) -> int:
+		"""Health check plus receiver MemAvailable in MB."""
+		q = shlex.quote(destination)
+		out = self.run(
+			f"test -d {q} && touch {q}/.health_check && rm {q}/.health_check && grep MemAvailable /proc/meminfo",
+			attempts=1, timeout=30,
+		)
+		m = re.search(r"MemAvailable:\s+(\d+)", out)
+		return int(m.group(1)) // 1024 if m else MEM_HIGH_MB
+
+# ------------------ Scheduling ------------------
+PROGRESS_BYTES = re.compile(rb"^\s*([\d,]+)\s+\d+%")
+
+class Scheduler:
+	"""Shared largest-first queue, a movable concurrency limit, and rsync workers."""
+
+	def __init__(self, units: List[Unit], rsync_cmd, jobs: int):
+		self.queue: Deque[Unit] = deque(units)
+		self.rsync_cmd = rsync_cmd  # unit, files-from path -> argv
+		self.limit = jobs
+		self.cond = threading.Condition()
+		self.running: Dict[int, Tuple[Unit, subprocess.Popen]] = {}  # order started -> (unit, proc)
+		self.active = 0             # units taken by workers and not yet finished (counted against limit)
+		self.requeued = set()       # ids of processes stopped for memory
+		self.started = 0
+		self.failed: List[str] = []
+		self.aborted: Optional[str] = None
+		self.progress_bytes = 0     # rsync progress summed over all units
+		self.done_units = 0
+
+	def take(self) -> Optional[Unit]:
+		with self.cond:
+			while True:
+				if self.aborted or (not self.queue and not self.active) or self.failed:
+					return None
+				if self.queue and self.active < self.limit:
+					# Reserve the slot now; the rsync only shows up in running once it has started
+					self.active += 1
+					return self.queue.popleft()
+				self.cond.wait(1.0)
+
+	def worker(self) -> None:
+		while True:
+			unit = self.take()
+			if unit is None:
+				with self.cond:
+					self.cond.notify_all()
+				return
+			try:
+				self.run_unit(unit)
+			finally:
+				with self.cond:
+					self.active -= 1
+					self.cond.notify_all()
+
+	def run_unit(self, unit: Unit) -> None:
+		fd, list_path = tempfile.mkstemp(prefix="backup-unit-")
+		with os.fdopen(fd, "wb") as f:
+			for entry in unit.entries:
+				f.write(os.fsencode(entry) + b"\0")
+		try:
+			while True:
+				unit.attempts += 1
+				with self.cond:
+					if self.aborted:
+						return
+					proc = subprocess.Popen(self.rsync_cmd(unit, list_path), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+					self.started += 1
+					key = self.started
+					self.running[key] = (unit, proc)
+				stderr = bytearray()
+				drain = threading.Thread(target=lambda: stderr.extend(proc.stderr.read()), daemon=True)
+				drain.start()
+				last = 0
+				for line in iter_progress(proc.stdout):
+					m = PROGRESS_BYTES.match(line)
+					if m:
+						value = int(m.group(1).replace(b",", b""))
+						with self.cond:
+							self.progress_bytes += max(0, value - last)
+						last = value
+				code = proc.wait()
+				drain.join()
+				with self.cond:
+					del self.running[key]
+					requeued = key in self.requeued
+					self.requeued.discard(key)
+					if requeued:
+						# Stopped to relieve the receiver; --partial keeps what it had
+						unit.attempts -= 1
+						self.queue.appendleft(unit)
+					elif code in (0, RSYNC_VANISHED):
+						if code == RSYNC_VANISHED:
+							logger.info(f"Some files vanished during the copy of {unit.describe()}")
+						self.done_units += 1
+					self.cond.notify_all()
+				if requeued or code in (0, RSYNC_VANISHED) or self.aborted:
+					# Killed by abort(): the abort reason is the failure, not this unit
+					return
+				err = stderr.decode("utf-8", "replace").strip().splitlines()
+				detail = err[-1] if err else f"exit {code}"
+				logger.info(f"rsync for {unit.describe()} failed (exit {code}) on attempt {unit.attempts}/{UNIT_ATTEMPTS}: {detail}")
+				if unit.attempts >= UNIT_ATTEMPTS:
+					with self.cond:
+						self.failed.append(f"{unit.describe()}: {detail}")
+						self.cond.notify_all()
+					return
+				time.sleep(RETRY_DELAY_SEC)
+		finally:
+			os.unlink(list_path)
+
+	def stop_newest(self) -> None:
+		with self.cond:
+			if len(self.running) <= MIN_JOBS:
+				return
+			key = max(self.running)
+			unit, proc = self.running[key]
+			self.requeued.add(key)
+			logger.info(f"Receiver memory critical; pausing {unit.describe()}")
+			proc.terminate()
+
+	def abort(self, reason: str) -> None:
+		with self.cond:
+			self.aborted = reason
+			for _, proc in self.running.values():
+				proc.terminate()
+			self.cond.notify_all()
+
+	def finished(self) -> bool:
+		with self.cond:
+			return self.aborted is not None or bool(self.failed) or (not self.queue and not self.active)
+
+def iter_progress(stream):
+	"""Lines of rsync output, splitting on the carriage returns progress2 uses."""
+	buf = b""
+	while True:
+		chunk = stream.read1(65536) if hasattr(stream, "read1") else stream.read(65536)
+		if not chunk:
+			break
+		buf += chunk
+		parts = re.split(rb"[\r\n]", buf)
+		buf = parts.pop()
+		yield from parts
+	if buf:
+		yield buf
+
+class ConcurrencyController:
+	"""Hill-climbs the rsync count on receiver memory and measured throughput."""
+
+	def __init__(self, sched: Scheduler, probe):
+		self.sched = sched
+		self.probe = probe          # () -> MemAvailable MB, raises BackupError if unhealthy
+		self.last_bytes = 0
+		self.last_time = time.monotonic()
+		self.before_grow: Optional[float] = None  # Throughput before the last increase
+		self.hold = 0
+		self.failures = 0
+
+	def step(self) -> None:
+		try:
+			mem = self.probe()
+			self.failures = 0
+		except BackupError as e:
+			self.failures += 1
+			logger.info(f"Health check attempt {self.failures}/{HEALTH_ATTEMPTS} failed: {e}")
+			if self.failures >= HEALTH_ATTEMPTS:
+				self.sched.abort(f"Remote filesystem became unavailable during backup: {e}")
+			return
+		now = time.monotonic()
+		with self.sched.cond:
+			rate = (self.sched.progress_bytes - self.last_bytes) / max(now - self.last_time, 1e-6)
+			self.last_bytes, self.last_time = self.sched.progress_bytes, now
+			limit = self.sched.limit
+		new = limit
+		if mem < MEM_CRITICAL_MB:
+			new = max(MIN_JOBS, limit // 2)
+			self.sched.stop_newest()
+			self.hold = GROW_HOLD_PROBES
+		elif mem < MEM_LOW_MB:
+			new = max(MIN_JOBS, limit - 1)
+			self.hold = GROW_HOLD_PROBES
+		elif self.before_grow is not None:
+			# Judge the last increase now that it has run for a probe interval
+			if rate < self.before_grow * GAIN_REQUIRED:
+				new = max(MIN_JOBS, limit - 1)
+				self.hold = GROW_HOLD_PROBES
+			self.before_grow = None
+		elif self.hold > 0:
+			self.hold -= 1
+		elif mem > MEM_HIGH_MB and limit < MAX_JOBS and len(self.sched.queue) > 0:
+			new = limit + 1
+			self.before_grow = rate
+		if new != limit:
+			logger.info(f"Receiver MemAvailable {mem} MB, {rate / 1e6:.1f} MB/s: concurrency {limit} -> {new}")
+			with self.sched.cond:
+				self.sched.limit = new
+				self.sched.cond.notify_all()
+		else:
+			logger.debug(f"Receiver MemAvailable {mem} MB, {rate / 1e6:.1f} MB/s, {limit} rsyncs")
+
+def transfer(units: List[Unit], rsync_cmd, probe, jobs: int) -> Scheduler:
+	sched = Scheduler(units, rsync_cmd, jobs)
+	controller = ConcurrencyController(sched, probe)
+	workers = [threading.Thread(target=sched.worker, daemon=True) for _ in range(MAX_JOBS)]
+	for w in workers:
+		w.start()
+	next_probe = time.monotonic() + PROBE_INTERVAL_SEC
+	try:
+		while not sched.finished():
+			time.sleep(1.0)
+			if time.monotonic() >= next_probe:
+				controller.step()
+				next_probe = time.monotonic() + PROBE_INTERVAL_SEC
+	except BaseException:
+		# SIGTERM or Ctrl-C: don't leave rsyncs writing into the snapshot
+		sched.abort("interrupted")
+		raise
+	if sched.failed or sched.aborted:
+		# Stop whatever is still copying before reporting
+		sched.abort(sched.aborted or "unit failed")
+	for w in workers:
+		w.join()
+	return sched
+
+# ------------------ Snapshot ------------------
+def promote(remote: Remote, destination: str, snapshot: str) -> None:
+	"""Rename SNAPSHOT.partial into place and swap latest with a rename, both atomic."""
+	snap = shlex.quote(f"{destination}/snapshots/{snapshot}")
+	partial = shlex.quote(f"{destination}/snapshots/{snapshot}.partial")
+	latest = shlex.quote(f"{destination}/latest")
+	tmp_link = shlex.quote(f"{destination}/.latest.tmp")
+	remote.run(f"mv -T {partial} {snap} && ln -sfn {snap} {tmp_link} && mv -T {tmp_link} {latest} && chmod 775 {latest}")
+
+def catalog_command(catalog: str, destination: str, *args: str) -> str:
+	return " ".join(shlex.quote(a) for a in (REMOTE_PYTHON, catalog, "--root", destination, *args))
+
+def record_snapshot(remote: Remote, catalog: str, destination: str, snapshot: str, base: Optional[str],
+		changes: Optional[Tuple[List[Tuple[str, int]], List[str]]]) -> None:
+	"""Add the promoted snapshot to the catalog; a failure only costs a walk on the next run."""
+	if changes is None:
+		cmd, data = catalog_command(catalog, destination, "record", snapshot), None
+	else:
+		changed, deleted = changes
+		cmd = catalog_command(catalog, destination, "record", snapshot, "--base", base, "--changes", "-")
+		data = b"".join(b"+" + os.fsencode(p) + b"\0" for p, _ in changed) + b"".join(b"-" + os.fsencode(p) + b"\0" for p in deleted)
+	try:
+		remote.run(cmd, attempts=1, data=data, timeout=None)
+	except BackupError as e:
+		logger.warning(f"Could not record {snapshot} in the snapshot catalog: {e}")
+
+def cleanup(remote: Remote, destination: str, retention_days: int, catalog: Optional[str] = None) -> None:
+	snaps = shlex.quote(f"{destination}/snapshots/")
+	remote.run(f"find {snaps} -mindepth 1 -maxdepth 1 -type d -name '*.partial' -exec rm -r {{}} +")
+	logger.info(f"Removed stale .partial directories. Now applying retention policy of {retention_days} days")
+	if catalog:
+		# Catalogues any snapshot it missed, then deletes by snapshot time (never latest), several trees at once
+		remote.run(catalog_command(catalog, destination, "sync"), timeout=None)
+		remote.run(catalog_command(catalog, destination, "prune", "--older-than-days", str(retention_days)), timeout=None)
+		return
+	latest = shlex.quote(f"{destination}/latest")
+	# Never the snapshot latest points at, however old its directory mtime
+	remote.run(
+		f"keep=$(readlink -f {latest}); find {snaps} -mindepth 1 -maxdepth 1 -type d -mtime +{int(retention_days)} "
+		f"! -path \"$keep\" -exec rm -rf {{}} +"
+	)
+
+# ------------------ Main ------------------
+def parse_args(argv: List[str]):
+	import argparse
+	p = argparse.ArgumentParser(description="Size-balanced parallel rsync of the NAS into a new snapshot")
+	p.add_argument("directories", nargs="+", help="Directories under --source to back up (e.g. the user shares)")
+	p.add_argument("--source", required=True, help="Local directory holding the backup directories")
+	p.add_argument("--destination", help="Backup root on the receiver (holds snapshots/ and latest)")
+	p.add_argument("--ssh", default=SSH_COMMAND, help="SSH command, e.g. \"ssh -i /path/to/key\"")
+	p.add_argument("--device", help="user@host of the receiver")
+	p.add_argument("--snapshot-name", default=time.strftime("Backup_%Y-%m-%d_%H-%M-%S"))
+	p.add_argument("--retention-days", type=int, default=RETENTION_DAYS)
+	p.add_argument("--unit-gb", type=float, default=UNIT_GB, help="Target size of one work unit")
+	p.add_argument("--unit-max-files", type=int, default=UNIT_MAX_FILES)
+	p.add_argument("--jobs", type=int, default=START_JOBS, help=f"Concurrent rsyncs to start with ({MIN_JOBS}-{MAX_JOBS})")
+	p.add_argument("--index", default=INDEX_PATH, help="Backup index database (kept on this machine)")
+	p.add_argument("--full", action="store_true", help="Full link-dest backup even if the index allows a change-set run")
+	p.add_argument("--full-every-days", type=float, default=FULL_EVERY_DAYS, help="Force a full backup after this many days; in between, only size and mtime changes are picked up")
+	p.add_argument("--catalog", help="Path of Snapshot_Catalog.py on the receiver; records snapshots and prunes with it")
+	p.add_argument("--plan", action="store_true", help="Print the work units and exit")
+	p.add_argument("--details-file", help="Write the failure reason here (Backupscript.sh emails it)")
+	p.add_argument("--debug", action="store_true")
+	args = p.parse_args(argv)
+	if not args.plan and not (args.destination and args.device):
+		p.error("--destination and --device are required unless --plan is given")
+	args.jobs = min(MAX_JOBS, max(MIN_JOBS, args.jobs))
+	return args
+
+def run_backup(args) -> None:
+	for d in args.directories:
+		if not os.path.isdir(os.path.join(args.source, d)):
+			raise BackupError(f"Backup directory {os.path.join(args.source, d)} does not exist")
+	target_bytes = int(args.unit_gb * 1e9)
+	conn = open_index(args.index)
+	t = time.monotonic()
+	seen, unreadable = walk_source(conn, args.source, args.directories)
+	changed, new_dirs, deleted = index_changes(conn)
+	logger.info(
+		f"Walked {seen} files in {time.monotonic() - t:.0f}s: {len(changed)} new or changed "
+		f"({human_bytes(sum(size for _, size in changed))}), {len(deleted)} deleted since the indexed snapshot"
+	)
+
+	if args.plan:
+		# Assumes latest on the receiver is still the indexed snapshot
+		reason = full_reason(args, conn, get_meta(conn, "snapshot"), unreadable)
+		if reason:
+			logger.info(f"Would run a full backup: {reason}")
+			units = plan_units(args.source, args.directories, target_bytes, args.unit_max_files)
+		else:
+			units = change_units(changed, new_dirs, target_bytes, args.unit_max_files)
+		for u in units:
+			print(u.describe())
+		return
+
+	remote = Remote(args.ssh, args.device)
+	snapshots = f"{args.destination}/snapshots"
+	partial = f"{snapshots}/{args.snapshot_name}.partial"
+	latest = f"{args.destination}/latest"
+	q_latest = shlex.quote(latest)
+	latest_snapshot = remote.run(f"if test -e {q_latest}; then basename \"$(readlink -f {q_latest})\"; fi").strip() or None
+	logger.info(f"Detected latest directory at {latest} ({latest_snapshot})" if latest_snapshot else "No latest directory detected")
+
+	reason = full_reason(args, conn, latest_snapshot, unreadable)
+	if reason:
+		logger.info(f"Full backup: {reason}")
+		t = time.monotonic()
+		units = plan_units(args.source, args.directories, target_bytes, args.unit_max_files)
+		logger.info(f"Planned {len(units)} units, {human_bytes(sum(u.bytes for u in units))}, in {time.monotonic() - t:.0f}s")
+		opts = RSYNC_OPTS + ([f"--link-dest={latest}"] if latest_snapshot else [])
+		remote.run(f"mkdir -p {shlex.quote(partial)}")
+	else:
+		# Start from a hard-link copy of latest, then apply only what changed
+		units = change_units(changed, new_dirs, target_bytes, args.unit_max_files)
+		logger.info(f"Change-set backup: {len(units)} units, {len(deleted)} deletions")
+		opts = CHANGESET_RSYNC_OPTS
+		q_partial = shlex.quote(partial)
+		# cp -a gives the new root latest's mtime; touch it so mtime-based retention dates it from today
+		remote.run(f"rm -rf {q_partial} && mkdir -p {q_partial} && cp -al {q_latest}/. {q_partial}/ && touch {q_partial}", timeout=None)
+		if deleted:
+			remote.run(f"cd {q_partial} && xargs -0 rm -rf --",
+				data=b"\0".join(os.fsencode(p) for p in deleted) + b"\0", timeout=None)
+
+	rsh = " ".join(shlex.quote(a) for a in remote.ssh)
+
+	def rsync_cmd(unit: Unit, list_path: str) -> List[str]:
+		return ["rsync", *opts, f"--files-from={list_path}", "-e", rsh,
+			os.path.join(args.source, ""), f"{args.device}:{partial}/"]
+
+	if units:
+		sched = transfer(units, rsync_cmd, lambda: remote.probe(args.destination), args.jobs)
+		if sched.aborted:
+			raise BackupError(sched.aborted)
+		if sched.failed:
+			raise BackupError("One or more rsync jobs failed:\n" + "\n".join(sched.failed))
+	logger.info(f"Rsync of {len(units)} units done. Now finishing snapshot and symbolic link to latest directory")
+	promote(remote, args.destination, args.snapshot_name)
+	commit_index(conn, args.snapshot_name, args.directories, full=reason is not None)
+	conn.close()
+	logger.info("Successful creation of snapshot folder and linking to latest directory")
+	if args.catalog:
+		record_snapshot(remote, args.catalog, args.destination, args.snapshot_name, latest_snapshot,
+			None if reason else (changed, deleted))
+	cleanup(remote, args.destination, args.retention_days, args.catalog)
+	logger.info("Retention policy applied backup completed")
+
+def main(argv: List[str]) -> int:
+	args = parse_args(argv)
+	setup_logging(args.debug)
+	# Let SIGTERM (e.g. from a stopped cron job or systemd) unwind so running rsyncs are stopped
+	signal.signal(signal.SIGTERM, lambda *_: sys.exit(143))
+	try:
+		run_backup(args)
+	except BackupError as e:
+		logger.error(str(e))
+		if args.details_file:
+			with open(args.details_file, "w") as f:
+				f.write(str(e) + "\n")
+		return 1
+	return 0
+
+if __name__ == "__main__":
+	raise SystemExit(main(sys.argv[1:]))
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""Offline throughput benchmark for Detectionalgorithm.py.
+
+Builds a synthetic media tree, swaps the YOLO model for a fake detector with
+configurable latency, and times the scan phases (walk, diff, scan, reconcile)
+over a fixed sequence of scenarios:
+
+	cold     first scan into an empty database
+	rescan   nothing changed
+	changed  1% of files rewritten
+	deleted  10% of files removed
+	diff     1% new files, run with --diff
+
+Results are written as JSON so runs can be compared across commits. Needs
+numpy and opencv-python-headless, but no model weights or network.
+
+Example:
+	python Detection_Benchmark.py --files 10000 --videos 10 --output bench.json
+	python Detection_Benchmark.py --files 1000000 --size-kb 8 --per-image-ms 0 --work-dir /mnt/hdd/bench
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import platform
+import subprocess
+from typing import List, Optional
+
+import numpy as np
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import Detectionalgorithm as detection  # noqa: E402
+
+SCENARIOS = ("cold", "rescan", "changed", "deleted", "diff")
+FILES_PER_DIR: int = 200          # Synthetic files per leaf directory
+VIDEO_SECONDS: int = 3            # Length of each synthetic video
+VIDEO_FPS: int = 30
+VIDEO_SIZE = (320, 240)
+WORK_SUBDIR = "bench-work"        # Created and removed inside --work-dir
+
+# ------------------ Fake Detector ------------------
+class FakeBox:
+	def __init__(self, cls_id: int, conf: float, xyxy: list):
+		self.cls = cls_id
+		self.conf = conf
+		self.xyxy = np.array([xyxy], dtype=np.float32)
+
+class FakeResult:
+	def __init__(self, boxes: list):
+		self.boxes = boxes
+
+class FakeDetector:
+	"""Stand-in for ultralytics.YOLO with the call shape Detectionalgorithm uses.
+
+	Each call sleeps call_overhead_ms plus per_image_ms per input, so batching
+	gains show up as they would on a real CPU model. Roughly hit_rate of
+	inputs get a person and/or dog box.
+	"""
+	names = {0: "person", 16: "dog"}
+
+	def __init__(self, call_overhead_ms: float, per_image_ms: float, hit_rate: float = 0.3, seed: int = 0):
+		self.call_overhead = call_overhead_ms / 1000.0
+		self.per_image = per_image_ms / 1000.0
+		self.hit_rate = hit_rate
+		self.rng = random.Random(seed)
+		self.calls = 0
+		self.images = 0
+
+	def __call__(self, source, verbose: bool = False) -> List[FakeResult]:
+		sources = source if isinstance(source, list) else [source]
+		self.calls += 1
+		self.images += len(sources)
+		delay = self.call_overhead + self.per_image * len(sources)
+		if delay > 0:
+			time.sleep(delay)
+		results = []
+		for _ in sources:
+			boxes = []
+			if self.rng.random() < self.hit_rate:
+				boxes.append(FakeBox(self.rng.choice((0, 16)), self.rng.uniform(0.4, 0.95), [10.0, 20.0, 200.0, 300.0]))
+			results.append(FakeResult(boxes))
+		return results
+
+# ------------------ Synthetic Tree ------------------
+def base_jpeg() -> bytes:
+	"""A small smooth JPEG; padding after its EOI marker sets each file's size."""
+	x = np.linspace(0, 255, 640, dtype=np.uint8)
+	img = np.dstack([np.tile(x, (480, 1))] * 3)
+	ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 80])
+	if not ok:
+		raise RuntimeError("OpenCV could not encode the base JPEG")
+	return buf.tobytes()
+
+def leaf_dir(root: str, index: int) -> str:
+	"""users/<user>/<year>/<batch> layout similar to the phone-sync folders."""
+	leaf = index // FILES_PER_DIR
+	return os.path.join(root, f"user_{leaf % 4}", str(2015 + (leaf // 4) % 10), f"batch_{leaf:05d}")
+
+def write_image(path: str, jpeg: bytes, size: int, rng: random.Random) -> None:
+	# A random tail keeps every file's sha256 unique
+	tail = rng.getrandbits(128).to_bytes(16, "little")
+	pad = max(0, size - len(jpeg) - len(tail))
+	with open(path, "wb") as f:
+		f.write(jpeg)
+		f.write(tail)
+		if pad:
+			f.write(b"\0" * pad)
+
+def write_video(path: str, seed: int) -> None:
+	rng = np.random.default_rng(seed)
+	writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), VIDEO_FPS, VIDEO_SIZE)
+	frame = (rng.random((VIDEO_SIZE[1], VIDEO_SIZE[0], 3)) * 255).astype(np.uint8)
+	for i in range(VIDEO_SECONDS * VIDEO_FPS):
+		writer.write(np.roll(frame, i * 4, axis=1))
+	writer.release()
+
+def generate_tree(root: str, files: int, size_kb: int, videos: int, seed: int) -> List[str]:
+	"""Create files images (size_kb each) and videos short clips under root."""
+	rng = random.Random(seed)
+	jpeg = base_jpeg()
+	paths = []
+	for i in range(files):
+		d = leaf_dir(root, i)
+		if i % FILES_PER_DIR == 0:
+			os.makedirs(d, exist_ok=True)
+		path = os.path.join(d, f"IMG_{i:07d}.jpg")
+		write_image(path, jpeg, size_kb * 1024, rng)
+		paths.append(path)
+	for v in range(videos):
+		d = leaf_dir(root, (v * FILES_PER_DIR) % max(files, 1))
+		os.makedirs(d, exist_ok=True)
+		path = os.path.join(d, f"VID_{v:05d}.mp4")
+		write_video(path, seed + v)
+		paths.append(path)
+	return paths
+
+def mutate(paths: List[str], fraction: float, rng: random.Random) -> List[str]:
+	"""Rewrite the tail of a fraction of images so their content and mtime change."""
+	images = [p for p in paths if p.endswith(".jpg")]
+	picked = rng.sample(images, max(1, int(len(images) * fraction))) if images else []
+	for p in picked:
+		with open(p, "r+b") as f:
+			f.seek(0, os.SEEK_END)
+			f.write(rng.getrandbits(64).to_bytes(8, "little"))
+	return picked
+
+# ------------------ Scenarios ------------------
+def timed_run(root: str, model: FakeDetector, args, diff: bool = False) -> dict:
+	"""One walk/diff/scan/reconcile pass, mirroring Detectionalgorithm.main()."""
+	detection._dir_cache.clear()
+	detection.DETECTION_ERRORS.clear()
+	detection.RUN_STATS = detection.RunStats()
+	calls, images = model.calls, model.images
+	conn = detection.connect_db()
+	detection.init_db(conn)
+	stages = {}
+	t0 = time.perf_counter()
+	media = detection.walk_tree(root, conn, skip_unchanged_dirs=args.skip_unchanged_dirs)
+	stages["walk"] = time.perf_counter() - t0
+	untracked = None
+	if diff:
+		t = time.perf_counter()
+		untracked = sum(1 for _ in detection.diff_untracked(conn))
+		stages["diff"] = time.perf_counter() - t
+	t = time.perf_counter()
+	detection.scan(root, conn, model, batch_size=args.batch_size, io_threads=args.io_threads)
+	stages["scan"] = time.perf_counter() - t
+	t = time.perf_counter()
+	detection.reconcile_removed(root, conn)
+	stages["reconcile"] = time.perf_counter() - t
+	conn.close()
+	total = time.perf_counter() - t0
+	result = {
+		"seconds": {k: round(v, 4) for k, v in stages.items()},
+		"total_seconds": round(total, 4),
+		"media_files": media,
+		"files_per_sec": round(media / total, 1) if total else None,
+		"model_calls": model.calls - calls,
+		"model_images": model.images - images,
+		"errors": len(detection.DETECTION_ERRORS),
+		"stage_seconds": {k: round(v, 4) for k, v in detection.RUN_STATS.seconds.items()},
+	}
+	if untracked is not None:
+		result["untracked"] = untracked
+	return result
+
+def git_commit() -> Optional[str]:
+	try:
+		out = subprocess.run(
+			["git", "rev-parse", "--short", "HEAD"],
+			cwd=os.path.dirname(os.path.abspath(__file__)),
+			capture_output=True, text=True, timeout=10,
+		)
+		return out.stdout.strip() or None
+	except (OSError, subprocess.SubprocessError):
+		return None
+
+def run_benchmark(args) -> dict:
+	# Only ever create and delete our own child, never what else is in --work-dir
+	work = os.path.join(args.work_dir, WORK_SUBDIR)
+	root = os.path.join(work, "media")
+	if os.path.exists(work):
+		shutil.rmtree(work)
+	os.makedirs(root)
+	detection.DB_PATH = os.path.join(work, "bench.db")
+	detection.ROOT_SCAN_PATH = root
+	# The synthetic images share their pixels, so near-duplicate reuse would skip nearly all inference
+	detection.REUSE_NEAR_DUPLICATES = args.near_duplicates
+	detection.setup_logging(args.debug)
+	if not args.debug:
+		detection.logger.setLevel(logging.WARNING)
+	# Separate stream from generate_tree() so new files never repeat its content
+	rng = random.Random(args.seed + 1)
+	model = FakeDetector(args.call_overhead_ms, args.per_image_ms, seed=args.seed)
+
+	t = time.perf_counter()
+	paths = generate_tree(root, args.files, args.size_kb, args.videos, args.seed)
+	report = {
+		"commit": git_commit(),
+		"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+		"host": {"machine": platform.machine(), "python": platform.python_version(), "cpus": os.cpu_count()},
+		"params": {k: v for k, v in vars(args).items() if k not in ("output", "debug")},
+		"generate_seconds": round(time.perf_counter() - t, 2),
+		"scenarios": {},
+	}
+	for name in args.scenarios:
+		if name == "changed":
+			mutate(paths, 0.01, rng)
+		elif name == "deleted":
+			gone = set(rng.sample(paths, max(1, len(paths) // 10)))
+			for p in gone:
+				os.remove(p)
+			paths = [p for p in paths if p not in gone]
+		elif name == "diff":
+			jpeg = base_jpeg()
+			d = os.path.join(root, "new_uploads")
+			os.makedirs(d, exist_ok=True)
+			for i in range(max(1, len(paths) // 100)):
+				p = os.path.join(d, f"NEW_{i:06d}.jpg")
+				write_image(p, jpeg, args.size_kb * 1024, rng)
+				paths.append(p)
+		report["scenarios"][name] = timed_run(root, model, args, diff=(name == "diff"))
+		print(f"{name:8s} {json.dumps(report['scenarios'][name])}", file=sys.stderr)
+	if not args.keep:
+		shutil.rmtree(work, ignore_errors=True)
+	return report
+
+def parse_args(argv: List[str]):
+	import argparse
+	p = argparse.ArgumentParser(description="Synthetic, offline benchmark of the detection scan")
+	p.add_argument("--files", type=int, default=10000, help="Synthetic images to generate")
+	p.add_argument("--size-kb", type=int, default=64, help="Size of each synthetic image")
+	p.add_argument("--videos", type=int, default=5, help="Synthetic short videos to generate")
+	p.add_argument("--call-overhead-ms", type=float, default=20.0, help="Fake model latency per call")
+	p.add_argument("--per-image-ms", type=float, default=5.0, help="Fake model latency per image in a call")
+	p.add_argument("--batch-size", type=int, default=detection.BATCH_SIZE)
+	p.add_argument("--io-threads", type=int, default=detection.IO_THREADS)
+	p.add_argument("--skip-unchanged-dirs", action="store_true")
+	p.add_argument("--near-duplicates", action="store_true", help="Keep near-duplicate detection reuse on (all synthetic images qualify)")
+	p.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated subset of: " + ", ".join(SCENARIOS))
+	p.add_argument("--work-dir", default="/tmp/detection_bench", help=f"Scratch directory; the benchmark replaces only its {WORK_SUBDIR}/ inside")
+	p.add_argument("--seed", type=int, default=1)
+	p.add_argument("--keep", action="store_true", help="Keep the synthetic tree and database")
+	p.add_argument("--output", help="Write JSON results here instead of stdout")
+	p.add_argument("--debug", action="store_true")
+	args = p.parse_args(argv)
+	args.scenarios = [s for s in args.scenarios.split(",") if s]
+	unknown = set(args.scenarios) - set(SCENARIOS)
+	if unknown:
+		p.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+	return args
+
+def main(argv: List[str]) -> int:
+	args = parse_args(argv)
+	report = run_benchmark(args)
+	text = json.dumps(report, indent=2)
+	if args.output:
+		with open(args.output, "w") as f:
+			f.write(text + "\n")
+	else:
+		print(text)
+	return 0
+
+if __name__ == "__main__":
+	raise SystemExit(main(sys.argv[1:]))
@@ -5,26 +5,116 @@ Scans a root directory for image/video files, runs YOLO detection for
 people and dogs, and stores metadata + detections in SQLite.
 
 Manual test:
-	python Detectionalgorithm.py --summary --debug
+	python Detectionalgorithm.py --debug
+	python Detectionalgorithm.py --summary    # read-only; starts without loading the model
+
+--summary and --diff only read the database (and walk, for --diff); they
+never load the model or import torch/OpenCV.
+
+The query subcommand searches the database the same way, newest first and
+a page at a time (directory filters use the directory_closure table):
+	python Detectionalgorithm.py query --class dog --min-confidence 0.8 --under Photos/2023
+	python Detectionalgorithm.py query --class person --since 2024-06-01 --media-type video --json
+
+Batched inference (N images per model call, faster on the Pi 5 CPU):
+	python Detectionalgorithm.py --batch-size 8
+
+Images are decoded straight to about MODEL_INPUT_SIZE px (JPEGs by libjpeg
+at 1/2..1/8 scale, or from a big enough EXIF thumbnail) with EXIF
+orientation applied, and boxes are scaled back to full-size coordinates
+before they are stored. HEIC needs 'pillow-heif'; without it those files go
+to the model by path.
+
+Each run walks ROOT_SCAN_PATH once into temporary tables; untracked,
+changed and removed files are then found with set-based queries.
+Hashing and decoding run on --io-threads worker threads while the main thread
+runs inference, and a single writer thread commits database updates in
+batches (every COMMIT_EVERY_FILES updates or COMMIT_EVERY_SEC seconds).
+
+On multi-core hosts --workers N shards inference across N processes, each
+with its own model and a pinned share of the CPU threads; the main process
+stays the only database writer. N is scaled down (or refused) when that many
+model instances would not fit in available RAM.
+
+--backend onnx|openvino|ncnn exports MODEL_PATH once to a faster CPU format
+(optionally int8 with --int8), checks that its detections agree with the
+.pt reference on a few images, and falls back to torch if they don't. Each
+detections row records the backend and model that produced it.
+--reprocess-stale re-runs files processed under a different model or
+thresholds; a validated backend switch alone reprocesses nothing.
+
+Every run records per-stage timings (walk, stat, hash, decode, inference,
+DB write, reconcile) and throughput in the 'runs' table, optionally in a
+Prometheus node-exporter textfile (PROMETHEUS_TEXTFILE), and in the failure
+email.
+
+--queue turns the pending files into a persistent work queue, processed
+newest first (--priority) and checkpointed file by file, so an interrupted
+run loses nothing. --time-budget stops taking new files after N seconds and
+--resume drains what is left without walking again. Videos over
+FILE_TIMEOUT_SEC are abandoned (a hung worker process is killed; with a
+timeout set, inference always runs in at least one worker, even with
+--daemon), and files that fail MAX_FILE_ATTEMPTS runs in a row are skipped
+until they change.
+
+Each files row carries its photo viewer bucket (both, dog_only, person_only
+or neither), kept in step with its detections; Media_Selector.py samples it.
+
+Files whose content (sha256) already has detections from the same model and
+thresholds get a copy of those detections instead of another model run.
+Images also get a 64-bit dHash (files.phash); a burst shot within
+NEAR_DUPLICATE_MAX_DISTANCE bits of a processed image in the same directory,
+taken within NEAR_DUPLICATE_WINDOW_SEC of it, is copied the same way.
+files.reuse_kind records which rule applied.
+
+Files whose (size, mtime, inode) match their database row are not re-hashed.
+Add --skip-unchanged-dirs to also skip directories whose mtime has not moved
+since the last run (misses files edited in place), and run --verify-hashes
+occasionally to re-hash everything as an audit.
 
 Example cron (weekly Sunday 02:30):
 	30 2 * * 0 /usr/bin/python3 /path/to/Detectionalgorithm.py >> /var/log/detection.log 2>&1
 
+--daemon instead stays running with the model loaded and watches
+ROOT_SCAN_PATH with inotify. New or changed files are processed once they
+have been quiet for DAEMON_DEBOUNCE_SEC (so half-uploaded files wait), and
+deleted ones leave the database. A full scan still runs at startup and every
+DAEMON_FULL_SCAN_HOURS as a safety net, so drop the cron job when using it:
+	@reboot /usr/bin/python3 /path/to/Detectionalgorithm.py --daemon >> /var/log/detection.log 2>&1
+
 All configuration is internal (no environment variables) for simplicity.
 """
+from __future__ import annotations
+
 import os
 import sys
+import errno
 import hashlib
+import io
 import json
 import sqlite3
 import time
 import logging
+import queue
+import select
+import signal
+import struct
+import ctypes
+import ctypes.util
 import smtplib
+import subprocess
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from dataclasses import dataclass
 from email.message import EmailMessage
-from typing import List, Tuple, Optional
+from typing import TYPE_CHECKING, Iterator, List, Tuple, Optional
 
-from ultralytics import YOLO  # Requires 'ultralytics' package
-import cv2  # Requires 'opencv-python-headless'
+# ultralytics and cv2 are imported where they are used, so --summary and --diff start without them
+if TYPE_CHECKING:
+	from ultralytics import YOLO  # Requires 'ultralytics' package
 
 # ------------------ Configuration Constants ------------------
 DB_PATH: str = "share_detections.db"              # SQLite DB file
@@ -33,11 +123,50 @@ MODEL_PATH: str = "yolo11m.pt"              # Use 'yolo11n.pt' for faster, light
 SUPPORTED_IMAGE_EXT = {".jpg", ".jpeg", ".png", ".bmp", ".webp", ".gif", ".heic"}
 SUPPORTED_VIDEO_EXT = {".mp4", ".mov", ".avi", ".mpg", ".mpeg", ".wmv", ".3gp"}
 TARGET_CLASSES = {"person", "dog"}
-FRAME_SAMPLE_INTERVAL: int = 30             # Sample every Nth frame in videos
+MODEL_INPUT_SIZE: int = 640                 # Long side images are decoded to for the model (YOLO's imgsz)
+USE_EXIF_THUMBNAILS: bool = True            # Detect on an embedded EXIF thumbnail when it is at least MODEL_INPUT_SIZE
+FRAME_SAMPLE_SECONDS: float = 1.0          # Sample one video frame per N seconds of playback
+FRAME_SAMPLE_INTERVAL: int = 30             # Fallback: sample every Nth frame when the stream reports no FPS
+SEEK_MIN_GAP_FRAMES: int = 90               # Seek instead of grab() when the next sample is further than this
 MIN_CONFIDENCE: float = 0.35                # Detection confidence threshold
 LOG_PROGRESS_EVERY: int = 25                # Info log every N media files processed
 MAX_VIDEO_FRAMES: Optional[int] = None      # Cap frames processed per video (None = no cap)
 RETRY_MODEL_LOAD: int = 1                   # Retry count for model loading
+BACKEND: str = "torch"                      # torch | onnx | openvino | ncnn (override with --backend)
+BACKEND_INT8: bool = False                  # int8-quantize the exported model (onnx, openvino; override with --int8)
+BACKEND_IMGSZ: int = 640                    # Export input size
+BACKEND_INT8_CALIBRATION: Optional[str] = None  # Dataset YAML for OpenVINO int8 calibration (e.g. a local coco8.yaml)
+BACKEND_VALIDATE_IMAGES: int = 8            # Library images (plus ultralytics samples) compared against the .pt reference
+BACKEND_MIN_IOU: float = 0.7                # Box overlap for two detections to count as the same
+BACKEND_CONF_TOLERANCE: float = 0.1         # Allowed confidence difference between backend and reference
+BACKEND_MIN_AGREEMENT: float = 0.9          # Share of confident detections that must match before a backend is used
+BATCH_SIZE: int = 1                         # Images per model call (override with --batch-size)
+IO_THREADS: int = 3                         # Stat/hash/decode threads (override with --io-threads)
+PREFETCH_FILES: int = 32                    # Max files prepared ahead of inference (bounds decoded images held in RAM)
+WRITER_QUEUE_SIZE: int = 256                # Max pending DB writes before the scan waits on the writer
+COMMIT_EVERY_FILES: int = 200               # Writer commits after this many updates...
+COMMIT_EVERY_SEC: float = 5.0               # ...or after this many seconds, whichever comes first
+WORKERS: int = 0                            # Inference processes (override with --workers; 0 = in-process)
+WORKER_BASE_MEMORY_MB: int = 350            # Per-worker interpreter + torch/OpenCV runtime
+WORKER_MODEL_MEMORY_FACTOR: float = 8.0     # Per-worker resident MB per MB of weights file (weights + activations)
+MEMORY_RESERVE_MB: int = 768                # RAM left for the OS, Samba and the main process when sizing --workers
+REUSE_DETECTIONS: bool = True               # Copy detections from an identical file (same sha256) instead of re-running the model
+REUSE_RECENT_HASHES: int = 50000            # Hashes detected this run remembered for reuse before they are committed
+REUSE_NEAR_DUPLICATES: bool = True          # Copy detections from a near-identical image (burst shots) in the same directory
+NEAR_DUPLICATE_MAX_DISTANCE: int = 5        # Max differing bits between two 64-bit dHashes (files.phash) of near-duplicates
+NEAR_DUPLICATE_WINDOW_SEC: int = 30         # Max mtime difference between near-duplicates
+NEAR_DUPLICATE_RECENT: int = 512            # Images detected this run checked for near-duplicates before they are committed
+QUEUE_PRIORITY: str = "newest"              # Work queue order: newest | oldest | walk (override with --priority)
+FILE_TIMEOUT_SEC: Optional[float] = 300.0   # Give up on one file (video or image batch) after this long (None = never)
+HARD_TIMEOUT_GRACE_SEC: float = 30.0        # Extra time before a stuck worker process is killed
+MAX_FILE_ATTEMPTS: Optional[int] = 3        # Skip files that failed this many runs in a row until they change (None = always retry)
+DAEMON_DEBOUNCE_SEC: float = 5.0            # --daemon: quiet time after the last write before a file is read
+DAEMON_BATCH_FILES: int = 200               # --daemon: most settled files handed to one scan
+DAEMON_FULL_SCAN_HOURS: float = 168.0       # --daemon: full walk/scan/reconcile this often, as a safety net
+
+# ------------------ Optional Metrics Export ------------------
+# Prometheus node-exporter textfile collector target; None disables it.
+PROMETHEUS_TEXTFILE: Optional[str] = None   # e.g. "/var/lib/prometheus/node-exporter/detection.prom"
 
 # ------------------ Optional Email Alert Configuration ------------------
 # Configure these to enable failure emails. Leave EMAIL_RECIPIENTS empty to disable.
@@ -48,8 +177,12 @@ SMTP_STARTTLS: bool = True       # Use STARTTLS upgrade if True, else implicit S
 SMTP_USERNAME: str = ""          # SMTP username (optional if server allows anonymous)
 SMTP_PASSWORD: str = ""          # SMTP password or app password
 EMAIL_SENDER: str = "noreply@example.com"  # From address in emails
+# Alert_Spool.py to queue the failure email with instead (batched, retried while offline); "" sends over SMTP directly
+ALERT_SPOOL: str = ""            # e.g., "/path/to/Alert_Spool.py"
 
 # ------------------ Internal State ------------------
+ACTIVE_BACKEND: str = "torch"    # Backend in use after prepare_backend()
+ACTIVE_MODEL_PATH: Optional[str] = None  # Model file/dir in use (None = MODEL_PATH)
 LOG_BUFFER: list[str] = []       # Accumulates log lines for potential email
 DETECTION_ERRORS: list[str] = [] # Per-file detection failures
 
@@ -69,9 +202,73 @@ class BufferingStdoutHandler(logging.Handler):
 		except Exception:
 			pass
 
+class RunStats:
+	"""Per-stage timers and counters for one run. Thread-safe.
+
+	Stage times are summed across threads, so stages that run on the I/O
+	threads or worker processes (hash, decode, inference) can add up to more
+	than the wall-clock time of the run.
+	"""
+	STAGES = ("model_load", "walk", "stat", "hash", "decode", "inference", "db_write", "reconcile")
+
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.started_at = time.time()
+		self.seconds = dict.fromkeys(self.STAGES, 0.0)
+		self.counts: dict = defaultdict(int)
+
+	@contextmanager
+	def stage(self, name: str):
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.add_time(name, time.perf_counter() - start)
+
+	def add_time(self, name: str, seconds: float) -> None:
+		with self.lock:
+			self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+	def count(self, name: str, n: int = 1) -> None:
+		with self.lock:
+			self.counts[name] += n
+
+	def elapsed(self) -> float:
+		return time.time() - self.started_at
+
+	def rates(self) -> dict:
+		wall = max(self.elapsed(), 1e-9)
+		return {
+			"files_per_sec": self.counts["files_seen"] / wall,
+			"processed_per_sec": (self.counts["files_inferred"] + self.counts["files_reused"]) / wall,
+			"hash_bytes_per_sec": self.counts["bytes_hashed"] / max(self.seconds["hash"], 1e-9),
+		}
+
+	def breakdown(self) -> List[str]:
+		"""Short human-readable summary for logs and emails."""
+		wall = self.elapsed()
+		lines = [f"Wall time: {wall:.1f}s"]
+		for name in self.STAGES:
+			secs = self.seconds.get(name, 0.0)
+			if secs:
+				lines.append(f"  {name:<10} {secs:10.1f}s ({100.0 * secs / max(wall, 1e-9):5.1f}% of wall)")
+		c = self.counts
+		r = self.rates()
+		lines.append(
+			f"Files: seen {c['files_seen']}, hashed {c['files_hashed']}, inferred {c['files_inferred']}, reused {c['files_reused']}"
+		)
+		lines.append(
+			f"Throughput: {r['files_per_sec']:.1f} files/s walked, {r['processed_per_sec']:.2f} files/s processed, "
+			f"{r['hash_bytes_per_sec'] / (1 << 20):.1f} MB/s hashed"
+		)
+		return lines
+
+RUN_STATS = RunStats()
+
 def setup_logging(debug: bool) -> None:
 	level = logging.DEBUG if debug else logging.INFO
 	logger.setLevel(level)
+	logger.propagate = False  # export/runtime libraries may configure the root logger
 	handler = BufferingStdoutHandler(sys.stdout, level)
 	if not logger.handlers:
 		logger.addHandler(handler)
@@ -87,12 +284,14 @@ def connect_db() -> sqlite3.Connection:
 
 def init_db(conn: sqlite3.Connection) -> None:
 	logger.debug("Initializing database schema")
+	had_closure = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='directory_closure'").fetchone()
 	conn.executescript(
 		"""
 		CREATE TABLE IF NOT EXISTS directories (
 			id INTEGER PRIMARY KEY,
 			path TEXT UNIQUE NOT NULL,
-			parent_id INTEGER REFERENCES directories(id)
+			parent_id INTEGER REFERENCES directories(id),
+			mtime_ns INTEGER
 		);
 		CREATE TABLE IF NOT EXISTS files (
 			id INTEGER PRIMARY KEY,
@@ -101,9 +300,15 @@ def init_db(conn: sqlite3.Connection) -> None:
 			path TEXT UNIQUE NOT NULL,
 			size INTEGER,
 			mtime INTEGER,
+			inode INTEGER,
 			sha256 TEXT,
 			media_type TEXT,
 			processed_at INTEGER,
+			detector TEXT,
+			reused_from INTEGER,
+			bucket TEXT NOT NULL DEFAULT 'neither',
+			reuse_kind TEXT,
+			phash INTEGER,
 			UNIQUE(path)
 		);
 		CREATE TABLE IF NOT EXISTS detections (
@@ -112,22 +317,153 @@ def init_db(conn: sqlite3.Connection) -> None:
 			object_class TEXT NOT NULL,
 			confidence REAL NOT NULL,
 			frame_index INTEGER,
-			bbox TEXT
+			bbox TEXT,
+			backend TEXT,
+			model TEXT
 		);
 		CREATE INDEX IF NOT EXISTS idx_files_directory ON files(directory_id);
+		CREATE INDEX IF NOT EXISTS idx_files_mtime ON files(mtime);
+		CREATE INDEX IF NOT EXISTS idx_files_dir_mtime ON files(directory_id, mtime);
+		-- Every (ancestor, descendant) directory pair, including each directory with itself at depth 0
+		CREATE TABLE IF NOT EXISTS directory_closure (
+			ancestor_id INTEGER NOT NULL,
+			descendant_id INTEGER NOT NULL,
+			depth INTEGER NOT NULL,
+			PRIMARY KEY (ancestor_id, descendant_id)
+		) WITHOUT ROWID;
+		CREATE INDEX IF NOT EXISTS idx_directory_closure_descendant ON directory_closure(descendant_id);
 		CREATE INDEX IF NOT EXISTS idx_detections_file ON detections(file_id);
+		CREATE INDEX IF NOT EXISTS idx_detections_class ON detections(object_class, confidence, file_id);
+		CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files(sha256);
+		CREATE TABLE IF NOT EXISTS work_queue (
+			path TEXT PRIMARY KEY,
+			dirpath TEXT NOT NULL,
+			media_type TEXT NOT NULL,
+			size INTEGER,
+			mtime INTEGER,
+			inode INTEGER,
+			priority REAL NOT NULL
+		);
+		CREATE INDEX IF NOT EXISTS idx_work_queue_priority ON work_queue(priority, path);
+		CREATE TABLE IF NOT EXISTS file_failures (
+			path TEXT PRIMARY KEY,
+			size INTEGER,
+			mtime INTEGER,
+			attempts INTEGER NOT NULL,
+			last_error TEXT,
+			last_failed_at INTEGER
+		);
+		CREATE TABLE IF NOT EXISTS runs (
+			id INTEGER PRIMARY KEY,
+			started_at INTEGER NOT NULL,
+			finished_at INTEGER NOT NULL,
+			exit_code INTEGER,
+			root TEXT,
+			args TEXT,
+			files_seen INTEGER,
+			files_hashed INTEGER,
+			files_inferred INTEGER,
+			files_reused INTEGER,
+			bytes_hashed INTEGER,
+			errors INTEGER,
+			files_per_sec REAL,
+			bytes_per_sec REAL,
+			stages TEXT
+		);
 		"""
 	)
+	# Columns added after the first release; older databases get them here.
+	ensure_column(conn, "directories", "mtime_ns", "INTEGER")
+	ensure_column(conn, "files", "inode", "INTEGER")
+	ensure_column(conn, "files", "detector", "TEXT")
+	ensure_column(conn, "files", "reused_from", "INTEGER")
+	# How reused_from was chosen: 'identical' (same sha256) or 'near_duplicate' (close phash)
+	if ensure_column(conn, "files", "reuse_kind", "TEXT"):
+		conn.execute("UPDATE files SET reuse_kind = 'identical' WHERE reused_from IS NOT NULL")
+	ensure_column(conn, "files", "phash", "INTEGER")
+	ensure_column(conn, "detections", "backend", "TEXT")
+	ensure_column(conn, "detections", "model", "TEXT")
+	if ensure_column(conn, "files", "bucket", "TEXT NOT NULL DEFAULT 'neither'"):
+		conn.execute(f"UPDATE files SET bucket = {BUCKET_SQL.format(file_id='files.id')}")
+	conn.execute("CREATE INDEX IF NOT EXISTS idx_files_bucket ON files(media_type, bucket, id)")
+	if not had_closure and conn.execute("SELECT 1 FROM directories LIMIT 1").fetchone():
+		logger.info("Migrating database: building directory_closure")
+		conn.execute(
+			"""
+			WITH RECURSIVE c(ancestor_id, descendant_id, depth) AS (
+				SELECT id, id, 0 FROM directories
+				UNION ALL
+				SELECT d.parent_id, c.descendant_id, c.depth + 1
+				FROM c JOIN directories d ON d.id = c.ancestor_id WHERE d.parent_id IS NOT NULL
+			)
+			INSERT OR IGNORE INTO directory_closure(ancestor_id, descendant_id, depth) SELECT * FROM c
+			"""
+		)
 	conn.commit()
 
+def ensure_column(conn: sqlite3.Connection, table: str, column: str, decl: str) -> bool:
+	"""Add column to table if it is missing; True when it was added."""
+	cols = {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}
+	if column not in cols:
+		logger.info(f"Migrating database: adding {table}.{column}")
+		conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+		return True
+	return False
+
+# Viewer bucket of a file from its detections (files.bucket, see media_bucket())
+BUCKET_SQL = """CASE
+	WHEN EXISTS (SELECT 1 FROM detections d WHERE d.file_id = {file_id} AND d.object_class = 'person')
+		THEN CASE WHEN EXISTS (SELECT 1 FROM detections d WHERE d.file_id = {file_id} AND d.object_class = 'dog')
+			THEN 'both' ELSE 'person_only' END
+	WHEN EXISTS (SELECT 1 FROM detections d WHERE d.file_id = {file_id} AND d.object_class = 'dog') THEN 'dog_only'
+	ELSE 'neither'
+END"""
+
+def media_bucket(classes) -> str:
+	"""Photo viewer bucket for a set of detected class names."""
+	person, dog = "person" in classes, "dog" in classes
+	if person and dog:
+		return "both"
+	if dog:
+		return "dog_only"
+	if person:
+		return "person_only"
+	return "neither"
+
 # ------------------ Helpers ------------------
 def sha256_file(path: str, block_size: int = 1 << 20) -> str:
 	h = hashlib.sha256()
-	with open(path, "rb") as f:
-		for chunk in iter(lambda: f.read(block_size), b""):
-			h.update(chunk)
+	size = 0
+	with RUN_STATS.stage("hash"):
+		with open(path, "rb") as f:
+			for chunk in iter(lambda: f.read(block_size), b""):
+				h.update(chunk)
+				size += len(chunk)
+	RUN_STATS.count("files_hashed")
+	RUN_STATS.count("bytes_hashed", size)
 	return h.hexdigest()
 
+def image_dhash(path: str, image=None) -> Optional[int]:
+	"""64-bit difference hash (dHash) of an image, as a signed SQLite integer.
+
+	Uses the decoded BGR image when there is one, otherwise a 1/8 scale
+	grayscale decode. None if OpenCV can't read the file.
+	"""
+	import cv2  # Requires 'opencv-python-headless'
+	import numpy as np
+	if image is None:
+		gray = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+	else:
+		gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+	if gray is None:
+		return None
+	small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+	bits = int.from_bytes(np.packbits(small[:, 1:] > small[:, :-1]).tobytes(), "big")
+	return bits - (1 << 64) if bits >> 63 else bits
+
+def hamming(a: int, b: int) -> int:
+	return bin((a ^ b) & 0xFFFFFFFFFFFFFFFF).count("1")
+
 def classify_media(path: str) -> Optional[str]:
 	ext = os.path.splitext(path)[1].lower()
 	if ext in SUPPORTED_IMAGE_EXT:
@@ -138,6 +474,9 @@ def classify_media(path: str) -> Optional[str]:
 
 _dir_cache = {}
 def ensure_directory(conn: sqlite3.Connection, path: str) -> int:
+	"""Return the id of the directories row for path, creating it (and its
+	parents, and their directory_closure rows) if needed. The caller owns the
+	transaction."""
 	if path in _dir_cache:
 		return _dir_cache[path]
 	cur = conn.execute("SELECT id FROM directories WHERE path=?", (path,))
@@ -148,93 +487,532 @@ def ensure_directory(conn: sqlite3.Connection, path: str) -> int:
 	parent = os.path.dirname(path)
 	parent_id = ensure_directory(conn, parent) if parent and parent != path else None
 	cur = conn.execute("INSERT INTO directories(path, parent_id) VALUES(?, ?)", (path, parent_id))
+	dir_id = cur.lastrowid
+	# The parent's ancestors are this directory's too, one level further away
+	conn.execute(
+		"INSERT INTO directory_closure(ancestor_id, descendant_id, depth) "
+		"SELECT ancestor_id, ?, depth + 1 FROM directory_closure WHERE descendant_id = ? UNION ALL SELECT ?, ?, 0",
+		(dir_id, parent_id, dir_id, dir_id),
+	)
+	_dir_cache[path] = dir_id
+	return dir_id
+
+def lookup_directory(conn: sqlite3.Connection, path: str) -> Optional[Tuple[int, Optional[int]]]:
+	"""Return (id, mtime_ns) for a known directory, or None if it has no row yet."""
+	return conn.execute("SELECT id, mtime_ns FROM directories WHERE path=?", (path,)).fetchone()
+
+def subtree_clause(column: str, root: str) -> Tuple[str, tuple]:
+	"""SQL condition matching root and everything below it as a path range.
+
+	Unlike LIKE 'root%' this can use the UNIQUE index on path, and it does not
+	match siblings such as 'root2/'.
+	"""
+	root = root.rstrip(os.sep) or os.sep
+	prefix = root if root.endswith(os.sep) else root + os.sep
+	upper = prefix[:-1] + chr(ord(os.sep) + 1)
+	return f"({column} = ? OR ({column} >= ? AND {column} < ?))", (root, prefix, upper)
+
+def create_seen_tables(conn: sqlite3.Connection) -> None:
+	conn.executescript(
+		"""
+		DROP TABLE IF EXISTS temp.seen_dirs;
+		DROP TABLE IF EXISTS temp.seen_files;
+		CREATE TEMP TABLE seen_dirs (
+			path TEXT PRIMARY KEY,
+			mtime_ns INTEGER,
+			unchanged INTEGER NOT NULL DEFAULT 0
+		);
+		CREATE TEMP TABLE seen_files (
+			id INTEGER PRIMARY KEY,
+			path TEXT UNIQUE NOT NULL,
+			dirpath TEXT NOT NULL,
+			media_type TEXT NOT NULL,
+			size INTEGER,
+			mtime INTEGER,
+			inode INTEGER
+		);
+		"""
+	)
+
+def walk_tree(root: str, conn: sqlite3.Connection, skip_unchanged_dirs: bool = False) -> int:
+	"""Walk root once, streaming what is on disk into temp tables on conn.
+
+	temp.seen_dirs gets one row per directory and temp.seen_files one row per
+	media file, with its (size, mtime, inode) fingerprint. diff_untracked(),
+	scan() and reconcile_removed() then work from these tables with set-based
+	queries, so memory stays flat however large the tree is.
+
+	With skip_unchanged_dirs, files in a directory whose mtime matches the one
+	recorded after its last complete scan are not stat'ed (their fingerprint is
+	left NULL and trusted). A directory's mtime only moves when entries are
+	added, removed or renamed, so files edited in place are missed until the
+	next run without the flag.
+
+	Returns the number of media files seen.
+	"""
+	logger.info(f"Walking {root}")
+	create_seen_tables(conn)
+	media_count = 0
+	skipped_dirs = 0
+	stat_seconds = 0.0
+	started = time.perf_counter()
+	for dirpath, _, filenames in os.walk(root, onerror=lambda e: logger.warning(f"Cannot list directory: {e}")):
+		try:
+			dir_mtime_ns = os.stat(dirpath).st_mtime_ns
+		except OSError:
+			dir_mtime_ns = None
+		known = lookup_directory(conn, dirpath) if skip_unchanged_dirs else None
+		unchanged = bool(known and dir_mtime_ns is not None and known[1] == dir_mtime_ns)
+		if unchanged:
+			skipped_dirs += 1
+			logger.debug(f"Directory unchanged, skipping file checks: {dirpath}")
+		conn.execute("INSERT INTO seen_dirs(path, mtime_ns, unchanged) VALUES(?,?,?)", (dirpath, dir_mtime_ns, int(unchanged)))
+		rows = []
+		for name in filenames:
+			path = os.path.join(dirpath, name)
+			media_type = classify_media(path)
+			if not media_type:
+				continue
+			if unchanged:
+				rows.append((path, dirpath, media_type, None, None, None))
+			else:
+				t = time.perf_counter()
+				try:
+					st = os.stat(path)
+				except OSError as e:
+					logger.debug(f"Vanished during walk: {path} ({e})")
+					continue
+				finally:
+					stat_seconds += time.perf_counter() - t
+				rows.append((path, dirpath, media_type, st.st_size, int(st.st_mtime), st.st_ino))
+			media_count += 1
+			if media_count % LOG_PROGRESS_EVERY == 0:
+				logger.debug(f"Walk progress: {media_count} media files")
+		if rows:
+			conn.executemany(
+				"INSERT INTO seen_files(path, dirpath, media_type, size, mtime, inode) VALUES(?,?,?,?,?,?)",
+				rows,
+			)
 	conn.commit()
-	_dir_cache[path] = cur.lastrowid
-	return cur.lastrowid
-
-def upsert_file(conn: sqlite3.Connection, directory_id: int, path: str) -> int:
-	st = os.stat(path)
-	sha = sha256_file(path)
-	media_type = classify_media(path)
-	cur = conn.execute("SELECT id, sha256, mtime FROM files WHERE path=?", (path,))
-	row = cur.fetchone()
+	# 'walk' is listing directories and filling the temp tables; per-file stat() is its own stage
+	RUN_STATS.add_time("stat", stat_seconds)
+	RUN_STATS.add_time("walk", time.perf_counter() - started - stat_seconds)
+	RUN_STATS.count("files_seen", media_count)
+	logger.info(f"Walk complete. Media files: {media_count}, unchanged directories skipped: {skipped_dirs}")
+	return media_count
+
+def record_walked_directories(conn: sqlite3.Connection) -> None:
+	"""Create rows for newly walked directories and store every walked mtime."""
+	new_dirs = [r[0] for r in conn.execute(
+		"SELECT s.path FROM seen_dirs s LEFT JOIN directories d ON d.path = s.path WHERE d.id IS NULL ORDER BY length(s.path)"
+	)]
+	for path in new_dirs:
+		ensure_directory(conn, path)
+	conn.execute(
+		"UPDATE directories SET mtime_ns = (SELECT s.mtime_ns FROM seen_dirs s WHERE s.path = directories.path) "
+		"WHERE path IN (SELECT path FROM seen_dirs)"
+	)
+	conn.commit()
+
+@dataclass
+class PreparedFile:
+	"""Outcome of the I/O stage (stat, hash, decode) for one media file."""
+	path: str
+	dirpath: str
+	media_type: str
+	file_id: Optional[int] = None                   # None for files without a row yet
+	stat: Optional[Tuple[int, int, int]] = None     # (size, mtime, inode) to write, if the row needs updating
+	sha256: Optional[str] = None
+	reset: bool = False                             # content changed, previous detections are stale
+	needs_inference: bool = False
+	image: object = None                            # load_image() BGR ndarray for images awaiting inference
+	scale: Optional[Tuple[float, float]] = None     # load_image() box scale back to the full-size image
+	mtime: Optional[int] = None
+	phash: Optional[int] = None                     # image_dhash() of images awaiting inference
+
+def prepare_file(
+	path: str,
+	dirpath: str,
+	media_type: str,
+	fingerprint: Optional[Tuple[int, int, int]],
+	row: Optional[tuple],
+	verify_hashes: bool,
+	decode: bool = True,
+	current_detector: Optional[str] = None,
+) -> PreparedFile:
+	"""Hash and (for images) decode one file. Runs on the I/O threads.
+
+	fingerprint is the (size, mtime, inode) recorded by the walk, or None when
+	the walk skipped the stat; row is (id, size, mtime, inode, sha256,
+	processed_at, detector) from the files table, or None for a new file.
+	With current_detector set, files processed under a different detector
+	signature are run again.
+
+	A known file whose (size, mtime, inode) still match its row is trusted
+	without reading it. Otherwise it is hashed, and its detections are only
+	invalidated when the content hash actually changed. verify_hashes forces
+	the hash for every file, and a mismatch behind an unchanged fingerprint is
+	logged as possible corruption.
+	"""
+	if fingerprint is None:
+		st = os.stat(path)
+		fingerprint = (st.st_size, int(st.st_mtime), st.st_ino)
+	item = PreparedFile(path, dirpath, media_type, mtime=fingerprint[1])
 	if row:
-		file_id, old_sha, old_mtime = row
-		if old_sha != sha or old_mtime != int(st.st_mtime):
-			logger.debug(f"File changed -> reset processed: {path}")
+		item.file_id, old_size, old_mtime, old_inode, old_sha, processed_at, old_detector = row
+		item.sha256 = old_sha
+		unchanged = (old_size, old_mtime, old_inode) == fingerprint
+		if not unchanged or verify_hashes:
+			sha = sha256_file(path)
+			if sha != old_sha:
+				if unchanged:
+					logger.warning(f"Hash changed but size/mtime/inode did not (possible corruption): {path}")
+				logger.debug(f"File changed -> reset processed: {path}")
+				item.stat, item.sha256, item.reset = fingerprint, sha, True
+			elif not unchanged:
+				logger.debug(f"Metadata changed, content identical: {path}")
+				item.stat = fingerprint
+		stale = current_detector is not None and old_detector is not None and old_detector != current_detector
+		item.needs_inference = item.reset or processed_at is None or stale
+	else:
+		item.stat, item.sha256, item.needs_inference = fingerprint, sha256_file(path), True
+	if decode and item.needs_inference and media_type == "image":
+		with RUN_STATS.stage("decode"):
+			item.image, item.scale = load_image(path)  # None if Pillow can't decode it; the model loader gets the path instead
+	if REUSE_NEAR_DUPLICATES and item.needs_inference and media_type == "image":
+		with RUN_STATS.stage("decode"):
+			item.phash = image_dhash(path, item.image)
+	return item
+
+def write_file_record(conn: sqlite3.Connection, item: PreparedFile) -> int:
+	"""Insert or update the files row described by item and return its id."""
+	if item.file_id is not None:
+		size, mtime, inode = item.stat
+		if item.reset:
 			conn.execute(
-				"UPDATE files SET size=?, mtime=?, sha256=?, media_type=?, processed_at=NULL WHERE id=?",
-				(st.st_size, int(st.st_mtime), sha, media_type, file_id),
+				"UPDATE files SET size=?, mtime=?, inode=?, sha256=?, media_type=?, processed_at=NULL WHERE id=?",
+				(size, mtime, inode, item.sha256, item.media_type, item.file_id),
 			)
-			conn.commit()
-		return file_id
+		else:
+			conn.execute("UPDATE files SET size=?, mtime=?, inode=? WHERE id=?", (size, mtime, inode, item.file_id))
+		return item.file_id
+	dir_id = ensure_directory(conn, item.dirpath)
+	size, mtime, inode = item.stat
 	cur = conn.execute(
-		"INSERT INTO files(directory_id, name, path, size, mtime, sha256, media_type, processed_at) VALUES(?,?,?,?,?,?,?,NULL)",
-		(directory_id, os.path.basename(path), path, st.st_size, int(st.st_mtime), sha, media_type),
+		"INSERT INTO files(directory_id, name, path, size, mtime, inode, sha256, media_type, processed_at) VALUES(?,?,?,?,?,?,?,?,NULL)",
+		(dir_id, os.path.basename(item.path), item.path, size, mtime, inode, item.sha256, item.media_type),
 	)
-	conn.commit()
-	logger.debug(f"New file record: {path}")
-	return cur.lastrowid
+	logger.debug(f"New file record: {item.path}")
+	item.file_id = cur.lastrowid
+	return item.file_id
 
-def needs_processing(conn: sqlite3.Connection, file_id: int) -> bool:
-	cur = conn.execute("SELECT processed_at FROM files WHERE id=?", (file_id,))
-	row = cur.fetchone()
-	return row[0] is None if row else True
+def record_file_failure(conn: sqlite3.Connection, path: str, error: str) -> None:
+	"""Count one more failed run for path. The count restarts when the file changes."""
+	try:
+		st = os.stat(path)
+		size, mtime = st.st_size, int(st.st_mtime)
+	except OSError:
+		size = mtime = None
+	row = conn.execute("SELECT size, mtime, attempts FROM file_failures WHERE path=?", (path,)).fetchone()
+	attempts = row[2] + 1 if row and (row[0], row[1]) == (size, mtime) else 1
+	conn.execute(
+		"INSERT OR REPLACE INTO file_failures(path, size, mtime, attempts, last_error, last_failed_at) VALUES(?,?,?,?,?,?)",
+		(path, size, mtime, attempts, error, int(time.time())),
+	)
+	if MAX_FILE_ATTEMPTS is not None and attempts == MAX_FILE_ATTEMPTS:
+		logger.warning(f"Failed {attempts} runs in a row, skipping until it changes: {path}")
+
+class DbWriter(threading.Thread):
+	"""Single thread owning the write connection.
+
+	Jobs arrive on a bounded queue and are applied inside one transaction that
+	is committed every COMMIT_EVERY_FILES jobs or COMMIT_EVERY_SEC seconds, so a
+	scan costs one fsync per batch instead of one per file. A failing job is
+	logged against its file and skipped; a failing commit stops the writer and
+	is re-raised to the scan from put()/close().
+	"""
+	def __init__(self):
+		super().__init__(name="db-writer", daemon=True)
+		self.jobs: queue.Queue = queue.Queue(maxsize=WRITER_QUEUE_SIZE)
+		self.error: Optional[Exception] = None
+
+	def put(self, kind: str, *args) -> None:
+		if self.error is not None:
+			raise RuntimeError(f"Database writer failed: {self.error}")
+		self.jobs.put((kind, args))
+
+	def close(self) -> None:
+		self.jobs.put(None)
+		self.join()
+		if self.error is not None:
+			raise RuntimeError(f"Database writer failed: {self.error}")
+
+	def apply(self, conn: sqlite3.Connection, kind: str, args: tuple) -> None:
+		if kind == "file":
+			write_file_record(conn, args[0])
+		elif kind == "detections":
+			item, dets = args
+			if item.file_id is None:
+				item.file_id = conn.execute("SELECT id FROM files WHERE path=?", (item.path,)).fetchone()[0]
+			store_detections(conn, item.file_id, dets, commit=False)
+		elif kind == "reuse":
+			item = args[0]
+			if item.file_id is None:
+				item.file_id = conn.execute("SELECT id FROM files WHERE path=?", (item.path,)).fetchone()[0]
+			if not copy_detections(conn, item.file_id, item.sha256):
+				logger.warning(f"Reuse source vanished, file left for the next run: {item.path}")
+		elif kind == "near_duplicate":
+			item, source_path = args
+			if item.file_id is None:
+				item.file_id = conn.execute("SELECT id FROM files WHERE path=?", (item.path,)).fetchone()[0]
+			source = conn.execute("SELECT id FROM files WHERE path=? AND processed_at IS NOT NULL", (source_path,)).fetchone()
+			if source is None:
+				logger.warning(f"Near-duplicate source vanished, file left for the next run: {item.path}")
+			else:
+				copy_detections_from(conn, item.file_id, source[0], "near_duplicate")
+		elif kind == "phash":
+			item = args[0]
+			if item.file_id is None:
+				item.file_id = conn.execute("SELECT id FROM files WHERE path=?", (item.path,)).fetchone()[0]
+			conn.execute("UPDATE files SET phash=? WHERE id=?", (item.phash, item.file_id))
+		elif kind == "done":
+			# Checkpoint: the file's results are in this same write batch
+			conn.execute("DELETE FROM work_queue WHERE path=?", args)
+			conn.execute("DELETE FROM file_failures WHERE path=?", args)
+		elif kind == "failed":
+			record_file_failure(conn, *args)
+			conn.execute("DELETE FROM work_queue WHERE path=?", args[:1])
+
+	def run(self) -> None:
+		conn = connect_db()
+		pending = 0
+		last_commit = time.monotonic()
+		try:
+			while True:
+				try:
+					job = self.jobs.get(timeout=COMMIT_EVERY_SEC)
+				except queue.Empty:
+					job = ()
+				if job is None:
+					break
+				if job:
+					kind, args = job
+					try:
+						with RUN_STATS.stage("db_write"):
+							self.apply(conn, kind, args)
+						pending += 1
+					except sqlite3.Error as e:
+						record_detection_failure(getattr(args[0], "path", args[0]), e)
+				if pending and (pending >= COMMIT_EVERY_FILES or time.monotonic() - last_commit >= COMMIT_EVERY_SEC):
+					with RUN_STATS.stage("db_write"):
+						conn.commit()
+					logger.debug(f"Writer committed {pending} updates")
+					pending = 0
+					last_commit = time.monotonic()
+			conn.commit()
+		except Exception as e:
+			logger.critical(f"Database writer stopped: {e}")
+			self.error = e
+			# Keep draining so the scan never blocks on a full queue
+			while self.jobs.get() is not None:
+				pass
+		finally:
+			conn.close()
+
+# ------------------ Image Loading ------------------
+_heif_registered = False
+
+def register_heif() -> None:
+	"""Let Pillow open HEIC/HEIF files when pillow-heif is installed."""
+	global _heif_registered
+	if _heif_registered:
+		return
+	_heif_registered = True
+	try:
+		from pillow_heif import register_heif_opener
+		register_heif_opener()
+	except ImportError:
+		logger.debug("pillow-heif not installed; HEIC files go to the model by path")
+
+def exif_thumbnail(im, min_side: int):
+	"""The EXIF (IFD1) thumbnail of an open Pillow image, or None unless its
+	long side is at least min_side and its shape matches the image's."""
+	from PIL import Image, ExifTags
+	raw = im.info.get("exif")
+	if not raw:
+		return None
+	tiff = raw[6:] if raw.startswith(b"Exif\x00\x00") else raw
+	try:
+		ifd1 = im.getexif().get_ifd(ExifTags.IFD.IFD1)
+		offset, length = ifd1.get(0x0201), ifd1.get(0x0202)  # JPEGInterchangeFormat, ...Length
+		if not offset or not length or offset + length > len(tiff):
+			return None
+		thumb = Image.open(io.BytesIO(tiff[offset:offset + length]))
+		thumb.load()
+	except (AttributeError, OSError, SyntaxError, ValueError):
+		return None
+	# A thumbnail padded to another aspect ratio would misplace every box
+	w, h = im.size
+	if max(thumb.size) < min_side or abs(thumb.size[0] / thumb.size[1] - w / h) > 0.01:
+		return None
+	return thumb
+
+def load_image(path: str, target: int = MODEL_INPUT_SIZE) -> Tuple[object, Optional[Tuple[float, float]]]:
+	"""Decode an image for the model at about target px on its long side.
+
+	Returns (BGR ndarray, (sx, sy)), where sx and sy scale box coordinates on
+	the array back to the full-size upright image, or (None, None) if Pillow
+	can't read the file. JPEGs are decoded by libjpeg at 1/2, 1/4 or 1/8 scale
+	(Pillow draft mode), or replaced by their EXIF thumbnail when that is big
+	enough. EXIF orientation is applied, so boxes end up where they were when
+	OpenCV decoded the full image.
+	"""
+	import cv2  # Requires 'opencv-python-headless'
+	import numpy as np
+	from PIL import Image
+	register_heif()
+	try:
+		with Image.open(path) as im:
+			orientation = im.getexif().get(0x0112, 1)
+			w, h = im.size
+			upright = (h, w) if orientation in (5, 6, 7, 8) else (w, h)
+			src = exif_thumbnail(im, target) if USE_EXIF_THUMBNAILS else None
+			if src is None:
+				if max(w, h) > target:
+					ratio = target / max(w, h)
+					im.draft("RGB", (max(1, int(w * ratio)), max(1, int(h * ratio))))
+				src = im.convert("RGB")
+			elif src.mode != "RGB":
+				src = src.convert("RGB")
+	except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+		logger.debug(f"Pillow could not decode {path}: {e}")
+		return None, None
+	if max(src.size) > target:
+		src.thumbnail((target, target), Image.BILINEAR)
+	# The thumbnail carries no orientation of its own, so apply the image's to either source
+	method = {
+		2: Image.Transpose.FLIP_LEFT_RIGHT, 3: Image.Transpose.ROTATE_180, 4: Image.Transpose.FLIP_TOP_BOTTOM,
+		5: Image.Transpose.TRANSPOSE, 6: Image.Transpose.ROTATE_270, 7: Image.Transpose.TRANSVERSE, 8: Image.Transpose.ROTATE_90,
+	}.get(orientation)
+	if method is not None:
+		src = src.transpose(method)
+	image = cv2.cvtColor(np.asarray(src), cv2.COLOR_RGB2BGR)
+	return image, (upright[0] / image.shape[1], upright[1] / image.shape[0])
+
+def to_original(dets: list, scale: Optional[Tuple[float, float]]) -> list:
+	"""Scale (class, conf, [x1, y1, x2, y2]) detections on a load_image() array to the full-size image."""
+	if scale is None:
+		return dets
+	sx, sy = scale
+	return [(c, conf, [b[0] * sx, b[1] * sy, b[2] * sx, b[3] * sy]) for c, conf, b in dets]
 
 # ------------------ Model & Detection ------------------
 def load_model() -> YOLO:
+	from ultralytics import YOLO
+	path = ACTIVE_MODEL_PATH or MODEL_PATH
 	for attempt in range(RETRY_MODEL_LOAD + 1):
 		try:
-			logger.info(f"Loading YOLO model: {MODEL_PATH}")
-			return YOLO(MODEL_PATH)
+			logger.info(f"Loading YOLO model: {path} ({ACTIVE_BACKEND})")
+			with RUN_STATS.stage("model_load"):
+				return YOLO(path, task="detect")
 		except Exception as e:
 			logger.error(f"Model load failed attempt {attempt+1}: {e}")
 			if attempt == RETRY_MODEL_LOAD:
 				raise
 			time.sleep(2)
 
-def detect_on_image(model: YOLO, path: str) -> List[Tuple[str, float, list]]:
-	res = model(path, verbose=False)[0]
+def target_detections(model: YOLO, res) -> List[Tuple[str, float, list]]:
+	"""Filter one YOLO result down to TARGET_CLASSES above MIN_CONFIDENCE."""
 	out = []
 	for box in res.boxes:
 		cls_name = model.names[int(box.cls)]
 		conf = float(box.conf)
 		if cls_name in TARGET_CLASSES and conf >= MIN_CONFIDENCE:
 			out.append((cls_name, conf, box.xyxy[0].tolist()))
+	return out
+
+def detect_on_image(model: YOLO, path: str, image=None, scale: Optional[Tuple[float, float]] = None) -> List[Tuple[str, float, list]]:
+	"""Detect on one image, using the load_image() array (and its scale) when there is one."""
+	with RUN_STATS.stage("inference"):
+		res = model(image if image is not None else path, verbose=False)[0]
+	out = to_original(target_detections(model, res), scale if image is not None else None)
 	logger.debug(f"Image {len(out)} detections: {path}")
 	return out
 
-def detect_on_video(model: YOLO, path: str) -> List[Tuple[str, float, int, list]]:
-	"""Detect only a single instance per target class in a video.
+def detect_on_images(model: YOLO, images: list) -> List[List[Tuple[str, float, list]]]:
+	"""Run one batched model call over decoded images (BGR ndarrays).
 
-	Scans sampled frames until each class in TARGET_CLASSES has at least one
-	detection (or video ends). Keeps the highest-confidence bbox per class.
-	Early-exits once all target classes have been found to avoid unnecessary
-	processing of long videos.
+	Returns one detection list per input image, in input order.
 	"""
-	cap = cv2.VideoCapture(path)
-	best: dict[str, Tuple[str, float, int, list]] = {}
+	with RUN_STATS.stage("inference"):
+		results = model(images, verbose=False)
+	return [target_detections(model, res) for res in results]
+
+def video_sample_step(cap) -> int:
+	"""Frames between samples, derived from the stream FPS and FRAME_SAMPLE_SECONDS."""
+	import cv2
+	fps = cap.get(cv2.CAP_PROP_FPS)
+	if not fps or fps != fps or fps <= 0 or fps > 1000:  # missing, NaN or bogus FPS
+		return FRAME_SAMPLE_INTERVAL
+	return max(1, int(round(fps * FRAME_SAMPLE_SECONDS)))
+
+def sample_video_frames(cap) -> Iterator[Tuple[int, object]]:
+	"""Yield (frame_index, frame) for the sampled frames of an open capture.
+
+	Only sampled frames are decoded into an ndarray. Short gaps are skipped with
+	grab(), which demuxes and decodes without the colour conversion and copy of
+	read(). Gaps of SEEK_MIN_GAP_FRAMES or more seek directly, so the decoder jumps
+	to the nearest keyframe instead of walking every frame. If the container
+	can't seek, the rest of the video falls back to grab().
+	"""
+	import cv2
+	step = video_sample_step(cap)
+	can_seek = step >= SEEK_MIN_GAP_FRAMES
 	frame_index = 0
 	while True:
-		ok, frame = cap.read()
-		if not ok:
-			break
 		if MAX_VIDEO_FRAMES is not None and frame_index >= MAX_VIDEO_FRAMES:
 			logger.debug("Reached max video frame cap")
-			break
-		# Sample frame
-		if frame_index % FRAME_SAMPLE_INTERVAL == 0:
-			tmp_path = f"/tmp/_frame_{os.getpid()}_{frame_index}.jpg"
-			cv2.imwrite(tmp_path, frame)
-			res = model(tmp_path, verbose=False)[0]
-			for box in res.boxes:
-				cls_name = model.names[int(box.cls)]
-				if cls_name not in TARGET_CLASSES:
-					continue
-				conf = float(box.conf)
-				if conf < MIN_CONFIDENCE:
-					continue
-				bbox = box.xyxy[0].tolist()
+			return
+		ok, frame = cap.read()
+		if not ok:
+			return
+		yield frame_index, frame
+		target = frame_index + step
+		if can_seek:
+			if cap.set(cv2.CAP_PROP_POS_FRAMES, target) and int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == target:
+				frame_index = target
+				continue
+			logger.debug("Seek unsupported for this stream; skipping with grab()")
+			can_seek = False
+			frame_index = int(cap.get(cv2.CAP_PROP_POS_FRAMES)) or frame_index + 1
+		else:
+			frame_index += 1
+		while frame_index < target:
+			if not cap.grab():
+				return
+			frame_index += 1
+
+def detect_on_video(model: YOLO, path: str, timeout: Optional[float] = None) -> List[Tuple[str, float, int, list]]:
+	"""Detect only a single instance per target class in a video.
+
+	Scans sampled frames (one per FRAME_SAMPLE_SECONDS) until each class in
+	TARGET_CLASSES has at least one detection (or video ends). Keeps the
+	highest-confidence bbox per class. Frames are passed to the model in memory.
+	Early-exits once all target classes have been found to avoid unnecessary
+	processing of long videos. Raises TimeoutError once timeout seconds have
+	passed; a decode stuck inside OpenCV is only stopped by killing the worker.
+	"""
+	import cv2
+	started = time.perf_counter()
+	inference = 0.0
+	cap = cv2.VideoCapture(path)
+	best: dict[str, Tuple[str, float, int, list]] = {}
+	try:
+		for frame_index, frame in sample_video_frames(cap):
+			t = time.perf_counter()
+			res = model(frame, verbose=False)[0]
+			inference += time.perf_counter() - t
+			for cls_name, conf, bbox in target_detections(model, res):
 				prev = best.get(cls_name)
 				# Replace only if new detection has higher confidence
 				if prev is None or conf > prev[1]:
@@ -242,22 +1020,19 @@ def detect_on_video(model: YOLO, path: str) -> List[Tuple[str, float, int, list]
 			# Early exit if all target classes found
 			if len(best) == len(TARGET_CLASSES):
 				logger.debug("Early exit: all target classes detected in video")
-				try:
-					os.remove(tmp_path)
-				except OSError:
-					pass
 				break
-			try:
-				os.remove(tmp_path)
-			except OSError:
-				pass
-		frame_index += 1
-	cap.release()
+			if timeout is not None and time.perf_counter() - started > timeout:
+				raise TimeoutError(f"Video not finished after {timeout:.0f}s (frame {frame_index})")
+	finally:
+		cap.release()
+		# Everything but the model calls is opening, seeking and decoding frames
+		RUN_STATS.add_time("inference", inference)
+		RUN_STATS.add_time("decode", time.perf_counter() - started - inference)
 	detections = list(best.values())
 	logger.debug(f"Video per-class detections {len(detections)}: {path}")
 	return detections
 
-def store_detections(conn: sqlite3.Connection, file_id: int, detections) -> None:
+def store_detections(conn: sqlite3.Connection, file_id: int, detections, commit: bool = True) -> None:
 	conn.execute("DELETE FROM detections WHERE file_id=?", (file_id,))
 	rows = []
 	now = int(time.time())
@@ -267,89 +1042,892 @@ def store_detections(conn: sqlite3.Connection, file_id: int, detections) -> None
 			frame_idx = None
 		else:              # video tuple
 			cls_name, conf, frame_idx, bbox = det
-		rows.append((file_id, cls_name, conf, frame_idx, json.dumps(bbox)))
+		rows.append((file_id, cls_name, conf, frame_idx, json.dumps(bbox), ACTIVE_BACKEND, os.path.basename((ACTIVE_MODEL_PATH or MODEL_PATH).rstrip(os.sep))))
 	if rows:
 		conn.executemany(
-			"INSERT INTO detections(file_id, object_class, confidence, frame_index, bbox) VALUES(?,?,?,?,?)",
+			"INSERT INTO detections(file_id, object_class, confidence, frame_index, bbox, backend, model) VALUES(?,?,?,?,?,?,?)",
 			rows,
 		)
-	conn.execute("UPDATE files SET processed_at=? WHERE id=?", (now, file_id))
-	conn.commit()
+	conn.execute(
+		"UPDATE files SET processed_at=?, detector=?, reused_from=NULL, reuse_kind=NULL, bucket=? WHERE id=?",
+		(now, detector_signature(), media_bucket({r[1] for r in rows}), file_id),
+	)
+	if commit:
+		conn.commit()
 	logger.debug(f"Stored {len(rows)} detections for file_id={file_id}")
 
-def scan(root: str, conn: sqlite3.Connection, model: YOLO) -> None:
-	logger.info(f"Starting scan of root: {root}")
-	media_count = 0
-	for dirpath, _, filenames in os.walk(root):
-		dir_id = ensure_directory(conn, dirpath)
-		for name in filenames:
-			path = os.path.join(dirpath, name)
-			media_type = classify_media(path)
-			if not media_type:
+def detector_signature() -> str:
+	"""Identify the model and settings that produce a file's detections.
+
+	Detections are only reused between files whose signature matches, so
+	changing the model, thresholds, classes or video sampling never copies
+	results made under different settings.
+	"""
+	classes = ",".join(sorted(TARGET_CLASSES))
+	return f"{os.path.basename(MODEL_PATH)}|conf={MIN_CONFIDENCE}|classes={classes}|video={FRAME_SAMPLE_SECONDS}s"
+
+def find_reuse_source(conn: sqlite3.Connection, sha256: str, exclude_id: Optional[int] = None) -> Optional[int]:
+	"""Id of a processed file with identical content and detector signature."""
+	row = conn.execute(
+		"SELECT id FROM files WHERE sha256=? AND processed_at IS NOT NULL AND detector=? AND id IS NOT ? LIMIT 1",
+		(sha256, detector_signature(), exclude_id),
+	).fetchone()
+	return row[0] if row else None
+
+def copy_detections(conn: sqlite3.Connection, file_id: int, sha256: str) -> bool:
+	"""Give file_id the detections of an identical, already processed file.
+
+	Returns False (leaving the file unprocessed) if no source exists.
+	"""
+	source_id = find_reuse_source(conn, sha256, exclude_id=file_id)
+	if source_id is None:
+		return False
+	copy_detections_from(conn, file_id, source_id, "identical")
+	return True
+
+def copy_detections_from(conn: sqlite3.Connection, file_id: int, source_id: int, kind: str) -> None:
+	"""Replace file_id's detections with source_id's, recording kind in files.reuse_kind."""
+	conn.execute("DELETE FROM detections WHERE file_id=?", (file_id,))
+	conn.execute(
+		"INSERT INTO detections(file_id, object_class, confidence, frame_index, bbox, backend, model) "
+		"SELECT ?, object_class, confidence, frame_index, bbox, backend, model FROM detections WHERE file_id=?",
+		(file_id, source_id),
+	)
+	conn.execute(
+		"UPDATE files SET processed_at=?, detector=?, reused_from=?, reuse_kind=?, bucket=(SELECT bucket FROM files WHERE id=?) WHERE id=?",
+		(int(time.time()), detector_signature(), source_id, kind, source_id, file_id),
+	)
+	logger.debug(f"Copied detections ({kind}) from file_id={source_id} to file_id={file_id}")
+
+def find_near_duplicate(conn: sqlite3.Connection, item: PreparedFile, recent=()) -> Optional[Tuple[str, int]]:
+	"""(path, distance) of the processed image closest to item by phash, or None.
+
+	Candidates share item's directory, lie within NEAR_DUPLICATE_WINDOW_SEC of
+	its mtime and NEAR_DUPLICATE_MAX_DISTANCE of its phash, and got their
+	detections from the model or an identical file, never from another
+	near-duplicate, so a long burst can't drift through a chain of copies.
+	recent holds (dirpath, mtime, phash, path) of images detected this run
+	that may not be committed yet.
+	"""
+	lo, hi = item.mtime - NEAR_DUPLICATE_WINDOW_SEC, item.mtime + NEAR_DUPLICATE_WINDOW_SEC
+	candidates = [(path, phash) for dirpath, mtime, phash, path in recent if dirpath == item.dirpath and lo <= mtime <= hi]
+	candidates += conn.execute(
+		"SELECT f.path, f.phash FROM files f JOIN directories d ON d.id = f.directory_id "
+		"WHERE d.path = ? AND f.mtime BETWEEN ? AND ? AND f.phash IS NOT NULL AND f.processed_at IS NOT NULL "
+		"AND f.detector = ? AND f.reuse_kind IS NOT 'near_duplicate' AND f.path != ?",
+		(item.dirpath, lo, hi, detector_signature(), item.path),
+	).fetchall()
+	best = None
+	for path, phash in candidates:
+		distance = hamming(phash, item.phash)
+		if distance <= NEAR_DUPLICATE_MAX_DISTANCE and (best is None or distance < best[1]):
+			best = (path, distance)
+	return best
+
+def record_detection_failure(path: str, e: Exception) -> None:
+	err_msg = f"Detection failure {path}: {e}"
+	logger.error(err_msg)
+	DETECTION_ERRORS.append(err_msg)
+
+def detect_image_batch(model: YOLO, items: List[PreparedFile]) -> List[Tuple[PreparedFile, Optional[list], Optional[Exception]]]:
+	"""Run a batch of decoded images through the model in one call.
+
+	Returns (item, detections, error) per item, in input order, with boxes in
+	full-size image coordinates. Items load_image() could not decode go
+	through the model's own loader by path. If the
+	batched call itself fails, each file is retried on its own so a single bad
+	image only fails itself.
+	"""
+	out: List[Tuple[PreparedFile, Optional[list], Optional[Exception]]] = []
+	decoded = [it for it in items if it.image is not None]
+	batch_dets = None
+	if decoded:
+		try:
+			batch_dets = dict(zip(map(id, decoded), detect_on_images(model, [it.image for it in decoded])))
+		except Exception as e:
+			logger.warning(f"Batched inference failed ({e}); retrying {len(decoded)} files one at a time")
+	for it in items:
+		try:
+			if batch_dets is not None and id(it) in batch_dets:
+				dets = to_original(batch_dets[id(it)], it.scale)
+				logger.debug(f"Image {len(dets)} detections: {it.path}")
+			else:
+				dets = detect_on_image(model, it.path, it.image, it.scale)
+			out.append((it, dets, None))
+		except Exception as e:
+			out.append((it, None, e))
+		it.image = None
+	return out
+
+# ------------------ Inference Backends ------------------
+def export_path(backend: str, int8: bool) -> str:
+	"""Where the exported model for backend lives, next to MODEL_PATH."""
+	stem = os.path.splitext(MODEL_PATH)[0]
+	if backend == "onnx":
+		return f"{stem}_int8.onnx" if int8 else f"{stem}.onnx"
+	if backend == "openvino":
+		return f"{stem}_int8_openvino_model" if int8 else f"{stem}_openvino_model"
+	if backend == "ncnn":
+		return f"{stem}_ncnn_model"
+	raise ValueError(f"Unknown backend: {backend}")
+
+def export_model(backend: str, int8: bool) -> str:
+	"""Export MODEL_PATH for backend unless an export newer than the weights exists.
+
+	ONNX int8 uses onnxruntime dynamic quantization (no calibration data).
+	OpenVINO int8 needs BACKEND_INT8_CALIBRATION. NCNN has no int8 export.
+	"""
+	target = export_path(backend, int8)
+	if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(MODEL_PATH):
+		return target
+	from ultralytics import YOLO
+	logger.info(f"Exporting {MODEL_PATH} for {backend}{' int8' if int8 else ''} (one-off)")
+	ref = YOLO(MODEL_PATH)
+	if backend == "onnx":
+		fp32 = ref.export(format="onnx", imgsz=BACKEND_IMGSZ)
+		if int8:
+			from onnxruntime.quantization import QuantType, quantize_dynamic
+			quantize_dynamic(fp32, target, weight_type=QuantType.QUInt8)
+		return target
+	if backend == "openvino":
+		if int8 and not BACKEND_INT8_CALIBRATION:
+			raise ValueError("OpenVINO int8 export needs BACKEND_INT8_CALIBRATION")
+		kwargs = {"int8": True, "data": BACKEND_INT8_CALIBRATION} if int8 else {}
+		return str(ref.export(format="openvino", imgsz=BACKEND_IMGSZ, **kwargs))
+	if int8:
+		logger.warning("NCNN export has no int8 mode; exporting fp16")
+	return str(ref.export(format="ncnn", imgsz=BACKEND_IMGSZ))
+
+def box_iou(a: list, b: list) -> float:
+	ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+	iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+	inter = ix * iy
+	union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+	return inter / union if union > 0 else 0.0
+
+def count_agreement(ref: list, cand: list) -> Tuple[int, int]:
+	"""(matched, required) detections between two image results.
+
+	A detection is required when it clears MIN_CONFIDENCE by at least
+	BACKEND_CONF_TOLERANCE on either side; it matches when the other side has
+	the same class within BACKEND_MIN_IOU and BACKEND_CONF_TOLERANCE.
+	Detections sitting right on the threshold may appear on one side only.
+	"""
+	matched = required = 0
+	for mine, other in ((ref, cand), (cand, ref)):
+		for cls_name, conf, bbox in mine:
+			if conf < MIN_CONFIDENCE + BACKEND_CONF_TOLERANCE:
 				continue
-			media_count += 1
-			if media_count % LOG_PROGRESS_EVERY == 0:
-				logger.info(f"Progress: {media_count} media files encountered")
-			file_id = upsert_file(conn, dir_id, path)
-			if not needs_processing(conn, file_id):
-				logger.debug(f"Skip already processed: {path}")
+			required += 1
+			if any(
+				c == cls_name and abs(cf - conf) <= BACKEND_CONF_TOLERANCE and box_iou(bbox, b) >= BACKEND_MIN_IOU
+				for c, cf, b in other
+			):
+				matched += 1
+	return matched, required
+
+def validation_images(conn: sqlite3.Connection) -> List[str]:
+	"""Bundled ultralytics samples plus the most recently processed library images."""
+	paths = []
+	try:
+		from ultralytics.utils import ASSETS
+		paths.extend(str(p) for p in sorted(ASSETS.glob("*.jpg")))
+	except ImportError:
+		pass
+	cur = conn.execute(
+		"SELECT path FROM files WHERE media_type='image' AND processed_at IS NOT NULL ORDER BY processed_at DESC LIMIT ?",
+		(BACKEND_VALIDATE_IMAGES * 2,),
+	)
+	library = [p for (p,) in cur if os.path.isfile(p)]
+	return paths + library[:BACKEND_VALIDATE_IMAGES]
+
+def validate_export(conn: sqlite3.Connection, path: str) -> bool:
+	"""Compare an exported model with the .pt reference; cache the verdict.
+
+	The verdict is stored in '<path>.validation.json' and reused until the
+	reference weights or detection thresholds change.
+	"""
+	marker = path.rstrip(os.sep) + ".validation.json"
+	key = {
+		"reference": os.path.basename(MODEL_PATH),
+		"reference_mtime": int(os.path.getmtime(MODEL_PATH)),
+		"detector": detector_signature(),
+	}
+	try:
+		with open(marker) as f:
+			cached = json.load(f)
+		if all(cached.get(k) == v for k, v in key.items()):
+			return bool(cached["passed"])
+	except (OSError, ValueError, KeyError):
+		pass
+	images = validation_images(conn)
+	if not images:
+		logger.warning("No images available to validate the exported model; using it unchecked")
+		return True
+	from ultralytics import YOLO
+	ref = YOLO(MODEL_PATH)
+	cand = YOLO(path, task="detect")
+	matched = required = 0
+	for img in images:
+		m, r = count_agreement(detect_on_image(ref, img), detect_on_image(cand, img))
+		matched += m
+		required += r
+	agreement = matched / required if required else 1.0
+	passed = agreement >= BACKEND_MIN_AGREEMENT
+	logger.info(f"Backend validation {path}: {matched}/{required} detections agree ({agreement:.1%}) over {len(images)} images")
+	try:
+		with open(marker, "w") as f:
+			json.dump({**key, "agreement": agreement, "images": len(images), "passed": passed}, f)
+	except OSError as e:
+		logger.warning(f"Could not cache validation result: {e}")
+	return passed
+
+def prepare_backend(conn: sqlite3.Connection, backend: str, int8: bool) -> None:
+	"""Select the inference backend, exporting and validating it on first use.
+
+	Any failure, or disagreement with the reference, falls back to torch.
+	"""
+	global ACTIVE_BACKEND, ACTIVE_MODEL_PATH
+	ACTIVE_BACKEND, ACTIVE_MODEL_PATH = "torch", MODEL_PATH
+	if backend == "torch":
+		return
+	try:
+		path = export_model(backend, int8)
+		if not validate_export(conn, path):
+			logger.error(f"{backend} export disagrees with {MODEL_PATH}; falling back to torch")
+			return
+	except Exception as e:
+		logger.error(f"{backend} backend unavailable ({e}); falling back to torch")
+		return
+	ACTIVE_BACKEND = f"{backend}-int8" if int8 and backend != "ncnn" else backend
+	ACTIVE_MODEL_PATH = path
+
+# ------------------ Worker Processes ------------------
+# Settings a worker needs; spawned processes re-import this module and do not
+# see values changed at runtime, so they are passed to worker_init().
+WORKER_SHARED_SETTINGS = (
+	"MODEL_PATH", "TARGET_CLASSES", "MIN_CONFIDENCE", "FRAME_SAMPLE_SECONDS",
+	"FRAME_SAMPLE_INTERVAL", "SEEK_MIN_GAP_FRAMES", "MAX_VIDEO_FRAMES", "RETRY_MODEL_LOAD",
+	"ACTIVE_BACKEND", "ACTIVE_MODEL_PATH",
+)
+_worker_model = None
+_worker_error: Optional[str] = None
+
+def available_memory_mb() -> Optional[int]:
+	try:
+		with open("/proc/meminfo") as f:
+			for line in f:
+				if line.startswith("MemAvailable:"):
+					return int(line.split()[1]) // 1024
+	except (OSError, ValueError, IndexError):
+		pass
+	return None
+
+def worker_memory_mb() -> int:
+	"""Rough resident size of one worker, scaled from the weights file."""
+	try:
+		weights_mb = os.path.getsize(MODEL_PATH) / (1 << 20)
+	except OSError:
+		weights_mb = 40.0  # yolo11m.pt
+	return int(WORKER_BASE_MEMORY_MB + weights_mb * WORKER_MODEL_MEMORY_FACTOR)
+
+def plan_workers(requested: int) -> int:
+	"""Scale the requested worker count to the CPUs and RAM of this host.
+
+	Returns 0 (in-process inference) if not even one worker fits, so the same
+	setting is safe on the 8 GB Pi 5 and the 1 GB Pi 4 backup nodes.
+	"""
+	if requested <= 0:
+		return 0
+	cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+	workers = min(requested, cpus)
+	avail = available_memory_mb()
+	if avail is None:
+		logger.warning("Could not read MemAvailable; not checking worker memory")
+		return workers
+	per_worker = worker_memory_mb()
+	fit = max(0, (avail - MEMORY_RESERVE_MB) // per_worker)
+	if fit < 1:
+		logger.error(
+			f"Refusing --workers {requested}: one {os.path.basename(MODEL_PATH)} worker needs ~{per_worker} MB, "
+			f"{avail} MB available with {MEMORY_RESERVE_MB} MB reserved. Running inference in-process."
+		)
+		return 0
+	if fit < workers:
+		logger.warning(f"Scaling --workers {requested} down to {fit} to fit {avail} MB available (~{per_worker} MB each)")
+		workers = fit
+	return workers
+
+def worker_init(config: dict, threads: int, debug: bool, pids) -> None:
+	"""Process pool initializer: report the pid, apply settings, pin threads and load the model."""
+	global _worker_model, _worker_error
+	pids.put(os.getpid())
+	globals().update(config)
+	setup_logging(debug)
+	import cv2
+	cv2.setNumThreads(1)
+	try:
+		import torch
+		torch.set_num_threads(threads)
+	except ImportError:
+		pass
+	try:
+		_worker_model = load_model()
+	except Exception as e:
+		_worker_error = str(e)
+
+def worker_detect(
+	media_type: str, paths: List[str], timeout: Optional[float] = None
+) -> Tuple[List[Tuple[str, Optional[list], Optional[str]]], dict]:
+	"""Detect on one video or a batch of images inside a worker process.
+
+	Returns (path, detections, error) per path so one bad file only fails itself,
+	plus the decode/inference seconds spent, for the parent's RUN_STATS.
+	"""
+	if _worker_model is None:
+		raise RuntimeError(f"Worker model unavailable: {_worker_error}")
+	before = dict(RUN_STATS.seconds)
+	if media_type == "video":
+		try:
+			results = [(paths[0], detect_on_video(_worker_model, paths[0], timeout), None)]
+		except Exception as e:
+			results = [(paths[0], None, str(e))]
+	else:
+		items = []
+		with RUN_STATS.stage("decode"):
+			for p in paths:
+				image, scale = load_image(p)
+				items.append(PreparedFile(p, os.path.dirname(p), "image", image=image, scale=scale))
+		results = [(it.path, dets, None if err is None else str(err)) for it, dets, err in detect_image_batch(_worker_model, items)]
+	return results, {k: v - before[k] for k, v in RUN_STATS.seconds.items() if v != before[k]}
+
+def start_worker_pool(workers: int, debug: bool) -> Tuple[ProcessPoolExecutor, object]:
+	"""Start the inference process pool; also returns the queue its workers put their pids on."""
+	cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+	threads = max(1, cpus // workers)
+	# Spawned workers read these when torch/OpenCV are imported
+	os.environ["OMP_NUM_THREADS"] = str(threads)
+	os.environ["OPENBLAS_NUM_THREADS"] = str(threads)
+	logger.info(f"Starting {workers} inference workers with {threads} threads each")
+	config = {name: globals()[name] for name in WORKER_SHARED_SETTINGS}
+	ctx = multiprocessing.get_context("spawn")
+	pids = ctx.SimpleQueue()
+	pool = ProcessPoolExecutor(
+		max_workers=workers,
+		mp_context=ctx,
+		initializer=worker_init,
+		initargs=(config, threads, debug, pids),
+	)
+	return pool, pids
+
+def kill_workers(pids) -> None:
+	"""SIGTERM every worker that has reported its pid on the pool's queue."""
+	while not pids.empty():
+		try:
+			os.kill(pids.get(), signal.SIGTERM)
+		except ProcessLookupError:
+			pass
+
+class WorkerPool:
+	"""Inference processes that are killed and restarted together when a job hangs."""
+
+	def __init__(self, workers: int, debug: bool):
+		self.workers = workers
+		self.debug = debug
+		self.executor, self.pids = start_worker_pool(workers, debug)
+
+	def submit(self, *args):
+		return self.executor.submit(*args)
+
+	def restart(self) -> None:
+		# A running call can't be cancelled; terminating its processes is the only way out
+		kill_workers(self.pids)
+		self.executor.shutdown(wait=True, cancel_futures=True)
+		self.executor, self.pids = start_worker_pool(self.workers, self.debug)
+
+	def shutdown(self) -> None:
+		self.executor.shutdown(wait=True, cancel_futures=True)
+
+# ------------------ Scan ------------------
+# Walked files that need work: new, unprocessed, with a fingerprint that no
+# longer matches their row, or processed under a stale detector signature (or
+# every file when verifying hashes). Files that failed max_attempts runs in a
+# row are left out until their size or mtime changes.
+PENDING_WORK_FILTER = """(
+		? OR f.id IS NULL OR f.processed_at IS NULL
+		OR (s.size IS NOT NULL AND (f.size IS NOT s.size OR f.mtime IS NOT s.mtime OR f.inode IS NOT s.inode))
+		OR f.detector != ?
+	) AND NOT EXISTS (
+		SELECT 1 FROM file_failures ff WHERE ff.path = s.path AND ff.attempts >= ?
+		AND (s.size IS NULL OR (ff.size = s.size AND ff.mtime = s.mtime))
+	)"""
+
+PENDING_WORK_SQL = f"""
+	SELECT s.id, s.path, s.dirpath, s.media_type, s.size, s.mtime, s.inode,
+		f.id, f.size, f.mtime, f.inode, f.sha256, f.processed_at, f.detector
+	FROM seen_files s LEFT JOIN files f ON f.path = s.path
+	WHERE s.id > ? AND {PENDING_WORK_FILTER}
+	ORDER BY s.id LIMIT ?
+"""
+
+# Sort keys for the persistent work queue (lowest first)
+QUEUE_PRIORITIES = {
+	"newest": "-COALESCE(s.mtime, f.mtime, 0)",
+	"oldest": "COALESCE(s.mtime, f.mtime, 0)",
+	"walk": "s.id",
+}
+
+QUEUE_WORK_SQL = """
+	SELECT q.priority, q.path, q.dirpath, q.media_type, q.size, q.mtime, q.inode,
+		f.id, f.size, f.mtime, f.inode, f.sha256, f.processed_at, f.detector
+	FROM work_queue q LEFT JOIN files f ON f.path = q.path
+	WHERE (q.priority, q.path) > (?, ?) AND {subtree}
+	ORDER BY q.priority, q.path LIMIT ?
+"""
+
+def pending_work(
+	conn: sqlite3.Connection,
+	verify_hashes: bool,
+	current_detector: Optional[str] = None,
+	max_attempts: Optional[int] = MAX_FILE_ATTEMPTS,
+	page_size: int = 500,
+) -> Iterator[tuple]:
+	"""Stream PENDING_WORK_SQL rows in walk order, one short query per page so no
+	read transaction stays open for the whole scan. current_detector=None never
+	treats a signature as stale."""
+	last_id = 0
+	while True:
+		rows = conn.execute(
+			PENDING_WORK_SQL, (last_id, int(verify_hashes), current_detector, max_attempts, page_size)
+		).fetchall()
+		if not rows:
+			return
+		yield from rows
+		last_id = rows[-1][0]
+
+def enqueue_pending(
+	conn: sqlite3.Connection,
+	root: str,
+	verify_hashes: bool,
+	current_detector: Optional[str] = None,
+	max_attempts: Optional[int] = MAX_FILE_ATTEMPTS,
+	priority: str = QUEUE_PRIORITY,
+) -> int:
+	"""Replace the work queue under root with the pending files of the
+	preceding walk_tree(). Returns the queue length."""
+	cond, args = subtree_clause("path", root)
+	conn.execute(f"DELETE FROM work_queue WHERE {cond}", args)
+	conn.execute(
+		f"""INSERT INTO work_queue(path, dirpath, media_type, size, mtime, inode, priority)
+		SELECT s.path, s.dirpath, s.media_type, s.size, s.mtime, s.inode, {QUEUE_PRIORITIES[priority]}
+		FROM seen_files s LEFT JOIN files f ON f.path = s.path
+		WHERE {PENDING_WORK_FILTER}""",
+		(int(verify_hashes), current_detector, max_attempts),
+	)
+	conn.commit()
+	count = conn.execute(f"SELECT COUNT(*) FROM work_queue WHERE {cond}", args).fetchone()[0]
+	logger.info(f"Work queue: {count} files pending ({priority} first)")
+	return count
+
+def queued_work(conn: sqlite3.Connection, root: str, page_size: int = 500) -> Iterator[tuple]:
+	"""Stream work_queue rows under root in priority order, paged like pending_work()."""
+	cond, args = subtree_clause("q.path", root)
+	sql = QUEUE_WORK_SQL.format(subtree=cond)
+	last = (float("-inf"), "")
+	while True:
+		rows = conn.execute(sql, (*last, *args, page_size)).fetchall()
+		if not rows:
+			return
+		yield from rows
+		last = rows[-1][:2]
+
+def scan(
+	root: str,
+	conn: sqlite3.Connection,
+	model: YOLO,
+	batch_size: int = BATCH_SIZE,
+	verify_hashes: bool = False,
+	io_threads: int = IO_THREADS,
+	workers: int = 0,
+	worker_pool: Optional[WorkerPool] = None,
+	reprocess_stale: bool = False,
+	use_queue: bool = False,
+	resume: bool = False,
+	priority: str = QUEUE_PRIORITY,
+	deadline: Optional[float] = None,
+	file_timeout: Optional[float] = FILE_TIMEOUT_SEC,
+	max_attempts: Optional[int] = MAX_FILE_ATTEMPTS,
+) -> None:
+	"""Refresh file records and run detection for the files found by the
+	preceding walk_tree() call on conn.
+
+	Only files that need work are read back from the walk, joined against
+	their rows in one query. The rest is a three-stage pipeline. io_threads
+	workers hash and decode files, with at most PREFETCH_FILES in flight. The
+	main thread runs inference in walk order (batch_size images per model
+	call), or hands them to `workers` inference processes, or to worker_pool
+	when the caller keeps one across scans (model may then be None). A DbWriter thread applies all database writes and commits them in
+	batches. Directory rows and mtimes are recorded only after every file has
+	been written, so an interrupted run never marks a half-scanned directory
+	as done. reprocess_stale re-runs files processed under a different
+	detector_signature().
+
+	With use_queue the pending files are first stored in the work_queue table
+	and taken in priority order; each file leaves the queue in the same write
+	batch as its results. resume drains the existing queue without a preceding
+	walk. No new file is started after deadline (time.monotonic()). Videos
+	give up after file_timeout seconds, and a worker job with no result after
+	twice that (plus HARD_TIMEOUT_GRACE_SEC) has its process killed.
+	"""
+	if worker_pool is not None:
+		workers = worker_pool.workers
+	logger.info(f"Starting scan of root: {root} (batch size {batch_size}, io threads {io_threads}, workers {workers})")
+	queued = 0
+	inferred = 0
+	reused = 0
+	near_reused = 0
+	stopped = False
+	# Hashes handed to the writer with fresh detections this run; they may not
+	# be committed yet, so the database alone can't offer them for reuse.
+	recent_hashes: dict = {}
+	recent_phashes: deque = deque(maxlen=NEAR_DUPLICATE_RECENT)
+	image_batch: List[PreparedFile] = []
+	current_detector = detector_signature() if reprocess_stale else None
+	if resume:
+		work = queued_work(conn, root)
+	elif use_queue:
+		enqueue_pending(conn, root, verify_hashes, current_detector, max_attempts, priority)
+		work = queued_work(conn, root)
+	else:
+		work = pending_work(conn, verify_hashes, current_detector, max_attempts)
+	debug = logger.isEnabledFor(logging.DEBUG)
+	inflight: deque = deque()
+	writer = DbWriter()
+	writer.start()
+	pool = ThreadPoolExecutor(max_workers=max(1, io_threads), thread_name_prefix="scan-io")
+	procs = worker_pool or (WorkerPool(workers, debug) if workers > 0 else None)
+	proc_pending: dict = {}  # worker future -> items it covers
+	proc_started: dict = {}  # worker future -> when it was first seen running
+
+	def remember(item: PreparedFile) -> None:
+		nonlocal inferred
+		inferred += 1
+		if item.sha256:
+			recent_hashes[item.sha256] = None
+			if len(recent_hashes) > REUSE_RECENT_HASHES:
+				del recent_hashes[next(iter(recent_hashes))]
+		if item.phash is not None:
+			recent_phashes.append((item.dirpath, item.mtime, item.phash, item.path))
+
+	def finish(item: PreparedFile, dets: list) -> None:
+		writer.put("detections", item, dets)
+		writer.put("done", item.path)
+		remember(item)
+
+	def fail(path: str, e: Exception) -> None:
+		record_detection_failure(path, e)
+		writer.put("failed", path, str(e))
+
+	def try_reuse(item: PreparedFile) -> bool:
+		nonlocal reused, near_reused
+		if REUSE_DETECTIONS and item.sha256 and (
+			item.sha256 in recent_hashes or find_reuse_source(conn, item.sha256, exclude_id=item.file_id) is not None
+		):
+			logger.debug(f"Reusing detections of identical content: {item.path}")
+			writer.put("reuse", item)
+		else:
+			match = find_near_duplicate(conn, item, recent_phashes) if item.phash is not None else None
+			if match is None:
+				return False
+			logger.debug(f"Reusing detections of near-duplicate {match[0]} (distance {match[1]}): {item.path}")
+			writer.put("near_duplicate", item, match[0])
+			near_reused += 1
+		item.image = None
+		writer.put("done", item.path)
+		reused += 1
+		return True
+
+	def restart_workers(overdue: list, limit: float) -> None:
+		for fut in overdue:
+			for item in proc_pending.pop(fut):
+				fail(item.path, TimeoutError(f"No result after {limit:.0f}s, worker killed"))
+		retry = list(proc_pending.values())
+		proc_pending.clear()
+		proc_started.clear()
+		logger.warning(f"Restarting inference workers after a stuck job ({len(retry)} jobs resubmitted)")
+		procs.restart()
+		for items in retry:
+			fut = procs.submit(worker_detect, items[0].media_type, [it.path for it in items], file_timeout)
+			proc_pending[fut] = items
+
+	def check_worker_timeouts() -> None:
+		# running() turns true when a job enters the pool's call queue, which can
+		# be one job before a worker picks it up, hence twice the timeout
+		limit = 2 * file_timeout + HARD_TIMEOUT_GRACE_SEC
+		now = time.monotonic()
+		for fut in proc_pending:
+			if fut.running():
+				proc_started.setdefault(fut, now)
+		# proc_pending is in submission order, which breaks ties between jobs first seen running together
+		overdue = [fut for fut in proc_pending if fut in proc_started and now - proc_started[fut] > limit]
+		overdue.sort(key=proc_started.get)
+		if overdue:
+			# Only the oldest jobs can be the ones holding a worker; later ones were waiting behind them
+			restart_workers(overdue[:workers], limit)
+
+	def collect_workers(return_when: str) -> None:
+		while True:
+			done, _ = wait(list(proc_pending), timeout=None if file_timeout is None else 1.0, return_when=return_when)
+			if done or not proc_pending:
+				break
+			check_worker_timeouts()
+		for fut in done:
+			items = proc_pending.pop(fut, None)
+			proc_started.pop(fut, None)
+			if items is None:
 				continue
-			logger.debug(f"Processing {media_type}: {path}")
 			try:
-				if media_type == "image":
-					dets_raw = detect_on_image(model, path)
-					dets = [(c, conf, b) for (c, conf, b) in dets_raw]
+				results, seconds = fut.result()
+			except Exception as e:
+				for item in items:
+					fail(item.path, e)
+				continue
+			for stage, secs in seconds.items():
+				RUN_STATS.add_time(stage, secs)
+			for item, (_, dets, err) in zip(items, results):
+				if err is not None:
+					fail(item.path, RuntimeError(err))
 				else:
-					dets_raw = detect_on_video(model, path)
-					dets = [(c, conf, fi, b) for (c, conf, fi, b) in dets_raw]
-				store_detections(conn, file_id, dets)
+					finish(item, dets)
+
+	def submit_to_workers(media_type: str, items: List[PreparedFile]) -> None:
+		fut = procs.submit(worker_detect, media_type, [it.path for it in items], file_timeout)
+		proc_pending[fut] = items
+		# Keep each worker one job ahead without queueing the whole library
+		while len(proc_pending) >= 2 * workers:
+			collect_workers(FIRST_COMPLETED)
+
+	def flush_images() -> None:
+		nonlocal image_batch
+		if procs is not None:
+			submit_to_workers("image", image_batch)
+			image_batch = []
+			return
+		for item, dets, err in detect_image_batch(model, image_batch):
+			if err is not None:
+				fail(item.path, err)
+			else:
+				finish(item, dets)
+		image_batch = []
+
+	def handle(item: PreparedFile) -> None:
+		if item.stat is not None:
+			writer.put("file", item)
+		if item.phash is not None:
+			writer.put("phash", item)
+		if not item.needs_inference:
+			writer.put("done", item.path)
+			return
+		if try_reuse(item):
+			return
+		logger.debug(f"Processing {item.media_type}: {item.path}")
+		if item.media_type == "image" and (batch_size > 1 or procs is not None):
+			image_batch.append(item)
+			if len(image_batch) >= batch_size:
+				flush_images()
+			return
+		if procs is not None:
+			submit_to_workers(item.media_type, [item])
+			return
+		try:
+			if item.media_type == "image":
+				dets_raw = detect_on_image(model, item.path, item.image, item.scale)
+				item.image = None
+				dets = [(c, conf, b) for (c, conf, b) in dets_raw]
+			else:
+				dets_raw = detect_on_video(model, item.path, file_timeout)
+				dets = [(c, conf, fi, b) for (c, conf, fi, b) in dets_raw]
+			finish(item, dets)
+		except Exception as e:
+			fail(item.path, e)
+
+	def drain(limit: int) -> None:
+		while len(inflight) > limit:
+			path, fut = inflight.popleft()
+			try:
+				item = fut.result()
+			except FileNotFoundError as e:
+				if not resume:
+					fail(path, e)
+					continue
+				# Queued by an earlier run and deleted since
+				logger.debug(f"Queued file no longer exists: {path}")
+				writer.put("done", path)
+				continue
 			except Exception as e:
-					err_msg = f"Detection failure {path}: {e}"
-					logger.error(err_msg)
-					DETECTION_ERRORS.append(err_msg)
-	logger.info(f"Scan complete. Media files seen: {media_count}")
-    
+				fail(path, e)
+				continue
+			handle(item)
+
+	try:
+		for _, path, dirpath, media_type, size, mtime, inode, *row in work:
+			if deadline is not None and time.monotonic() >= deadline:
+				stopped = True
+				logger.warning(f"Time budget reached after {queued} files; the rest stay queued for the next run")
+				break
+			queued += 1
+			if queued % LOG_PROGRESS_EVERY == 0:
+				logger.info(f"Progress: {queued} media files queued for hashing/detection")
+			# A resumed queue may be days old, so re-stat instead of trusting its fingerprint
+			fingerprint = (size, mtime, inode) if size is not None and not resume else None
+			known = tuple(row) if row[0] is not None else None
+			# Workers decode their own images; only in-process inference needs them here
+			fut = pool.submit(
+				prepare_file, path, dirpath, media_type, fingerprint, known, verify_hashes, procs is None, current_detector
+			)
+			inflight.append((path, fut))
+			drain(PREFETCH_FILES)
+		drain(0)
+		if image_batch:
+			flush_images()
+		while proc_pending:
+			collect_workers(FIRST_COMPLETED)
+	finally:
+		pool.shutdown(wait=True, cancel_futures=True)
+		if procs is not None and procs is not worker_pool:
+			procs.shutdown()
+		elif proc_pending:
+			# Don't leave this scan's jobs running in the caller's pool
+			procs.restart()
+		writer.close()
+	if not (stopped or resume):
+		record_walked_directories(conn)
+	RUN_STATS.count("files_queued", queued)
+	RUN_STATS.count("files_inferred", inferred)
+	RUN_STATS.count("files_reused", reused)
+	logger.info(f"Scan complete. Media files needing work: {queued}")
+	if use_queue or resume:
+		cond, args = subtree_clause("path", root)
+		remaining = conn.execute(f"SELECT COUNT(*) FROM work_queue WHERE {cond}", args).fetchone()[0]
+		logger.info(f"Work queue: {remaining} files left")
+	if inferred or reused:
+		logger.info(
+			f"Detection reuse: {reused}/{inferred + reused} files ({100.0 * reused / (inferred + reused):.1f}%) copied from "
+			f"identical content or near-duplicates ({near_reused})"
+		)
+
 def reconcile_removed(root: str, conn: sqlite3.Connection) -> None:
+	"""Delete rows under root that the preceding walk_tree() did not see.
+
+	Removed files leave their viewer bucket (idx_files_bucket) with their row.
+	"""
 	logger.info("Reconciling removed files/directories")
-	fs_dirs: set[str] = set()
-	fs_files: set[str] = set()
-	for dirpath, _, filenames in os.walk(root):
-		fs_dirs.add(dirpath)
-		for name in filenames:
-			p = os.path.join(dirpath, name)
-			if classify_media(p):
-				fs_files.add(p)
-	db_files = {r[0] for r in conn.execute("SELECT path FROM files WHERE path LIKE ?", (root + '%',))}
-	db_dirs = {r[0] for r in conn.execute("SELECT path FROM directories WHERE path LIKE ?", (root + '%',))}
-	missing_files = db_files - fs_files
-	missing_dirs = db_dirs - fs_dirs
-	if missing_files:
-		logger.info(f"Removing {len(missing_files)} missing file records")
-		for chunk_start in range(0, len(missing_files), 100):
-			chunk = list(missing_files)[chunk_start:chunk_start+100]
-			conn.executemany("DELETE FROM detections WHERE file_id = (SELECT id FROM files WHERE path=?)", [(p,) for p in chunk])
-			conn.executemany("DELETE FROM files WHERE path=?", [(p,) for p in chunk])
-		conn.commit()
-	if missing_dirs:
-		ordered = sorted(missing_dirs, key=len, reverse=True)
-		logger.info(f"Removing {len(ordered)} missing directory records")
-		for chunk_start in range(0, len(ordered), 100):
-			chunk = ordered[chunk_start:chunk_start+100]
-			conn.executemany("DELETE FROM files WHERE directory_id = (SELECT id FROM directories WHERE path=?)", [(d,) for d in chunk])
-			conn.executemany("DELETE FROM directories WHERE path=?", [(d,) for d in chunk])
-		conn.commit()
+	with RUN_STATS.stage("reconcile"):
+		removed_files, removed_dirs = _reconcile_removed(root, conn)
+	RUN_STATS.count("files_removed", removed_files)
 	logger.info("Reconciliation complete")
 
-def diff_untracked(root: str, conn: sqlite3.Connection) -> List[str]:
-	missing = []
-	for dirpath, _, filenames in os.walk(root):
-		for name in filenames:
-			path = os.path.join(dirpath, name)
-			if classify_media(path):
-				cur = conn.execute("SELECT 1 FROM files WHERE path=?", (path,))
-				if not cur.fetchone():
-					missing.append(path)
-	return missing
+def _reconcile_removed(root: str, conn: sqlite3.Connection) -> Tuple[int, int]:
+	file_cond, file_args = subtree_clause("path", root)
+	conn.execute("DROP TABLE IF EXISTS temp.gone_files")
+	conn.execute(
+		f"CREATE TEMP TABLE gone_files AS SELECT id FROM files WHERE {file_cond} "
+		"AND path NOT IN (SELECT path FROM seen_files)",
+		file_args,
+	)
+	removed_files = conn.execute("SELECT COUNT(*) FROM gone_files").fetchone()[0]
+	if removed_files:
+		logger.info(f"Removing {removed_files} missing file records")
+		conn.execute("DELETE FROM detections WHERE file_id IN (SELECT id FROM gone_files)")
+		conn.execute("DELETE FROM files WHERE id IN (SELECT id FROM gone_files)")
+	conn.execute("DROP TABLE IF EXISTS temp.gone_dirs")
+	conn.execute(
+		f"CREATE TEMP TABLE gone_dirs AS SELECT id FROM directories WHERE {file_cond} "
+		"AND path NOT IN (SELECT path FROM seen_dirs)",
+		file_args,
+	)
+	removed_dirs = conn.execute("SELECT COUNT(*) FROM gone_dirs").fetchone()[0]
+	if removed_dirs:
+		logger.info(f"Removing {removed_dirs} missing directory records")
+		conn.execute(
+			"DELETE FROM detections WHERE file_id IN "
+			"(SELECT id FROM files WHERE directory_id IN (SELECT id FROM gone_dirs))"
+		)
+		conn.execute("DELETE FROM files WHERE directory_id IN (SELECT id FROM gone_dirs)")
+		conn.execute("DELETE FROM directory_closure WHERE descendant_id IN (SELECT id FROM gone_dirs)")
+		conn.execute("DELETE FROM directories WHERE id IN (SELECT id FROM gone_dirs)")
+		_dir_cache.clear()
+	conn.execute("DROP TABLE temp.gone_files")
+	conn.execute("DROP TABLE temp.gone_dirs")
+	conn.commit()
+	return removed_files, removed_dirs
+
+def diff_untracked(conn: sqlite3.Connection) -> Iterator[str]:
+	"""Media files seen by the preceding walk_tree() that have no files row."""
+	cur = conn.execute(
+		"SELECT s.path FROM seen_files s LEFT JOIN files f ON f.path = s.path WHERE f.id IS NULL ORDER BY s.id"
+	)
+	for (path,) in cur:
+		yield path
+
+# ------------------ Run History ------------------
+def record_run(conn: sqlite3.Connection, exit_code: int, argv: List[str]) -> None:
+	"""Append this run's counters and stage timings to the runs table."""
+	c = RUN_STATS.counts
+	rates = RUN_STATS.rates()
+	stages = {name: round(secs, 3) for name, secs in RUN_STATS.seconds.items()}
+	try:
+		conn.execute(
+			"""INSERT INTO runs(started_at, finished_at, exit_code, root, args, files_seen, files_hashed,
+			files_inferred, files_reused, bytes_hashed, errors, files_per_sec, bytes_per_sec, stages)
+			VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?)""",
+			(
+				int(RUN_STATS.started_at), int(time.time()), exit_code, ROOT_SCAN_PATH, " ".join(argv),
+				c["files_seen"], c["files_hashed"], c["files_inferred"], c["files_reused"], c["bytes_hashed"],
+				len(DETECTION_ERRORS), rates["files_per_sec"], rates["hash_bytes_per_sec"], json.dumps(stages),
+			),
+		)
+		conn.commit()
+	except sqlite3.Error as e:
+		logger.error(f"Could not record run history: {e}")
+
+def write_prometheus_textfile(path: str, exit_code: int) -> None:
+	"""Write this run's metrics for the node-exporter textfile collector.
+
+	Written to a temporary file and renamed so the collector never reads a
+	partial file.
+	"""
+	c = RUN_STATS.counts
+	lines = [
+		"# HELP detection_run_stage_seconds Seconds spent per stage in the last detection run.",
+		"# TYPE detection_run_stage_seconds gauge",
+		*(f'detection_run_stage_seconds{{stage="{name}"}} {secs:.3f}' for name, secs in RUN_STATS.seconds.items()),
+		"# HELP detection_run_files Files per outcome in the last detection run.",
+		"# TYPE detection_run_files gauge",
+		*(f'detection_run_files{{kind="{kind}"}} {c[f"files_{kind}"]}' for kind in ("seen", "hashed", "queued", "inferred", "reused", "removed")),
+		"# HELP detection_run_bytes_hashed Bytes hashed in the last detection run.",
+		"# TYPE detection_run_bytes_hashed gauge",
+		f"detection_run_bytes_hashed {c['bytes_hashed']}",
+		"# HELP detection_run_errors Detection errors in the last run.",
+		"# TYPE detection_run_errors gauge",
+		f"detection_run_errors {len(DETECTION_ERRORS)}",
+		"# HELP detection_run_duration_seconds Wall-clock duration of the last detection run.",
+		"# TYPE detection_run_duration_seconds gauge",
+		f"detection_run_duration_seconds {RUN_STATS.elapsed():.3f}",
+		"# HELP detection_run_exit_code Exit code of the last detection run.",
+		"# TYPE detection_run_exit_code gauge",
+		f"detection_run_exit_code {exit_code}",
+		"# HELP detection_run_finished_timestamp_seconds Unix time the last detection run finished.",
+		"# TYPE detection_run_finished_timestamp_seconds gauge",
+		f"detection_run_finished_timestamp_seconds {int(time.time())}",
+	]
+	tmp = f"{path}.{os.getpid()}.tmp"
+	try:
+		with open(tmp, "w") as f:
+			f.write("\n".join(lines) + "\n")
+		os.replace(tmp, path)
+	except OSError as e:
+		logger.error(f"Could not write Prometheus textfile {path}: {e}")
 
 def summarize(conn: sqlite3.Connection) -> None:
 	logger.info("Summary (top 10 files by detection count):")
@@ -358,16 +1936,467 @@ def summarize(conn: sqlite3.Connection) -> None:
 	)
 	for path, cnt in cur.fetchall():
 		print(f"{cnt}\t{path}")
+	processed, reused, near = conn.execute(
+		"SELECT COUNT(processed_at), COUNT(reused_from), COUNT(CASE WHEN reuse_kind = 'near_duplicate' THEN 1 END) FROM files"
+	).fetchone()
+	if processed:
+		print(f"Detections reused from identical content: {reused - near}/{processed} processed files ({100.0 * (reused - near) / processed:.1f}%)")
+		print(f"Detections reused from near-duplicate images: {near}/{processed} processed files ({100.0 * near / processed:.1f}%)")
+	queued = conn.execute("SELECT COUNT(*) FROM work_queue").fetchone()[0]
+	if queued:
+		print(f"Files waiting in the work queue: {queued}")
+	if MAX_FILE_ATTEMPTS is not None:
+		for path, attempts, error in conn.execute(
+			"SELECT path, attempts, last_error FROM file_failures WHERE attempts >= ? ORDER BY path", (MAX_FILE_ATTEMPTS,)
+		):
+			print(f"Skipped after {attempts} failed runs: {path} ({error})")
+
+# ------------------ Query ------------------
+QUERY_PAGE_ROWS: int = 500  # Rows fetched per keyset page (no long-lived read transaction)
+QUERY_DRIVER_ROWS: int = 20000  # Filters matching fewer rows than this drive the query through their own index
+
+def parse_day(text: str, end: bool = False) -> int:
+	"""YYYY-MM-DD (local time) as epoch seconds; end=True gives the last second of that day."""
+	import datetime
+	day = datetime.datetime.strptime(text, "%Y-%m-%d")
+	if end:
+		day += datetime.timedelta(days=1)
+	return int(day.timestamp()) - (1 if end else 0)
+
+def parse_cursor(text: str) -> Tuple[int, int]:
+	mtime, _, file_id = text.partition(":")
+	return int(mtime), int(file_id)
+
+def capped_count(conn: sqlite3.Connection, sql: str, params: tuple) -> int:
+	"""Row count of sql, but stop counting at QUERY_DRIVER_ROWS."""
+	return conn.execute(f"SELECT COUNT(*) FROM ({sql} LIMIT ?)", (*params, QUERY_DRIVER_ROWS)).fetchone()[0]
+
+def query_filters(conn: sqlite3.Connection, args, ordered: bool = True) -> Tuple[str, str, list]:
+	"""FROM and WHERE clauses (over files f) and parameters for the query subcommand.
+
+	A class or directory filter matching fewer than QUERY_DRIVER_ROWS rows
+	drives the query through its own index. When every filter is broad, files
+	are read newest first from idx_files_mtime and checked one by one instead,
+	so a page never sorts the whole match set. ordered=False (counting)
+	always lets the indexes drive.
+	"""
+	where, params, sparse = ["f.mtime IS NOT NULL"], [], not ordered
+	if args.under:
+		# Same form as the walk's paths, which stay relative when ROOT_SCAN_PATH is
+		under = os.path.normpath(os.path.join(ROOT_SCAN_PATH, args.under))
+		row = conn.execute("SELECT id FROM directories WHERE path = ?", (under,)).fetchone()
+		if row is None:
+			raise LookupError(f"Directory not in the database: {under}")
+		subtree = "SELECT descendant_id FROM directory_closure WHERE ancestor_id = ?"
+		where.append(f"f.directory_id IN ({subtree})")
+		params.append(row[0])
+		sparse = sparse or capped_count(conn, f"SELECT 1 FROM files WHERE directory_id IN ({subtree})", (row[0],)) < QUERY_DRIVER_ROWS
+	if args.media_type:
+		where.append("f.media_type = ?")
+		params.append(args.media_type)
+	if args.since:
+		where.append("f.mtime >= ?")
+		params.append(parse_day(args.since))
+	if args.until:
+		where.append("f.mtime <= ?")
+		params.append(parse_day(args.until, end=True))
+	# All of the requested classes, each at --min-confidence or better
+	for cls in args.object_class or ():
+		hits = "SELECT file_id FROM detections WHERE object_class = ? AND confidence >= ?"
+		if not ordered or capped_count(conn, hits, (cls, args.min_confidence)) < QUERY_DRIVER_ROWS:
+			where.append(f"f.id IN ({hits})")
+			sparse = True
+		else:
+			# Unary + keeps SQLite on idx_detections_file for this per-file check
+			where.append("EXISTS (SELECT 1 FROM detections d WHERE d.file_id = f.id AND +d.object_class = ? AND d.confidence >= ?)")
+		params.extend((cls, args.min_confidence))
+	source = "files f" if sparse else "files f INDEXED BY idx_files_mtime"
+	return source, " AND ".join(where), params
+
+def query_files(conn: sqlite3.Connection, source: str, where: str, params: list, after: Optional[Tuple[int, int]] = None) -> Iterator[tuple]:
+	"""Yield (mtime, id, path, media_type, bucket, classes) newest first.
+
+	Pages by keyset on (mtime, id) so each page is a short read and a cursor
+	from a previous call resumes exactly where it stopped.
+	"""
+	while True:
+		cond, args = where, list(params)
+		if after is not None:
+			cond += " AND (f.mtime < ? OR (f.mtime = ? AND f.id < ?))"
+			args.extend((after[0], after[0], after[1]))
+		rows = conn.execute(
+			f"""
+			SELECT f.mtime, f.id, f.path, f.media_type, f.bucket,
+				(SELECT group_concat(object_class || '=' || printf('%.2f', conf), ',')
+				 FROM (SELECT object_class, MAX(confidence) AS conf FROM detections
+				       WHERE file_id = f.id GROUP BY object_class))
+			FROM {source} WHERE {cond}
+			ORDER BY f.mtime DESC, f.id DESC LIMIT ?
+			""",
+			(*args, QUERY_PAGE_ROWS),
+		).fetchall()
+		yield from rows
+		if len(rows) < QUERY_PAGE_ROWS:
+			return
+		after = (rows[-1][0], rows[-1][1])
+
+def parse_query_args(argv: List[str]):
+	import argparse
+	p = argparse.ArgumentParser(
+		prog="Detectionalgorithm.py query",
+		description="Find tracked files by detection class, confidence, media type, date and directory (read-only)",
+	)
+	p.add_argument("--class", dest="object_class", action="append", choices=sorted(TARGET_CLASSES), help="Require this class (repeat to require several)")
+	p.add_argument("--min-confidence", type=float, default=0.0, help="Minimum confidence for --class")
+	p.add_argument("--media-type", choices=("image", "video"), help="Only images or only videos")
+	p.add_argument("--since", help="Modified on or after YYYY-MM-DD")
+	p.add_argument("--until", help="Modified on or before YYYY-MM-DD")
+	p.add_argument("--under", help="Only files below this directory, relative to ROOT_SCAN_PATH")
+	p.add_argument("--limit", type=int, default=100, help="Rows to print (0 = all)")
+	p.add_argument("--after", help="Resume after this MTIME:ID cursor (printed when --limit cuts the output short)")
+	p.add_argument("--count", action="store_true", help="Only print the number of matching files")
+	p.add_argument("--json", action="store_true", help="One JSON object per line instead of tab-separated columns")
+	p.add_argument("--debug", action="store_true", help="Enable debug logging")
+	args = p.parse_args(argv)
+	try:
+		for day in (args.since, args.until):
+			if day:
+				parse_day(day)
+		if args.after:
+			parse_cursor(args.after)
+	except ValueError as e:
+		p.error(str(e))
+	return args
+
+def query_main(argv: List[str]) -> int:
+	args = parse_query_args(argv)
+	setup_logging(args.debug)
+	conn = connect_db()
+	init_db(conn)
+	try:
+		source, where, params = query_filters(conn, args, ordered=not args.count)
+	except LookupError as e:
+		print(e, file=sys.stderr)
+		conn.close()
+		return 1
+	if args.count:
+		print(conn.execute(f"SELECT COUNT(*) FROM {source} WHERE {where}", params).fetchone()[0])
+		conn.close()
+		return 0
+	after = parse_cursor(args.after) if args.after else None
+	printed = 0
+	try:
+		for mtime, file_id, path, media_type, bucket, classes in query_files(conn, source, where, params, after):
+			if args.limit and printed == args.limit:
+				print(f"More results: --after {after[0]}:{after[1]}", file=sys.stderr)
+				break
+			if args.json:
+				print(json.dumps({
+					"id": file_id, "path": path, "mtime": mtime, "media_type": media_type, "bucket": bucket,
+					"classes": {c: float(v) for c, v in (pair.split("=") for pair in classes.split(","))} if classes else {},
+				}))
+			else:
+				stamp = time.strftime("%Y-%m-%d %H:%M", time.localtime(mtime))
+				print(f"{stamp}\t{media_type}\t{bucket or ''}\t{classes or ''}\t{path}")
+			printed += 1
+			after = (mtime, file_id)
+	except BrokenPipeError:
+		# Piped into head and friends: stop quietly
+		os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+	conn.close()
+	return 0
+
+# ------------------ Daemon ------------------
+IN_MODIFY, IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO = 0x2, 0x8, 0x40, 0x80
+IN_CREATE, IN_DELETE, IN_DELETE_SELF = 0x100, 0x200, 0x400
+IN_Q_OVERFLOW, IN_IGNORED, IN_ONLYDIR, IN_ISDIR = 0x4000, 0x8000, 0x01000000, 0x40000000
+IN_NONBLOCK, IN_CLOEXEC = 0o4000, 0o2000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+INOTIFY_EVENT = struct.Struct("iIII")
+
+class TreeWatcher:
+	"""inotify watches on every directory under a root, through libc."""
+	def __init__(self):
+		self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+		self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self.fd < 0:
+			e = ctypes.get_errno()
+			raise OSError(e, os.strerror(e))
+		self.paths: dict = {}  # wd -> directory
+		self.complete = True    # False once a directory could not be watched
+
+	def add_tree(self, root: str) -> None:
+		for dirpath, _, _ in os.walk(root):
+			wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), WATCH_MASK)
+			if wd >= 0:
+				self.paths[wd] = dirpath
+				continue
+			e = ctypes.get_errno()
+			if e == errno.ENOSPC:
+				if self.complete:
+					logger.warning("inotify watch limit reached (raise fs.inotify.max_user_watches); "
+						"files below unwatched directories wait for the next full scan")
+				self.complete = False
+				return
+			if e not in (errno.ENOENT, errno.EACCES):
+				logger.warning(f"Cannot watch {dirpath}: {os.strerror(e)}")
+
+	def remove_tree(self, root: str) -> None:
+		"""Stop watching a directory moved out of the tree (its watches would follow it)."""
+		prefix = root.rstrip(os.sep) + os.sep
+		for wd, path in list(self.paths.items()):
+			if path == root or path.startswith(prefix):
+				self.libc.inotify_rm_watch(self.fd, wd)
+				del self.paths[wd]
+
+	def read_events(self) -> Iterator[Tuple[int, Optional[str]]]:
+		"""(mask, path) for every queued event; path is None when the queue overflowed."""
+		try:
+			buf = os.read(self.fd, 256 * 1024)
+		except BlockingIOError:
+			return
+		pos = 0
+		while pos + INOTIFY_EVENT.size <= len(buf):
+			wd, mask, _, length = INOTIFY_EVENT.unpack_from(buf, pos)
+			pos += INOTIFY_EVENT.size
+			name = buf[pos:pos + length].rstrip(b"\0")
+			pos += length
+			if mask & IN_Q_OVERFLOW:
+				yield mask, None
+				continue
+			if mask & IN_IGNORED:
+				self.paths.pop(wd, None)
+				continue
+			directory = self.paths.get(wd)
+			if directory is not None:
+				yield mask, os.path.join(directory, os.fsdecode(name)) if name else directory
+
+	def close(self) -> None:
+		os.close(self.fd)
+
+class ChangeTracker:
+	"""Debounces watch events into settled files to scan and paths to forget.
+
+	A file is ready once DAEMON_DEBOUNCE_SEC pass without an event for it and
+	its size and mtime are the same as at the previous check, so uploads still
+	being written (or copied in over Samba without further events) wait.
+	Removals are held back while files are settling, so a file moved within
+	the share keeps its old row as a source for detection reuse.
+	"""
+	def __init__(self, debounce: float):
+		self.debounce = debounce
+		self.pending: dict = {}  # path -> [due (monotonic), (size, mtime_ns) at the last check]
+		self.removed: set = set()
+
+	def touched(self, path: str, now: float) -> None:
+		entry = self.pending.setdefault(path, [0.0, None])
+		entry[0] = now + self.debounce
+		self.removed.discard(path)
+
+	def gone(self, path: str) -> None:
+		prefix = path + os.sep
+		for p in [p for p in self.pending if p == path or p.startswith(prefix)]:
+			del self.pending[p]
+		self.removed.add(path)
+
+	def ready(self, now: float, limit: int) -> List[str]:
+		out = []
+		for path, entry in list(self.pending.items()):
+			if entry[0] > now:
+				continue
+			try:
+				st = os.stat(path)
+			except OSError:
+				del self.pending[path]  # Its removal event is on its way
+				continue
+			fingerprint = (st.st_size, st.st_mtime_ns)
+			if fingerprint != entry[1]:
+				entry[0], entry[1] = now + self.debounce, fingerprint
+				continue
+			del self.pending[path]
+			out.append(path)
+			if len(out) >= limit:
+				break
+		return out
+
+	def take_removed(self) -> List[str]:
+		if self.pending:
+			return []
+		removed = sorted(p for p in self.removed if not os.path.lexists(p))
+		self.removed.clear()
+		return removed
+
+	def next_due(self) -> Optional[float]:
+		return min((entry[0] for entry in self.pending.values()), default=None)
+
+def load_paths(conn: sqlite3.Connection, paths: List[str]) -> int:
+	"""Fill the walk_tree() temp tables with just these files, so scan() handles only them."""
+	create_seen_tables(conn)
+	rows = []
+	for path in paths:
+		media_type = classify_media(path)
+		try:
+			st = os.stat(path)
+		except OSError:
+			continue
+		rows.append((path, os.path.dirname(path), media_type, st.st_size, int(st.st_mtime), st.st_ino))
+	# No seen_dirs rows: a directory's recorded mtime must only come from a full walk
+	conn.executemany("INSERT OR IGNORE INTO seen_files(path, dirpath, media_type, size, mtime, inode) VALUES(?,?,?,?,?,?)", rows)
+	conn.commit()
+	return len(rows)
+
+def remove_paths(conn: sqlite3.Connection, paths: List[str]) -> int:
+	"""Delete the rows of removed files, and of everything under removed directories."""
+	removed = 0
+	for path in paths:
+		cond, args = subtree_clause("path", path)
+		ids = f"SELECT id FROM files WHERE {cond}"
+		conn.execute(f"DELETE FROM detections WHERE file_id IN ({ids})", args)
+		removed += conn.execute(f"DELETE FROM files WHERE {cond}", args).rowcount
+		conn.execute(f"DELETE FROM directory_closure WHERE descendant_id IN (SELECT id FROM directories WHERE {cond})", args)
+		conn.execute(f"DELETE FROM directories WHERE {cond}", args)
+	conn.commit()
+	_dir_cache.clear()
+	return removed
+
+def run_daemon(args, argv: List[str], conn: sqlite3.Connection, model: Optional[YOLO], workers: int = 0) -> int:
+	"""Keep the model loaded and process files under ROOT_SCAN_PATH as they arrive.
+
+	With workers, the model lives in that many inference processes kept for
+	the daemon's lifetime instead of in this one (model is then None).
+
+	Watches are set before the startup pass, so nothing written during it is
+	missed. A full walk/scan/reconcile runs at startup, every
+	DAEMON_FULL_SCAN_HOURS, and after the inotify queue overflows. Each full
+	pass, and each incremental batch that hit errors, is recorded in 'runs'
+	and emailed like a cron run; stats of clean batches roll into the next one.
+	"""
+	global RUN_STATS
+	signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+	try:
+		watcher: Optional[TreeWatcher] = TreeWatcher()
+		watcher.add_tree(ROOT_SCAN_PATH)
+		logger.info(f"Watching {len(watcher.paths)} directories under {ROOT_SCAN_PATH}")
+	except OSError as e:
+		logger.error(f"inotify unavailable ({e}); only the periodic full scans will run")
+		watcher = None
+	tracker = ChangeTracker(DAEMON_DEBOUNCE_SEC)
+	next_full = time.monotonic()
+	procs = WorkerPool(workers, logger.isEnabledFor(logging.DEBUG)) if workers > 0 else None
+	scan_args = dict(batch_size=max(1, args.batch_size), io_threads=args.io_threads, worker_pool=procs,
+		reprocess_stale=args.reprocess_stale, file_timeout=args.file_timeout,
+		max_attempts=None if args.retry_failed else MAX_FILE_ATTEMPTS)
+	try:
+		while True:
+			now = time.monotonic()
+			if now >= next_full:
+				RUN_STATS = RunStats()
+				DETECTION_ERRORS.clear()
+				exit_code = full_pass(conn, model, 0, args, worker_pool=procs)
+				finish_run(conn, exit_code, argv, args)
+				del LOG_BUFFER[:]
+				next_full = time.monotonic() + DAEMON_FULL_SCAN_HOURS * 3600
+				continue
+			due = tracker.next_due()
+			timeout = max(0.0, min(next_full, due if due is not None else next_full) - now)
+			if watcher is None:
+				time.sleep(min(timeout, 60.0))
+				continue
+			if select.select([watcher.fd], [], [], min(timeout, 60.0))[0]:
+				for mask, path in watcher.read_events():
+					if path is None:
+						logger.warning("inotify queue overflowed; running a full scan")
+						next_full = time.monotonic()
+					elif mask & IN_ISDIR:
+						if mask & (IN_CREATE | IN_MOVED_TO):
+							# Files may land before the new directory's watch exists
+							watcher.add_tree(path)
+							for dirpath, _, filenames in os.walk(path):
+								for name in filenames:
+									if classify_media(name):
+										tracker.touched(os.path.join(dirpath, name), time.monotonic())
+						elif mask & IN_MOVED_FROM:
+							watcher.remove_tree(path)
+							tracker.gone(path)
+						elif mask & IN_DELETE:
+							tracker.gone(path)
+					elif mask & (IN_DELETE | IN_MOVED_FROM):
+						if classify_media(path):
+							tracker.gone(path)
+					elif mask & IN_DELETE_SELF:
+						continue
+					elif classify_media(path):
+						tracker.touched(path, time.monotonic())
+			ready = tracker.ready(time.monotonic(), DAEMON_BATCH_FILES)
+			if ready:
+				load_paths(conn, ready)
+				exit_code = 0
+				try:
+					scan(ROOT_SCAN_PATH, conn, model, **scan_args)
+				except Exception as e:
+					unhandled = f"Unhandled exception while processing new files: {e}"
+					logger.critical(unhandled)
+					DETECTION_ERRORS.append(unhandled)
+					exit_code = 3
+				logger.info(f"Processed {len(ready)} new or changed files")
+				if DETECTION_ERRORS:
+					# Report now; the next full pass may be days away and starts from a clean slate
+					finish_run(conn, exit_code, argv, args)
+					RUN_STATS = RunStats()
+					DETECTION_ERRORS.clear()
+					del LOG_BUFFER[:]
+			removed = tracker.take_removed()
+			if removed:
+				logger.info(f"Removed {remove_paths(conn, removed)} file records under {len(removed)} deleted paths")
+			del LOG_BUFFER[:-500]
+	finally:
+		if watcher is not None:
+			watcher.close()
+		if procs is not None:
+			procs.shutdown()
 
 def parse_args(argv: List[str]):
 	import argparse
 	p = argparse.ArgumentParser(description="Recursive YOLO people/dog detection (cron-friendly)")
-	p.add_argument("--diff", action="store_true", help="Show media files not yet tracked")
-	p.add_argument("--summary", action="store_true", help="Print detection summary")
+	p.add_argument("--diff", action="store_true", help="Show media files not yet tracked (read-only, no scan)")
+	p.add_argument("--summary", action="store_true", help="Print detection summary (read-only, no scan)")
+	p.add_argument("--daemon", action="store_true", help="Stay running: keep the model loaded and process new files as they arrive")
 	p.add_argument("--debug", action="store_true", help="Enable debug logging")
-	return p.parse_args(argv)
+	p.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Images per model call (1 = no batching)")
+	p.add_argument("--backend", choices=("torch", "onnx", "openvino", "ncnn"), default=BACKEND, help="Inference backend (exported and validated on first use)")
+	p.add_argument("--int8", action="store_true", default=BACKEND_INT8, help="Use an int8-quantized export (onnx, openvino)")
+	p.add_argument("--reprocess-stale", action="store_true", help="Re-run files processed with a different model or thresholds")
+	p.add_argument("--workers", type=int, default=WORKERS, help="Inference processes, each with its own model (0 = in-process, or one process with --file-timeout)")
+	p.add_argument("--io-threads", type=int, default=IO_THREADS, help="Threads for stat/hash/decode")
+	p.add_argument("--verify-hashes", action="store_true", help="Re-hash every file even if size/mtime/inode are unchanged")
+	p.add_argument("--skip-unchanged-dirs", action="store_true", help="Skip per-file checks in directories whose mtime is unchanged")
+	p.add_argument("--prometheus-textfile", default=PROMETHEUS_TEXTFILE, help="Write run metrics to this node-exporter textfile")
+	p.add_argument("--queue", action="store_true", help="Process pending files from a persistent, checkpointed work queue")
+	p.add_argument("--priority", choices=tuple(QUEUE_PRIORITIES), default=QUEUE_PRIORITY, help="Work queue order (implies --queue)")
+	p.add_argument("--time-budget", type=float, help="Stop starting new files after this many seconds (implies --queue)")
+	p.add_argument("--resume", action="store_true", help="Drain the existing work queue without walking ROOT_SCAN_PATH again")
+	p.add_argument("--file-timeout", type=float, default=FILE_TIMEOUT_SEC, help="Give up on one video or worker job after this many seconds (0 = never); "
+		"inference then runs in at least one worker process, also with --daemon, so a hung file can be killed")
+	p.add_argument("--retry-failed", action="store_true", help=f"Retry files that failed {MAX_FILE_ATTEMPTS} runs in a row")
+	args = p.parse_args(argv)
+	if args.resume and args.diff:
+		p.error("--diff needs a walk and can't be combined with --resume")
+	if args.daemon and (args.queue or args.resume or args.time_budget is not None or args.priority != QUEUE_PRIORITY):
+		p.error("--daemon can't be combined with the work queue options")
+	if args.file_timeout is not None and args.file_timeout <= 0:
+		args.file_timeout = None
+	args.queue = args.queue or args.resume or args.time_budget is not None or args.priority != QUEUE_PRIORITY
+	return args
 
 def send_failure_email(subject: str, body: str) -> None:
+	if ALERT_SPOOL:
+		try:
+			subprocess.run([sys.executable, ALERT_SPOOL, "send", "--source", "Detectionalgorithm.py",
+				"--subject", subject, "--body-file", "-"], input=body, text=True, check=True, timeout=60)
+			logger.info("Failure email queued with the alert spool")
+		except (OSError, subprocess.SubprocessError) as e:
+			logger.error(f"Failed to queue failure email: {e}")
+		return
 	if not EMAIL_RECIPIENTS or not SMTP_HOST:
 		return
 	try:
@@ -393,44 +2422,55 @@ def send_failure_email(subject: str, body: str) -> None:
 	except Exception as e:
 		logger.error(f"Failed to send failure email: {e}")
 
-def main(argv: List[str]) -> int:
-	args = parse_args(argv)
-	setup_logging(args.debug)
-	conn = connect_db()
-	init_db(conn)
-	exit_code = 0
-	model = None
+def full_pass(
+	conn: sqlite3.Connection, model: Optional[YOLO], workers: int, args, deadline: Optional[float] = None,
+	worker_pool: Optional[WorkerPool] = None,
+) -> int:
+	"""Walk, scan and reconcile ROOT_SCAN_PATH; returns the exit code."""
 	try:
-		model = load_model()
-	except Exception as e:
-		logger.critical(f"Model load failed: {e}")
-		exit_code = 2
-	if model and exit_code == 0:
-		try:
-			if args.diff:
-				missing = diff_untracked(ROOT_SCAN_PATH, conn)
-				if missing:
-					print("Untracked media files:")
-					for p in missing:
-						print(p)
-				else:
-					print("No untracked media files.")
-			scan(ROOT_SCAN_PATH, conn, model)
+		if not args.resume:
+			walk_tree(ROOT_SCAN_PATH, conn, skip_unchanged_dirs=args.skip_unchanged_dirs and not args.verify_hashes)
+		scan(
+			ROOT_SCAN_PATH,
+			conn,
+			model,
+			batch_size=max(1, args.batch_size),
+			verify_hashes=args.verify_hashes,
+			io_threads=args.io_threads,
+			workers=workers,
+			worker_pool=worker_pool,
+			reprocess_stale=args.reprocess_stale,
+			use_queue=args.queue,
+			resume=args.resume,
+			priority=args.priority,
+			deadline=deadline,
+			file_timeout=args.file_timeout,
+			max_attempts=None if args.retry_failed else MAX_FILE_ATTEMPTS,
+		)
+		if not args.resume:
 			reconcile_removed(ROOT_SCAN_PATH, conn)
-			if args.summary:
-				summarize(conn)
-		except Exception as e:
-			unhandled = f"Unhandled exception during scan: {e}"
-			logger.critical(unhandled)
-			DETECTION_ERRORS.append(unhandled)
-			exit_code = 3
-	conn.close()
+	except Exception as e:
+		unhandled = f"Unhandled exception during scan: {e}"
+		logger.critical(unhandled)
+		DETECTION_ERRORS.append(unhandled)
+		return 3
+	return 0
+
+def finish_run(conn: sqlite3.Connection, exit_code: int, argv: List[str], args) -> None:
+	"""Log, record and export the run's stats, and email if anything failed."""
+	for line in RUN_STATS.breakdown():
+		logger.info(line)
+	record_run(conn, exit_code, argv)
+	if args.prometheus_textfile:
+		write_prometheus_textfile(args.prometheus_textfile, exit_code)
 	if exit_code != 0 or DETECTION_ERRORS:
 		subject = f"Detection Script Failure (exit={exit_code} errors={len(DETECTION_ERRORS)})"
 		body_sections = [
 			f"Exit Code: {exit_code}",
 			f"Root Path: {ROOT_SCAN_PATH}",
 			f"Total Detection Errors: {len(DETECTION_ERRORS)}",
+			"\n-- Stage Breakdown --",
+			*RUN_STATS.breakdown(),
 			"\n-- Recent Log (up to 500 lines) --",
 			*LOG_BUFFER[-500:],
 		]
@@ -438,7 +2478,59 @@ def main(argv: List[str]) -> int:
 			body_sections.append("\n-- Error Details --")
 			body_sections.extend(DETECTION_ERRORS)
 		send_failure_email(subject, "\n".join(body_sections))
+
+def main(argv: List[str]) -> int:
+	if argv[:1] == ["query"]:
+		return query_main(argv[1:])
+	args = parse_args(argv)
+	deadline = time.monotonic() + args.time_budget if args.time_budget is not None else None
+	setup_logging(args.debug)
+	conn = connect_db()
+	init_db(conn)
+	if args.summary or args.diff:
+		# Read-only: no model, no scan, and no torch/OpenCV import
+		if args.diff:
+			walk_tree(ROOT_SCAN_PATH, conn)
+			untracked = 0
+			for p in diff_untracked(conn):
+				if not untracked:
+					print("Untracked media files:")
+				print(p)
+				untracked += 1
+			if not untracked:
+				print("No untracked media files.")
+		if args.summary:
+			summarize(conn)
+		conn.close()
+		return 0
+	exit_code = 0
+	model = None
+	prepare_backend(conn, args.backend, args.int8)
+	requested = 0 if args.daemon else args.workers
+	if args.daemon and args.workers:
+		logger.info("--daemon keeps one model loaded; --workers is ignored")
+	if requested <= 0 and args.file_timeout is not None:
+		# Only a separate process can be killed out of a hung read or model call
+		requested = 1
+	workers = plan_workers(requested)
+	if workers == 0 and args.file_timeout is not None:
+		logger.warning("Running inference in-process: --file-timeout is only checked between video frames")
+	if workers == 0:
+		try:
+			model = load_model()
+		except Exception as e:
+			logger.critical(f"Model load failed: {e}")
+			exit_code = 2
+	if args.daemon and exit_code == 0:
+		try:
+			return run_daemon(args, argv, conn, model, workers)
+		finally:
+			conn.close()
+	if (model or workers) and exit_code == 0:
+		exit_code = full_pass(conn, model, workers, args, deadline)
+	finish_run(conn, exit_code, argv, args)
+	conn.close()
 	return exit_code
 
 if __name__ == "__main__":
-	raise SystemExit(main(sys.argv[1:]))
\ No newline at end of file
+	raise SystemExit(main(sys.argv[1:]))
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""Random media selection for the photo viewer.
+
+Draws files from the viewer buckets that Detectionalgorithm.py maintains in
+files.bucket (both, dog_only, person_only, neither), per media type. Each
+draw picks a random id between the bucket's lowest and highest id and takes
+the first row at or above it from idx_files_bucket. That is a few index
+lookups per item, however large the library gets, instead of sorting the
+whole table with ORDER BY RANDOM(). Ids left behind by deleted rows make the
+draw slightly uneven; files after a large gap come up a little more often.
+
+Paths that no longer exist or can't be read are skipped, and so are
+near-duplicates of an image already picked (same directory, close mtime and
+files.phash, e.g. burst shots), so one burst fills at most one slot. A bucket
+with fewer usable files than requested returns what it has.
+
+Example (what Photo-Viewer.sh runs):
+	python Media_Selector.py --db share_detections.db image:both=20 image:dog_only=10 video:neither=5
+"""
+import os
+import sys
+import random
+import sqlite3
+from typing import List, Optional, Tuple
+
+DB_PATH: str = "share_detections.db"        # Same database as Detectionalgorithm.py
+MEDIA_TYPES = ("image", "video")
+BUCKETS = ("both", "dog_only", "person_only", "neither")
+DRAWS_PER_ITEM: int = 5                     # Random probes per requested item before filling sequentially
+NEAR_DUPLICATE_MAX_DISTANCE: int = 5        # Same near-duplicate test as Detectionalgorithm.py: max differing phash bits...
+NEAR_DUPLICATE_WINDOW_SEC: int = 30         # ...and max mtime difference, within one directory
+
+def connect_db(path: str) -> sqlite3.Connection:
+	# Read-only, so a running detection scan is never blocked
+	return sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=30)
+
+def usable(path: str) -> bool:
+	return os.path.isfile(path) and os.access(path, os.R_OK)
+
+def near_duplicate(a: tuple, b: tuple) -> bool:
+	"""Whether two (directory_id, mtime, phash) keys look like frames of one burst."""
+	if a[2] is None or b[2] is None or a[0] != b[0] or abs(a[1] - b[1]) > NEAR_DUPLICATE_WINDOW_SEC:
+		return False
+	return bin((a[2] ^ b[2]) & 0xFFFFFFFFFFFFFFFF).count("1") <= NEAR_DUPLICATE_MAX_DISTANCE
+
+def sample_bucket(
+	conn: sqlite3.Connection,
+	media_type: str,
+	bucket: str,
+	count: int,
+	rng: Optional[random.Random] = None,
+) -> List[str]:
+	"""Up to count distinct, readable paths from one media type and bucket."""
+	rng = rng or random.Random()
+	if count <= 0:
+		return []
+	lo, hi = conn.execute(
+		"SELECT MIN(id), MAX(id) FROM files WHERE media_type=? AND bucket=?", (media_type, bucket)
+	).fetchone()
+	if lo is None:
+		return []
+	picked: dict = {}  # id -> path, in draw order
+	keys: List[tuple] = []  # (directory_id, mtime, phash) of each pick
+	tried = set()
+
+	def take(row: tuple) -> None:
+		if row[0] not in tried:
+			tried.add(row[0])
+			key = row[2:]
+			if not any(near_duplicate(key, k) for k in keys) and usable(row[1]):
+				picked[row[0]] = row[1]
+				keys.append(key)
+
+	for _ in range(count * DRAWS_PER_ITEM):
+		if len(picked) >= count:
+			break
+		row = conn.execute(
+			"SELECT id, path, directory_id, mtime, phash FROM files WHERE media_type=? AND bucket=? AND id>=? ORDER BY id LIMIT 1",
+			(media_type, bucket, rng.randint(lo, hi)),
+		).fetchone()
+		if row:
+			take(row)
+	if len(picked) < count:
+		# Small or mostly missing bucket: walk it from a random point, wrapping once
+		start = rng.randint(lo, hi)
+		for cond, args in (("id>=?", (start,)), ("id<?", (start,))):
+			cur = conn.execute(
+				f"SELECT id, path, directory_id, mtime, phash FROM files WHERE media_type=? AND bucket=? AND {cond} ORDER BY id",
+				(media_type, bucket, *args),
+			)
+			for row in cur:
+				take(row)
+				if len(picked) >= count:
+					break
+			if len(picked) >= count:
+				break
+	return list(picked.values())
+
+def select_groups(
+	conn: sqlite3.Connection,
+	groups: List[Tuple[str, str, int]],
+	rng: Optional[random.Random] = None,
+) -> List[str]:
+	"""Sample every (media_type, bucket, count) group, warning on shortfalls."""
+	paths = []
+	for media_type, bucket, count in groups:
+		got = sample_bucket(conn, media_type, bucket, count, rng)
+		if len(got) < count:
+			print(f"Warning: only {len(got)}/{count} {media_type} files available in bucket {bucket}", file=sys.stderr)
+		paths.extend(got)
+	return paths
+
+def parse_group(spec: str) -> Tuple[str, str, int]:
+	"""'image:dog_only=10' -> ('image', 'dog_only', 10)."""
+	import argparse
+	try:
+		kind, count = spec.split("=", 1)
+		media_type, bucket = kind.split(":", 1)
+		count = int(count)
+	except ValueError:
+		raise argparse.ArgumentTypeError(f"expected MEDIA:BUCKET=COUNT, got {spec!r}")
+	if media_type not in MEDIA_TYPES or bucket not in BUCKETS:
+		raise argparse.ArgumentTypeError(f"unknown media type or bucket in {spec!r}")
+	return media_type, bucket, count
+
+def parse_args(argv: List[str]):
+	import argparse
+	p = argparse.ArgumentParser(description="Random photo viewer selection from the detection database")
+	p.add_argument("--db", default=DB_PATH, help="share_detections.db written by Detectionalgorithm.py")
+	p.add_argument("--seed", type=int, help="Seed for a repeatable selection")
+	p.add_argument("groups", nargs="+", type=parse_group, metavar="MEDIA:BUCKET=COUNT",
+		help=f"Media type ({', '.join(MEDIA_TYPES)}), bucket ({', '.join(BUCKETS)}) and count")
+	return p.parse_args(argv)
+
+def main(argv: List[str]) -> int:
+	args = parse_args(argv)
+	try:
+		conn = connect_db(args.db)
+		try:
+			paths = select_groups(conn, args.groups, random.Random(args.seed))
+		finally:
+			conn.close()
+	except sqlite3.OperationalError as e:
+		# e.g. a database from before files.bucket or files.phash; the next detection run adds it
+		print(f"Selection failed on {args.db}: {e}", file=sys.stderr)
+		return 1
+	for path in paths:
+		print(path)
+	return 0
+
+if __name__ == "__main__":
+	raise SystemExit(main(sys.argv[1:]))
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""Display-resolution rendition cache for the photo viewer.
+
+Photo-Viewer.sh passes each new playlist through this script. Images are
+scaled down to the panel size (EXIF orientation applied, HEIC decoded when
+pillow-heif is installed). Animated GIF/WebP/PNG files are left as they are,
+so they keep playing. With --videos, videos are transcoded to the panel size
+with ffmpeg, at full length. The output playlist points at the cached
+rendition where one exists and at the original otherwise.
+
+Renditions are keyed by the file's sha256 from share_detections.db plus the
+rendition settings. Moved or duplicated files therefore share one
+rendition, and changing the panel size never serves stale ones. They live
+in RENDITION_DIR, with an index (renditions.db) that records each file's
+size and last use. Once the cache is over its cap, the least recently used
+renditions are evicted.
+
+Rendering only happens within --time-budget seconds (Photo-Viewer.sh gives
+it the SELECT_TIME..START_TIME window); with a budget of 0 the playlist is
+only mapped onto renditions that already exist.
+
+Example:
+	python Rendition_Cache.py --db share_detections.db --playlist in.txt --output out.txt --time-budget 1800
+"""
+import os
+import sys
+import time
+import sqlite3
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+# ------------------ Configuration Constants ------------------
+DB_PATH: str = "share_detections.db"        # Detection database (read-only here)
+RENDITION_DIR: str = "renditions"           # Cache directory, next to the database by default
+PANEL_SIZE: Tuple[int, int] = (1280, 720)   # Renditions fit inside this box (either orientation)
+CACHE_MAX_MB: int = 2048                    # Evict least recently used renditions above this size
+JPEG_QUALITY: int = 88
+VIDEO_CRF: int = 26                         # x264 quality for video renditions (lower = better, larger)
+RENDER_THREADS: int = 2                     # Images rendered in parallel (Pillow releases the GIL while decoding)
+FFMPEG_TIMEOUT_SEC: int = 3600              # Give up on one video rendition after this long
+ANIMATED_EXT = {".gif", ".webp", ".png"}    # Formats that may hold an animation (played from the original)
+
+logger = logging.getLogger("renditions")
+
+def setup_logging(debug: bool) -> None:
+	# Same line format as Photo-Viewer.sh's log(), which this output is appended to
+	handler = logging.StreamHandler(sys.stderr)
+	handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", "%Y-%m-%d %H:%M:%S"))
+	logger.addHandler(handler)
+	logger.setLevel(logging.DEBUG if debug else logging.INFO)
+
+# ------------------ Cache Index ------------------
+def open_index(cache_dir: str) -> sqlite3.Connection:
+	os.makedirs(cache_dir, exist_ok=True)
+	conn = sqlite3.connect(os.path.join(cache_dir, "renditions.db"), timeout=30)
+	conn.execute("PRAGMA journal_mode=WAL")
+	conn.executescript(
+		"""
+		CREATE TABLE IF NOT EXISTS renditions (
+			key TEXT PRIMARY KEY,
+			path TEXT NOT NULL,
+			bytes INTEGER NOT NULL,
+			created_at INTEGER NOT NULL,
+			last_used INTEGER NOT NULL
+		);
+		CREATE INDEX IF NOT EXISTS idx_renditions_last_used ON renditions(last_used);
+		"""
+	)
+	return conn
+
+def lookup_hashes(db_path: str, paths: List[str]) -> Dict[str, str]:
+	"""path -> sha256 for the paths the detection database knows."""
+	conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=30)
+	try:
+		found = {}
+		for i in range(0, len(paths), 500):
+			chunk = paths[i:i + 500]
+			rows = conn.execute(
+				f"SELECT path, sha256 FROM files WHERE sha256 IS NOT NULL AND path IN ({','.join('?' * len(chunk))})",
+				chunk,
+			)
+			found.update(rows)
+		return found
+	finally:
+		conn.close()
+
+def rendition_key(sha256: str, media_type: str) -> str:
+	w, h = PANEL_SIZE
+	if media_type == "video":
+		return f"{sha256}_{w}x{h}_full_crf{VIDEO_CRF}.mp4"
+	return f"{sha256}_{w}x{h}_q{JPEG_QUALITY}.jpg"
+
+def rendition_path(cache_dir: str, key: str) -> str:
+	return os.path.join(cache_dir, key[:2], key)
+
+# ------------------ Rendering ------------------
+def fit_box(width: int, height: int) -> Tuple[int, int]:
+	"""PANEL_SIZE, turned to match the media's orientation."""
+	long_side, short_side = max(PANEL_SIZE), min(PANEL_SIZE)
+	return (long_side, short_side) if width >= height else (short_side, long_side)
+
+def render_image(src: str, dst: str) -> None:
+	from PIL import Image, ImageOps
+	try:
+		from pillow_heif import register_heif_opener
+		register_heif_opener()
+	except ImportError:
+		pass
+	with Image.open(src) as im:
+		box = fit_box(*im.size)
+		# JPEG only: let libjpeg decode at 1/2, 1/4 or 1/8 scale straight away
+		im.draft("RGB", (box[0], box[1]))
+		im = ImageOps.exif_transpose(im)
+		if im.mode not in ("RGB", "L"):
+			im = im.convert("RGB")
+		im.thumbnail(fit_box(*im.size), Image.LANCZOS)
+		tmp = f"{dst}.{os.getpid()}.tmp"
+		try:
+			im.save(tmp, "JPEG", quality=JPEG_QUALITY, optimize=True)
+			os.replace(tmp, dst)
+		finally:
+			if os.path.exists(tmp):
+				os.remove(tmp)
+
+def render_video(src: str, dst: str, timeout: float = FFMPEG_TIMEOUT_SEC) -> None:
+	long_side, short_side = max(PANEL_SIZE), min(PANEL_SIZE)
+	# Fit inside the panel in either orientation (ffmpeg has already applied any
+	# rotation), never upscale, and keep even dimensions for x264
+	scale = (
+		f"scale=w='min(iw,if(gte(iw,ih),{long_side},{short_side}))':h='min(ih,if(gte(iw,ih),{short_side},{long_side}))'"
+		":force_original_aspect_ratio=decrease:force_divisible_by=2"
+	)
+	tmp = f"{dst}.{os.getpid()}.tmp.mp4"
+	cmd = [
+		"ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-i", src,
+		"-vf", scale, "-c:v", "libx264", "-preset", "veryfast", "-crf", str(VIDEO_CRF),
+		"-pix_fmt", "yuv420p", "-c:a", "aac", "-b:a", "96k", "-movflags", "+faststart", tmp,
+	]
+	try:
+		subprocess.run(cmd, check=True, capture_output=True, timeout=timeout)
+		os.replace(tmp, dst)
+	except subprocess.CalledProcessError as e:
+		raise RuntimeError(e.stderr.decode(errors="replace").strip() or f"ffmpeg exit {e.returncode}")
+	except subprocess.TimeoutExpired:
+		raise RuntimeError(f"ffmpeg timed out after {timeout:.0f}s")
+	finally:
+		# Also the partial output of a failed or timed out ffmpeg
+		if os.path.exists(tmp):
+			os.remove(tmp)
+
+def is_animated(path: str) -> bool:
+	"""True for multi-frame images; a JPEG rendition would freeze them on the first frame."""
+	if os.path.splitext(path)[1].lower() not in ANIMATED_EXT:
+		return False
+	from PIL import Image
+	try:
+		with Image.open(path) as im:
+			return bool(getattr(im, "is_animated", False))
+	except OSError:
+		return False
+
+def media_type_of(path: str) -> str:
+	ext = os.path.splitext(path)[1].lower()
+	return "video" if ext in {".mp4", ".mov", ".avi", ".mpg", ".mpeg", ".wmv", ".3gp"} else "image"
+
+# ------------------ Cache Operations ------------------
+def build(
+	index: sqlite3.Connection,
+	cache_dir: str,
+	wanted: List[Tuple[str, str, str]],
+	deadline: float,
+	videos: bool,
+) -> int:
+	"""Render the missing (src, key, media_type) renditions until deadline. Returns how many were made."""
+	todo = [(src, key, mt) for src, key, mt in wanted if mt == "image" or videos]
+	made = 0
+
+	def render(src: str, key: str, media_type: str) -> Optional[int]:
+		if time.monotonic() >= deadline:
+			return None
+		dst = rendition_path(cache_dir, key)
+		os.makedirs(os.path.dirname(dst), exist_ok=True)
+		try:
+			if media_type == "video":
+				# Stop ffmpeg at the deadline rather than holding up the playlist
+				render_video(src, dst, min(FFMPEG_TIMEOUT_SEC, deadline - time.monotonic()))
+			else:
+				render_image(src, dst)
+		except Exception as e:
+			logger.warning(f"Rendition failed, using original: {src} ({e})")
+			return None
+		return os.path.getsize(dst)
+
+	images = [w for w in todo if w[2] == "image"]
+	with ThreadPoolExecutor(max_workers=max(1, RENDER_THREADS)) as pool:
+		sizes = list(pool.map(lambda w: render(*w), images))
+	# ffmpeg already uses every core, so videos go one at a time
+	sizes += [render(*w) for w in todo if w[2] == "video"]
+	now = int(time.time())
+	for (src, key, _), size in zip(images + [w for w in todo if w[2] == "video"], sizes):
+		if size is None:
+			continue
+		index.execute(
+			"INSERT OR REPLACE INTO renditions(key, path, bytes, created_at, last_used) VALUES(?,?,?,?,?)",
+			(key, rendition_path(cache_dir, key), size, now, now),
+		)
+		made += 1
+	index.commit()
+	if len(todo) > made and time.monotonic() >= deadline:
+		logger.info(f"Time budget reached; {len(todo) - made} renditions left for the next playlist")
+	return made
+
+def evict(index: sqlite3.Connection, keep: set, max_bytes: int) -> None:
+	"""Delete least recently used renditions (never those in keep) until under max_bytes."""
+	total = index.execute("SELECT COALESCE(SUM(bytes), 0) FROM renditions").fetchone()[0]
+	if total <= max_bytes:
+		return
+	removed = 0
+	for key, path, size in index.execute("SELECT key, path, bytes FROM renditions ORDER BY last_used").fetchall():
+		if total <= max_bytes:
+			break
+		if key in keep:
+			continue
+		try:
+			os.remove(path)
+		except FileNotFoundError:
+			pass
+		except OSError as e:
+			logger.warning(f"Could not evict {path}: {e}")
+			continue
+		index.execute("DELETE FROM renditions WHERE key=?", (key,))
+		total -= size
+		removed += 1
+	index.commit()
+	logger.info(f"Evicted {removed} renditions; cache now {total / (1 << 20):.0f} MB")
+
+def map_playlist(
+	db_path: str,
+	cache_dir: str,
+	paths: List[str],
+	time_budget: float,
+	videos: bool,
+	max_bytes: int,
+) -> List[str]:
+	"""Return paths with each entry swapped for its rendition where one exists."""
+	deadline = time.monotonic() + time_budget
+	hashes = lookup_hashes(db_path, paths)
+	keys = {p: rendition_key(hashes[p], media_type_of(p)) for p in paths if p in hashes and not is_animated(p)}
+	index = open_index(cache_dir)
+	try:
+		cached = {}
+		wanted = set(keys.values())
+		for key, path in index.execute("SELECT key, path FROM renditions").fetchall():
+			if key in wanted:
+				if os.path.isfile(path):
+					cached[key] = path
+				else:
+					index.execute("DELETE FROM renditions WHERE key=?", (key,))
+		missing = {key: (p, key, media_type_of(p)) for p, key in keys.items() if key not in cached}
+		if missing and time_budget > 0:
+			made = build(index, cache_dir, list(missing.values()), deadline, videos)
+			logger.info(f"Rendered {made}/{len(missing)} missing renditions")
+			for key in missing:
+				path = rendition_path(cache_dir, key)
+				if os.path.isfile(path):
+					cached[key] = path
+		used = [key for key in keys.values() if key in cached]
+		index.executemany("UPDATE renditions SET last_used=? WHERE key=?", [(int(time.time()), k) for k in used])
+		index.commit()
+		evict(index, set(used), max_bytes)
+	finally:
+		index.close()
+	logger.info(f"Playlist uses {len(used)}/{len(paths)} renditions")
+	return [cached.get(keys.get(p), p) for p in paths]
+
+def parse_args(argv: List[str]):
+	import argparse
+	p = argparse.ArgumentParser(description="Map a photo viewer playlist onto display-size renditions")
+	p.add_argument("--db", default=DB_PATH, help="share_detections.db written by Detectionalgorithm.py")
+	p.add_argument("--cache-dir", help="Rendition directory (default: 'renditions' next to --db)")
+	p.add_argument("--playlist", required=True, help="Input playlist, one path per line")
+	p.add_argument("--output", required=True, help="Output playlist")
+	p.add_argument("--time-budget", type=float, default=0, help="Seconds allowed for rendering (0 = only use existing renditions)")
+	p.add_argument("--size", default=f"{PANEL_SIZE[0]}x{PANEL_SIZE[1]}", help="Panel size WxH")
+	p.add_argument("--max-mb", type=int, default=CACHE_MAX_MB, help="Cache size cap in MB")
+	p.add_argument("--videos", action="store_true", help="Also transcode videos to the panel size (needs ffmpeg)")
+	p.add_argument("--debug", action="store_true")
+	return p.parse_args(argv)
+
+def main(argv: List[str]) -> int:
+	global PANEL_SIZE
+	args = parse_args(argv)
+	setup_logging(args.debug)
+	w, _, h = args.size.partition("x")
+	PANEL_SIZE = (int(w), int(h))
+	cache_dir = args.cache_dir or os.path.join(os.path.dirname(os.path.abspath(args.db)), RENDITION_DIR)
+	with open(args.playlist) as f:
+		paths = [line.rstrip("\n") for line in f if line.strip()]
+	try:
+		mapped = map_playlist(args.db, cache_dir, paths, args.time_budget, args.videos, args.max_mb << 20)
+	except (sqlite3.Error, OSError) as e:
+		logger.error(f"Rendition cache unavailable, using originals: {e}")
+		mapped = paths
+	tmp = f"{args.output}.tmp"
+	with open(tmp, "w") as f:
+		f.writelines(p + "\n" for p in mapped)
+	os.replace(tmp, args.output)
+	return 0
+
+if __name__ == "__main__":
+	raise SystemExit(main(sys.argv[1:]))
@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+"""Resident controller for the photo frame, started by Photo-Viewer.sh.
+
+One asyncio process runs mpv and holds a single IPC connection to it.
+Commands carry request ids and are matched to their replies. Pause state and
+file changes arrive as events instead of being polled. The same loop runs
+the daily schedule, touch gestures (evdev), night-time idle screen-off and
+auto-advance, so nothing spawns an interpreter per command any more.
+
+Playlists are still built by Photo-Viewer.sh (BUILD_PLAYLIST_CMD), once a day
+at SELECT_TIME, or straight away when the playlist file is missing.
+
+Configuration comes from the environment, with the same names and defaults
+as Photo-Viewer.sh, which exports them before starting this script.
+"""
+import os
+import sys
+import json
+import signal
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# ------------------ Configuration (from Photo-Viewer.sh) ------------------
+SELECT_TIME = os.environ.get("SELECT_TIME", "05:30")
+START_TIME = os.environ.get("START_TIME", "06:00")
+STOP_TIME = os.environ.get("STOP_TIME", "23:00")
+AUTO_ADVANCE_SEC = int(os.environ.get("AUTO_ADVANCE_SEC", "60"))
+IDLE_TIMEOUT_SEC = int(os.environ.get("IDLE_TIMEOUT_SEC", "300"))
+DEBUG_AFTER_HOURS = os.environ.get("DEBUG_AFTER_HOURS", "0") == "1"
+FORCE_PLAY = os.environ.get("FORCE_PLAY", "0") == "1"
+SCREEN_ON_CMD = os.environ.get("SCREEN_ON_CMD", "")
+SCREEN_OFF_CMD = os.environ.get("SCREEN_OFF_CMD", "")
+BUILD_PLAYLIST_CMD = os.environ.get("BUILD_PLAYLIST_CMD", "")
+PLAYLIST_FILE = os.environ.get("PLAYLIST_FILE", "/tmp/photo_viewer_playlist.txt")
+STATE_DAY_FILE = os.environ.get("STATE_DAY_FILE", "/tmp/photo_viewer_day.txt")
+IPC_SOCKET = os.environ.get("IPC_SOCKET", "/tmp/mpv-photo-viewer.sock")
+LOG_FILE = os.environ.get("LOG_FILE", "/tmp/photo_viewer.log")
+MPV_LOG_FILE = "/tmp/mpv_photo_viewer.log"
+
+SCHEDULE_CHECK_SEC: int = 30                # How often the time windows are re-evaluated
+IDLE_CHECK_SEC: int = 15                    # Night idle check interval
+MPV_RESTART_DELAY_SEC: int = 5              # Wait before restarting an mpv that exited
+MPV_SOCKET_WAIT_SEC: int = 10               # How long a new mpv gets to create its IPC socket
+COMMAND_TIMEOUT_SEC: float = 2.0            # mpv reply timeout per command
+SWIPE_DIST: int = 100                       # Touch units a finger must travel for a swipe
+SWIPE_TIME: float = 1.0                     # Max seconds for a swipe
+TOUCH_NAME_HINTS = ("touch", "ft5406", "goodix", "ft5")
+
+logger = logging.getLogger("viewer")
+
+def setup_logging() -> None:
+	# Same format as log() in Photo-Viewer.sh, to the terminal and the shared log file
+	fmt = logging.Formatter("[%(asctime)s] %(message)s", "%Y-%m-%d %H:%M:%S")
+	for handler in (logging.StreamHandler(sys.stdout), logging.FileHandler(LOG_FILE)):
+		handler.setFormatter(fmt)
+		logger.addHandler(handler)
+	logger.setLevel(logging.INFO)
+
+# ------------------ Time windows ------------------
+def now_time() -> str:
+	return datetime.now().strftime("%H:%M")
+
+def today() -> str:
+	return datetime.now().strftime("%Y-%m-%d")
+
+def is_play_window() -> bool:
+	t = now_time()
+	if FORCE_PLAY:
+		return True
+	return t >= START_TIME and (t < STOP_TIME or DEBUG_AFTER_HOURS)
+
+def is_night() -> bool:
+	t = now_time()
+	return t >= STOP_TIME or t < START_TIME
+
+# ------------------ mpv IPC ------------------
+class MpvError(Exception):
+	pass
+
+class MpvClient:
+	"""One persistent JSON IPC connection to mpv.
+
+	command() tags each request with a request_id and waits for the matching
+	reply. Events are dispatched to callbacks registered with on(), and
+	observed properties are kept up to date in self.properties.
+	"""
+	def __init__(self, path: str):
+		self.path = path
+		self.writer: Optional[asyncio.StreamWriter] = None
+		self.pending: Dict[int, asyncio.Future] = {}
+		self.handlers: Dict[str, list] = {}
+		self.properties: dict = {}
+		self.next_id = 0
+		self.closed = asyncio.Event()
+
+	async def connect(self, observe: List[str]) -> None:
+		reader, self.writer = await asyncio.open_unix_connection(self.path)
+		self.closed.clear()
+		self.reader_task = asyncio.create_task(self.read_loop(reader))
+		for i, name in enumerate(observe, 1):
+			await self.command("observe_property", i, name)
+
+	@property
+	def connected(self) -> bool:
+		return self.writer is not None and not self.closed.is_set()
+
+	def on(self, event: str, callback) -> None:
+		self.handlers.setdefault(event, []).append(callback)
+
+	async def command(self, *args, timeout: float = COMMAND_TIMEOUT_SEC):
+		if not self.connected:
+			raise MpvError("mpv IPC not connected")
+		self.next_id += 1
+		request_id = self.next_id
+		fut = asyncio.get_running_loop().create_future()
+		self.pending[request_id] = fut
+		try:
+			self.writer.write((json.dumps({"command": list(args), "request_id": request_id}) + "\n").encode())
+			await self.writer.drain()
+			reply = await asyncio.wait_for(fut, timeout)
+		finally:
+			self.pending.pop(request_id, None)
+		if reply.get("error") != "success":
+			raise MpvError(f"{args[0]}: {reply.get('error')}")
+		return reply.get("data")
+
+	async def send(self, *args) -> bool:
+		"""command() that logs failures instead of raising."""
+		try:
+			await self.command(*args)
+			return True
+		except (MpvError, asyncio.TimeoutError, OSError) as e:
+			logger.info(f"IPC command failed: {list(args)} ({e})")
+			return False
+
+	async def read_loop(self, reader: asyncio.StreamReader) -> None:
+		try:
+			while True:
+				line = await reader.readline()
+				if not line:
+					break
+				try:
+					msg = json.loads(line)
+				except ValueError:
+					continue
+				if "request_id" in msg and "event" not in msg:
+					fut = self.pending.get(msg["request_id"])
+					if fut is not None and not fut.done():
+						fut.set_result(msg)
+					continue
+				event = msg.get("event")
+				if event == "property-change":
+					self.properties[msg.get("name")] = msg.get("data")
+				for callback in self.handlers.get(event, ()):
+					callback(msg)
+		finally:
+			self.closed.set()
+			for fut in self.pending.values():
+				if not fut.done():
+					fut.set_exception(MpvError("mpv IPC connection closed"))
+			if self.writer is not None:
+				self.writer.close()
+
+# ------------------ Controller ------------------
+class Controller:
+	def __init__(self):
+		self.mpv = MpvClient(IPC_SOCKET)
+		self.mpv_proc: Optional[asyncio.subprocess.Process] = None
+		self.screen_on: Optional[bool] = None  # unknown until first set
+		self.mode: Optional[str] = None        # "play" or "off", as last applied by the schedule
+		self.last_input = asyncio.get_event_loop().time()
+		self.touch_device = None
+		self.file_changed = asyncio.Event()
+		self.mpv.on("file-loaded", lambda _: self.file_changed.set())
+		self.mpv.on("playback-restart", lambda _: self.file_changed.set())
+
+	# ---- screen ----
+	async def run_shell(self, cmd: str) -> None:
+		if not cmd:
+			return
+		proc = await asyncio.create_subprocess_shell(cmd)
+		await proc.wait()
+
+	async def set_screen(self, on: bool) -> None:
+		if self.screen_on == on:
+			return
+		self.screen_on = on
+		await self.run_shell(SCREEN_ON_CMD if on else SCREEN_OFF_CMD)
+
+	async def wake(self) -> None:
+		self.last_input = asyncio.get_event_loop().time()
+		if self.screen_on is not True:
+			logger.info("wake_screen trigger")
+			await self.set_screen(True)
+
+	# ---- mpv ----
+	async def run_mpv(self) -> None:
+		"""Keep mpv running and connected, restarting it if it exits."""
+		while True:
+			try:
+				os.remove(IPC_SOCKET)
+			except FileNotFoundError:
+				pass
+			logger.info("Starting mpv viewer")
+			with open(MPV_LOG_FILE, "w") as out:
+				self.mpv_proc = await asyncio.create_subprocess_exec(
+					"mpv", "--idle=yes", "--force-window=yes", "--fullscreen", "--loop-playlist=inf",
+					f"--input-ipc-server={IPC_SOCKET}", f"--image-display-duration={AUTO_ADVANCE_SEC}",
+					"--keep-open=yes", "--no-terminal", "--no-resume-playback", "--cursor-autohide=no",
+					f"--playlist={PLAYLIST_FILE}", stdout=out, stderr=out,
+				)
+			logger.info(f"mpv pid={self.mpv_proc.pid}")
+			if await self.connect_mpv():
+				# Put the new instance into the state the schedule expects
+				self.mode = None
+				await self.apply_schedule()
+			await self.mpv_proc.wait()
+			logger.info(f"mpv exited with {self.mpv_proc.returncode}; restarting in {MPV_RESTART_DELAY_SEC}s")
+			await asyncio.sleep(MPV_RESTART_DELAY_SEC)
+
+	async def connect_mpv(self) -> bool:
+		loop = asyncio.get_event_loop()
+		deadline = loop.time() + MPV_SOCKET_WAIT_SEC
+		while loop.time() < deadline and self.mpv_proc.returncode is None:
+			try:
+				await self.mpv.connect(observe=["pause"])
+				return True
+			except OSError:
+				await asyncio.sleep(0.2)
+		logger.info("mpv IPC socket never came up")
+		return False
+
+	async def stop_mpv(self) -> None:
+		if self.mpv_proc is not None and self.mpv_proc.returncode is None:
+			logger.info("Stopping mpv")
+			self.mpv_proc.terminate()
+			try:
+				await asyncio.wait_for(self.mpv_proc.wait(), 5)
+			except asyncio.TimeoutError:
+				self.mpv_proc.kill()
+
+	# ---- schedule ----
+	async def build_playlist(self) -> None:
+		if not BUILD_PLAYLIST_CMD:
+			return
+		proc = await asyncio.create_subprocess_shell(BUILD_PLAYLIST_CMD)
+		if await proc.wait() != 0:
+			logger.info("Playlist build failed")
+			return
+		if self.mpv.connected:
+			await self.mpv.send("loadlist", PLAYLIST_FILE, "replace")
+
+	def playlist_built_today(self) -> bool:
+		try:
+			with open(STATE_DAY_FILE) as f:
+				return f.read().strip() == today()
+		except OSError:
+			return False
+
+	async def daily_selection(self) -> None:
+		# Rebuild once per new day from SELECT_TIME, or now if there is no playlist at all
+		if now_time() >= SELECT_TIME and not self.playlist_built_today():
+			await self.build_playlist()
+		elif not os.path.isfile(PLAYLIST_FILE) or os.path.getsize(PLAYLIST_FILE) == 0:
+			await self.build_playlist()
+
+	async def apply_schedule(self) -> None:
+		"""Switch between playing and off hours. Only transitions are applied,
+		so a swipe to the desktop is not undone by the next check."""
+		mode = "play" if is_play_window() else "off"
+		if mode == self.mode or not self.mpv.connected:
+			return
+		self.mode = mode
+		logger.info(f"Schedule: {mode}")
+		if mode == "play":
+			await self.set_screen(True)
+			await self.mpv.send("set_property", "pause", False)
+			await self.mpv.send("set_property", "fullscreen", True)
+		else:
+			await self.mpv.send("set_property", "pause", True)
+			await self.mpv.send("set_property", "fullscreen", False)
+			await self.set_screen(False)
+
+	async def schedule_loop(self) -> None:
+		while True:
+			await self.daily_selection()
+			await self.apply_schedule()
+			await asyncio.sleep(SCHEDULE_CHECK_SEC)
+
+	# ---- auto-advance ----
+	async def auto_advance_loop(self) -> None:
+		"""Advance after AUTO_ADVANCE_SEC on one item; any file change restarts the clock."""
+		while True:
+			try:
+				await asyncio.wait_for(self.file_changed.wait(), AUTO_ADVANCE_SEC)
+				self.file_changed.clear()
+				continue
+			except asyncio.TimeoutError:
+				pass
+			if not self.mpv.connected:
+				continue
+			if not DEBUG_AFTER_HOURS and not is_play_window():
+				continue
+			if self.mpv.properties.get("pause") is not True:
+				await self.mpv.send("playlist-next", "weak")
+
+	# ---- idle ----
+	async def idle_seconds(self) -> Optional[float]:
+		"""Seconds since the last touch or X input, whichever is more recent (None if neither is known)."""
+		touch = asyncio.get_event_loop().time() - self.last_input if self.touch_device is not None else None
+		x_idle = await self.x_idle_seconds()
+		if touch is None or x_idle is None:
+			return touch if x_idle is None else x_idle
+		return min(touch, x_idle)
+
+	async def x_idle_seconds(self) -> Optional[float]:
+		try:
+			proc = await asyncio.create_subprocess_exec(
+				"xprintidle", stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+			)
+		except FileNotFoundError:
+			return None
+		out, _ = await proc.communicate()
+		try:
+			return int(out.strip()) / 1000.0
+		except ValueError:
+			return None
+
+	async def idle_loop(self) -> None:
+		while True:
+			await asyncio.sleep(IDLE_CHECK_SEC)
+			if not is_night() or self.screen_on is False:
+				continue
+			idle = await self.idle_seconds()
+			if idle is None:
+				logger.info("No touchscreen and xprintidle not installed; idle detection disabled")
+				return
+			if idle >= IDLE_TIMEOUT_SEC:
+				await self.set_screen(False)
+				await self.mpv.send("set_property", "fullscreen", False)
+				await self.mpv.send("set_property", "pause", True)
+
+	# ---- gestures ----
+	async def handle_swipe(self, dx_raw: int, dy_raw: int, dt: float) -> None:
+		# Rotate touch axes by +90 degrees so physical up/down become next/prev
+		# and physical left/right control desktop toggle, matching rotated screen.
+		rot_dx = dy_raw   # physical up -> negative dy -> rot_dx negative (next)
+		rot_dy = -dx_raw  # physical left -> negative dx -> rot_dy positive (desktop)
+
+		if dt > SWIPE_TIME:
+			return
+		if abs(rot_dx) > abs(rot_dy) and abs(rot_dx) > SWIPE_DIST:
+			if rot_dx < 0:
+				logger.info(f"Swipe (phys up -> next): rot_dx={rot_dx:.0f}")
+				await self.mpv.send("playlist-next", "force")
+			else:
+				logger.info(f"Swipe (phys down -> prev): rot_dx={rot_dx:.0f}")
+				await self.mpv.send("playlist-prev")
+		elif abs(rot_dy) > abs(rot_dx) and abs(rot_dy) > SWIPE_DIST:
+			if rot_dy > 0:
+				logger.info(f"Swipe (phys left -> desktop): rot_dy={rot_dy:.0f}")
+				await self.mpv.send("set_property", "fullscreen", False)
+				await self.mpv.send("set_property", "pause", True)
+				# Best-effort minimize so desktop is reachable when paused
+				await self.run_shell("command -v xdotool >/dev/null 2>&1 && xdotool search --class mpv windowminimize 2>/dev/null")
+			else:
+				logger.info(f"Swipe (phys right -> resume): rot_dy={rot_dy:.0f}")
+				await self.mpv.send("set_property", "fullscreen", True)
+				await self.mpv.send("set_property", "pause", False)
+
+	async def gesture_loop(self) -> None:
+		try:
+			from evdev import InputDevice, list_devices, ecodes
+		except ImportError:
+			logger.info("[gesture] evdev not available; gestures disabled")
+			return
+		for path in list_devices():
+			dev = InputDevice(path)
+			if any(k in dev.name.lower() for k in TOUCH_NAME_HINTS):
+				self.touch_device = dev
+				break
+		if self.touch_device is None:
+			logger.info("[gesture] No touchscreen found; gestures disabled")
+			return
+		device = self.touch_device
+		try:
+			device.grab()
+		except OSError:
+			logger.info("[gesture] Could not grab device; continuing without exclusive access")
+		loop = asyncio.get_event_loop()
+		start_pos = None
+		last_x = last_y = None
+		try:
+			async for event in device.async_read_loop():
+				if event.type == ecodes.EV_ABS:
+					if event.code in (ecodes.ABS_MT_POSITION_X, ecodes.ABS_X):
+						last_x = event.value
+					elif event.code in (ecodes.ABS_MT_POSITION_Y, ecodes.ABS_Y):
+						last_y = event.value
+					else:
+						continue
+					if last_x is None or last_y is None:
+						continue
+					if start_pos is None:
+						start_pos = (last_x, last_y, loop.time())
+						logger.info(f"Touch at ({last_x}, {last_y})")
+						await self.wake()
+					else:
+						dx = last_x - start_pos[0]
+						dy = last_y - start_pos[1]
+						if abs(dx) > SWIPE_DIST or abs(dy) > SWIPE_DIST:
+							await self.handle_swipe(dx, dy, loop.time() - start_pos[2])
+							start_pos = None
+				elif event.type == ecodes.EV_KEY and event.code == ecodes.BTN_TOUCH:
+					where = f"at ({last_x}, {last_y})" if last_x is not None and last_y is not None else "(coords unknown)"
+					if event.value == 1:
+						logger.info(f"Tap press {where}")
+						start_pos = ((last_x or 0), (last_y or 0), loop.time())
+					elif event.value == 0:
+						logger.info(f"Tap release {where}")
+						start_pos = None
+					await self.wake()
+		finally:
+			try:
+				device.ungrab()
+			except OSError:
+				pass
+
+	# ---- lifecycle ----
+	async def supervise(self, name: str, loop_fn) -> None:
+		"""Run one of the loops, restarting it if it fails."""
+		while True:
+			try:
+				await loop_fn()
+				return
+			except asyncio.CancelledError:
+				raise
+			except Exception as e:
+				logger.info(f"{name} failed: {e!r}; restarting in {MPV_RESTART_DELAY_SEC}s")
+				await asyncio.sleep(MPV_RESTART_DELAY_SEC)
+
+	async def run(self) -> None:
+		tasks = [
+			asyncio.create_task(self.supervise(name, fn))
+			for name, fn in (
+				("mpv", self.run_mpv),
+				("schedule", self.schedule_loop),
+				("auto-advance", self.auto_advance_loop),
+				("gestures", self.gesture_loop),
+				("idle watch", self.idle_loop),
+			)
+		]
+		stop = asyncio.Event()
+		loop = asyncio.get_running_loop()
+		for sig in (signal.SIGINT, signal.SIGTERM):
+			loop.add_signal_handler(sig, stop.set)
+		try:
+			await stop.wait()
+		finally:
+			logger.info("Shutting down photo viewer")
+			for task in tasks:
+				task.cancel()
+			await asyncio.gather(*tasks, return_exceptions=True)
+			await self.stop_mpv()
+			try:
+				os.remove(IPC_SOCKET)
+			except FileNotFoundError:
+				pass
+			logger.info("Cleanup complete")
+
+async def main_async() -> None:
+	await Controller().run()
+
+def main() -> int:
+	setup_logging()
+	logger.info(f"Viewer controller PID {os.getpid()}")
+	asyncio.run(main_async())
+	return 0
+
+if __name__ == "__main__":
+	raise SystemExit(main())